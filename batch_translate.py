@@ -2,14 +2,61 @@ import argparse
 import os
 import subprocess
 import logging
+import queue
+import threading
+import time
 from sacrebleu.metrics import BLEU, CHRF
 from subword_nmt.apply_bpe import BPE
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional
+import numpy as np
 import pandas as pd
 from datetime import datetime
+from corpus_store import read_lengths, read_lines
+from translation_cache import TranslationCache
+from instrumentation import Tracer
+from translator_backends import OpenNMTBackend, TranslatorBackend, add_backend_arguments, backend_from_args
+from metric_stats import SentenceStats, StreamingScorer
+from sentence_store import SentenceStore
+from vocab_check import VocabCheckError, precheck
+from nbest_rerank import DEFAULT_WEIGHTS, parse_nbest, candidate_lengths, rerank, select
+from length_batching import (fixed_size_batches, token_budget_batches,
+                             padding_efficiency, sort_lines)
+
+def pareto_frontier(results: pd.DataFrame,
+                    quality: str = 'bleu',
+                    speed: str = 'sents_per_sec') -> pd.DataFrame:
+    """
+    Cells that no other cell beats on both quality and speed.
+
+    Args:
+        results: One row per sweep cell
+        quality: Column to maximize, e.g. 'bleu'
+        speed: Throughput column to maximize, e.g. 'sents_per_sec'
+
+    Returns:
+        The frontier rows, fastest first
+    """
+    ordered = results.sort_values([speed, quality], ascending=[False, False])
+    keep = []
+    best_quality = -np.inf
+    for index, row in ordered.iterrows():
+        # A slower cell is only worth it if it is strictly better
+        if row[quality] > best_quality:
+            keep.append(index)
+            best_quality = row[quality]
+    return ordered.loc[keep]
+
 
 class BatchTranslator:
-    def __init__(self, project_dir: str):
+    def __init__(self,
+                 project_dir: str,
+                 cache_path: Optional[str] = None,
+                 cache_max_mb: float = 512,
+                 rerank_weights: Optional[Dict[str, float]] = None,
+                 qe_evaluator=None,
+                 qe_cache: Optional[str] = None,
+                 tracer: Optional[Tracer] = None,
+                 backend: Optional[TranslatorBackend] = None):
         self.project_dir = project_dir
         self.model_dir = os.path.join(project_dir, "onmt_data/onmt_model")
         
@@ -27,84 +74,714 @@ class BatchTranslator:
         # Results storage
         self.results = []
 
+        # Timing of the most recent decode
+        self.decode_stats = {}
+
+        # Decoder (onmt_translate by default) and its CPU threads, None keeps the default
+        self.backend = backend or OpenNMTBackend()
+        self.decode_threads = None
+
+        # Optional translation memory shared across runs; the key has no batching or
+        # threads, so cells that only profile those settings skip the lookups
+        self.cache = TranslationCache(cache_path, cache_max_mb) if cache_path else None
+        self.cache_lookups = True
+        self.profiling_cells = set()
+
+        # 'average' or 'ensemble' for the models built by the sweep, other models are single checkpoints
+        self.model_types = {}
+
+        # n-best reranking: feature weights and an optional evaluation.eval used for COMET-QE
+        self.rerank_weights = {**DEFAULT_WEIGHTS, **(rerank_weights or {})}
+        self.qe_evaluator = qe_evaluator
+        self.qe_cache = qe_cache
+
+        # Hypotheses, statistics and scores of every sentence of the current sweep
+        self.sentence_store = None
+        self.sentence_lengths = ([], [])
+
+        # Time, memory and line counts of every stage
+        self.tracer = tracer or Tracer(enabled=False)
+
     def get_checkpoints(self) -> List[str]:
         """Get all model checkpoints"""
         checkpoints = [f for f in os.listdir(self.model_dir) 
                       if f.startswith("model_step_") and f.endswith(".pt")]
         return sorted(checkpoints, key=lambda x: int(x.split("_")[2].split(".")[0]))
 
+    def _model_paths(self, checkpoint: str) -> List[str]:
+        """Resolve a checkpoint name, path or '+'-joined ensemble to model file paths"""
+        return [c if os.path.dirname(c) else os.path.join(self.model_dir, c)
+                for c in checkpoint.split('+')]
+
+    @staticmethod
+    def _checkpoint_step(checkpoint: str) -> int:
+        """Training step of a checkpoint (the last member for ensembles)"""
+        return int(os.path.basename(checkpoint.split('+')[-1]).split('_')[2].split('.')[0])
+
+    @staticmethod
+    def _checkpoint_label(checkpoint: str) -> str:
+        """Short label used in output file names, e.g. step6500, step6500_avg3, step6500_ens3"""
+        members = checkpoint.split('+')
+        name = os.path.basename(members[-1])[:-len('.pt')]
+        label = name.replace('model_', '', 1).replace('_', '', 1)
+        if len(members) > 1:
+            label += f"_ens{len(members)}"
+        return label
+
+    @staticmethod
+    def _load_checkpoint(path: str):
+        """Load a checkpoint on CPU, memory-mapped where the installed torch supports it"""
+        import torch  # only needed when averaging checkpoints
+        try:
+            return torch.load(path, map_location='cpu', mmap=True)
+        except (TypeError, RuntimeError):
+            # torch < 2.1, or a checkpoint saved in the legacy (non-zip) format
+            return torch.load(path, map_location='cpu')
+
+    def average_checkpoints(self, checkpoints: List[str], output_path: str) -> str:
+        """Average the parameters of several checkpoints into a single model.
+
+        Checkpoints are loaded one at a time and added parameter by parameter
+        into a running sum, so at most the sum and one checkpoint are in memory.
+        Vocab and options are taken from the first checkpoint and the optimizer
+        state is dropped, as in onmt_average_models.
+        """
+        import torch  # only needed when averaging checkpoints
+
+        sums = None
+        dtypes = {}
+        for i, checkpoint in enumerate(checkpoints):
+            state = self._load_checkpoint(self._model_paths(checkpoint)[0])
+            if sums is None:
+                sums = {'model': {}, 'generator': {}}
+                extra = {'vocab': state['vocab'], 'opt': state['opt'], 'optim': None}
+                for part in sums:
+                    for name, param in state[part].items():
+                        dtypes[(part, name)] = param.dtype
+                        sums[part][name] = param.detach().float().clone()
+            else:
+                for part in sums:
+                    for name, param in state[part].items():
+                        sums[part][name].add_(param.detach().float())
+            del state
+
+        for part in sums:
+            for name, total in sums[part].items():
+                sums[part][name] = total.div_(len(checkpoints)).to(dtypes[(part, name)])
+
+        torch.save({**extra, **sums}, output_path)
+        self.logger.info(f"Averaged {len(checkpoints)} checkpoints into {output_path}")
+        return output_path
+
+    def build_averaged_checkpoints(self,
+                                   checkpoints: List[str],
+                                   window: int,
+                                   count: int,
+                                   output_dir: str) -> List[str]:
+        """Average sliding windows of `window` consecutive checkpoints.
+
+        The last `count` windows are built, each ending at one of the most recent
+        checkpoints. Returns the paths of the averaged models.
+        """
+        averaged_dir = os.path.join(output_dir, "averaged")
+        os.makedirs(averaged_dir, exist_ok=True)
+        averaged = []
+        first_end = max(window, len(checkpoints) - count + 1)
+        for end in range(first_end, len(checkpoints) + 1):
+            members = checkpoints[end - window:end]
+            output_path = os.path.join(
+                averaged_dir, f"model_step_{self._checkpoint_step(members[-1])}_avg{window}.pt")
+            with self.tracer.stage('average_checkpoints', checkpoints=len(members)):
+                averaged.append(self.average_checkpoints(members, output_path))
+        return averaged
+
     def apply_bpe(self, test_file: str, bpe_codes: str, output_file: str):
         """Apply BPE encoding to test data"""
         with open(bpe_codes, 'r', encoding='utf-8') as codes_file:
             bpe = BPE(codes_file)
             
-        with open(test_file, 'r', encoding='utf-8') as infile, \
+        with self.tracer.stage('apply_bpe') as stage, \
+             open(test_file, 'r', encoding='utf-8') as infile, \
              open(output_file, 'w', encoding='utf-8') as outfile:
             for line in infile:
                 encoded_line = bpe.process_line(line.strip())
                 outfile.write(encoded_line + '\n')
+                stage.add(lines=1, tokens=len(encoded_line.split()))
+
+    def _decode(self,
+                model_path,
+                src_lines: List[str],
+                beam_size: int,
+                batch_size: int,
+                batch_type: str,
+                on_line: Optional[Callable[[int, str], None]] = None,
+                n_best: int = 1) -> List[str]:
+        """Decode BPE lines with the translator backend and return the hypotheses in input order.
+
+        Every line is handed to on_line (with its index in src_lines) as soon
+        as the backend yields it. model_path may be a list of checkpoints,
+        which are decoded as an ensemble in a single pass. With n_best > 1 the
+        entry of a sentence is its n_best "hypothesis<TAB>score" lines joined
+        by newlines.
+        """
+        model_paths = model_path if isinstance(model_path, list) else [model_path]
+        order = None
+        if batch_type == "tokens":
+            src_lines, order = sort_lines(src_lines)
+
+        hypotheses = [None] * len(src_lines)
+        group = []
+        target_tokens = 0
+        # on_line time (de-BPE, scoring) is not decoding, so it is left out of decode_time
+        callback_start = self.decode_stats['callback_time']
+        start_time = time.perf_counter()
+        output = self.backend.translate(model_paths, src_lines, beam_size, batch_size, batch_type,
+                                        n_best, self.decode_threads)
+        for i, line in enumerate(output):
+            group.append(line)
+            target_tokens += len(line.split('\t')[0].split())
+            if len(group) < n_best:
+                continue
+            sentence = i // n_best
+            index = int(order[sentence]) if order is not None else sentence
+            hypotheses[index] = '\n'.join(group)
+            group = []
+            if on_line is not None:
+                on_line(index, hypotheses[index])
+        if any(hypothesis is None for hypothesis in hypotheses):
+            raise RuntimeError(f"{self.backend.name} backend returned too few lines for {len(src_lines)} sentences")
+        self.decode_stats['decode_time'] += (time.perf_counter() - start_time
+                                             - (self.decode_stats['callback_time'] - callback_start))
+        self.decode_stats['decoded_sentences'] += len(src_lines)
+        self.decode_stats['target_tokens'] += target_tokens
+        self.decode_stats['peak_rss_mb'] = max(self.decode_stats['peak_rss_mb'], self.backend.peak_rss / 2 ** 20)
+
+        return hypotheses
+
+    def _translate_lines(self,
+                         checkpoint: str,
+                         src_lines: List[str],
+                         beam_size: int,
+                         batch_size: int,
+                         batch_type: str,
+                         on_line: Optional[Callable[[int, str], None]] = None,
+                         n_best: int = 1) -> List[str]:
+        """Translate source lines through the cache (if any), reporting every
+        hypothesis to on_line with its index in src_lines as it becomes available"""
+        model_path = self._model_paths(checkpoint)
+        self.decode_stats = {'decode_time': 0.0, 'decoded_sentences': 0,
+                             'target_tokens': 0, 'peak_rss_mb': 0.0, 'callback_time': 0.0}
+        if on_line is not None:
+            report_line = on_line
+
+            def on_line(index: int, hypothesis: str) -> None:
+                start = time.perf_counter()
+                report_line(index, hypothesis)
+                self.decode_stats['callback_time'] += time.perf_counter() - start
+
+        cache_hits = self.cache.hits if self.cache is not None else 0
+        with self.tracer.stage('translate', lines=len(src_lines),
+                               tokens=sum(len(line.split()) for line in src_lines)) as stage:
+            if self.cache is None or not self.cache_lookups:
+                hypotheses = self._decode(model_path, src_lines, beam_size, batch_size,
+                                          batch_type, on_line, n_best)
+            else:
+                positions = {}
+                for i, line in enumerate(src_lines):
+                    positions.setdefault(line, []).append(i)
+
+                def decode(lines: List[str]) -> List[str]:
+                    def on_decoded(j: int, hypothesis: str) -> None:
+                        for i in positions[lines[j]]:
+                            on_line(i, hypothesis)
+                    return self._decode(model_path, lines, beam_size, batch_size, batch_type,
+                                        on_decoded if on_line is not None else None, n_best)
+
+                options = {'beam_size': beam_size, **self.backend.cache_options}
+                if n_best > 1:
+                    options['n_best'] = n_best
+                hypotheses = self.cache.translate(model_path, options, src_lines, decode, on_hit=on_line)
+            stage.add(decoded=self.decode_stats['decoded_sentences'])
+            # The streaming work is traced as its own stages by the caller
+            stage.exclude(self.decode_stats['callback_time'])
+
+        decode_time = self.decode_stats['decode_time']
+        decoded = self.decode_stats['decoded_sentences']
+        # Sentences served from the cache make the throughput meaningless
+        measured = decode_time > 0 and (self.cache is None or self.cache.hits == cache_hits)
+        self.decode_stats['measured'] = measured
+        self.decode_stats['sents_per_sec'] = decoded / decode_time if measured else None
+        self.decode_stats['tokens_per_sec'] = self.decode_stats['target_tokens'] / decode_time if measured else None
+        if measured:
+            self.logger.info(f"Decoded {decoded} of {len(src_lines)} sentences in {decode_time:.2f}s "
+                             f"({self.decode_stats['sents_per_sec']:.1f} sentences/sec, "
+                             f"{self.decode_stats['tokens_per_sec']:.1f} target tokens/sec, "
+                             f"decoder peak memory {self.decode_stats['peak_rss_mb']:.1f} MB)")
+        else:
+            self.logger.info(f"Decoded {decoded} of {len(src_lines)} sentences in {decode_time:.2f}s, "
+                             f"the rest came from the cache: throughput not measured")
+        return hypotheses
 
     def translate(self, 
                  checkpoint: str, 
                  src_file: str, 
                  output_file: str,
                  beam_size: int = 5,
-                 batch_size: int = 32) -> str:
-        """Run translation with specific checkpoint and parameters"""
-        model_path = os.path.join(self.model_dir, checkpoint)
-        
-        cmd = [
-            "onmt_translate",
-            "-model", model_path,
-            "-src", src_file,
-            "-output", output_file,
-            "-gpu", "0",
-            "-batch_size", str(batch_size),
-            "-beam_size", str(beam_size),
-            "-replace_unk"
-        ]
-        
+                 batch_size: int = 32,
+                 batch_type: str = "sents") -> str:
+        """Run translation with specific checkpoint and parameters.
+
+        With batch_type "tokens", batch_size is a token budget: the source is
+        sorted by length before decoding and the output is restored to the
+        original order afterwards. If a translation cache is configured, only
+        source lines not decoded before with the same checkpoint and beam size
+        are sent to the translator backend.
+        """
         try:
-            subprocess.run(cmd, check=True, capture_output=True, text=True)
-            return output_file
+            hypotheses = self._translate_lines(checkpoint, read_lines(src_file),
+                                               beam_size, batch_size, batch_type)
         except subprocess.CalledProcessError as e:
             self.logger.error(f"Translation failed for {checkpoint}: {e}")
             return None
 
+        with open(output_file, 'w', encoding='utf-8') as f:
+            for line in hypotheses:
+                f.write(line + '\n')
+        return output_file
+
+    def translate_and_score(self,
+                            checkpoint: str,
+                            src_file: str,
+                            output_file: str,
+                            references: List[str],
+                            beam_size: int = 5,
+                            batch_size: int = 32,
+                            batch_type: str = "sents") -> Optional[Dict[str, object]]:
+        """Translate, remove BPE and score in one streaming pass.
+
+        Each decoded line is de-segmented and added to the BLEU/chrF statistics
+        as it arrives, so the scores are ready when decoding finishes. The BPE
+        output and the de-BPE'd copy (output_file without '.bpe.') are written
+        as side outputs only.
+        """
+        scorer = StreamingScorer({'bleu': self.bleu, 'chrf': self.chrf}, references)
+        clean_hypotheses = [None] * len(references)
+        # Seconds spent on de-BPE and scoring, interleaved with decoding
+        stage_time = {'remove_bpe': 0.0, 'metrics': 0.0}
+
+        def on_line(index: int, hypothesis: str) -> None:
+            start = time.perf_counter()
+            clean_hypotheses[index] = hypothesis.replace('@@ ', '')
+            middle = time.perf_counter()
+            scorer.add(index, clean_hypotheses[index])
+            stage_time['remove_bpe'] += middle - start
+            stage_time['metrics'] += time.perf_counter() - middle
+
+        try:
+            hypotheses = self._translate_lines(checkpoint, read_lines(src_file),
+                                               beam_size, batch_size, batch_type, on_line)
+        except subprocess.CalledProcessError as e:
+            self.logger.error(f"Translation failed for {checkpoint}: {e}")
+            return None
+        for name, seconds in stage_time.items():
+            self.tracer.record(name, seconds, lines=len(references))
+
+        clean_file = output_file.replace('.bpe.', '.')
+        for path, lines in ((output_file, hypotheses), (clean_file, clean_hypotheses)):
+            with open(path, 'w', encoding='utf-8') as f:
+                for line in lines:
+                    f.write(line + '\n')
+
+        sentences = {'hypotheses': clean_hypotheses,
+                     'stats': {name: scorer.sentence_stats(name) for name in scorer.metrics}}
+        return {'output_file': clean_file, 'sentences': sentences, **scorer.score()}
+
+    def score_hypotheses(self,
+                         hypotheses: List[str],
+                         output_file: str,
+                         references: List[str]) -> Dict[str, object]:
+        """Remove BPE from decoded hypotheses, write both versions and score them.
+
+        The counterpart of translate_and_score for hypotheses decoded beforehand,
+        e.g. by the decoder thread of the sweep pipeline.
+        """
+        with self.tracer.stage('remove_bpe', lines=len(hypotheses)):
+            clean_hypotheses = [line.replace('@@ ', '') for line in hypotheses]
+        clean_file = output_file.replace('.bpe.', '.')
+        for path, lines in ((output_file, hypotheses), (clean_file, clean_hypotheses)):
+            with open(path, 'w', encoding='utf-8') as f:
+                for line in lines:
+                    f.write(line + '\n')
+        with self.tracer.stage('metrics', lines=len(clean_hypotheses)):
+            stats = SentenceStats(clean_hypotheses, references, ('bleu', 'chrf'))
+            scores = stats.scores()
+        sentences = {'hypotheses': clean_hypotheses, 'stats': stats.stats}
+        return {'output_file': clean_file, 'sentences': sentences, **scores}
+
+    def translate_and_rerank(self,
+                             checkpoint: str,
+                             src_file: str,
+                             output_file: str,
+                             references: List[str],
+                             n_best: int,
+                             beam_size: int = 5,
+                             batch_size: int = 32,
+                             batch_type: str = "sents") -> Optional[Dict[str, object]]:
+        """Decode n-best lists, rerank them and score the reranked 1-best.
+
+        All candidates are reranked together in vectorized form (and QE-scored
+        in one batch if a QE evaluator is set). The raw n-best list is written
+        to output_file and the reranked, de-BPE'd 1-best to output_file without
+        '.bpe.'. Timings of every stage are returned with the scores.
+        """
+        src_lines = read_lines(src_file)
+
+        start_time = time.perf_counter()
+        try:
+            grouped = self._translate_lines(checkpoint, src_lines, beam_size,
+                                            batch_size, batch_type, n_best=n_best)
+        except subprocess.CalledProcessError as e:
+            self.logger.error(f"Translation failed for {checkpoint}: {e}")
+            return None
+        return self.rerank_and_score(src_lines, grouped, output_file, references, n_best,
+                                     time.perf_counter() - start_time)
+
+    def rerank_and_score(self,
+                         src_lines: List[str],
+                         grouped: List[str],
+                         output_file: str,
+                         references: List[str],
+                         n_best: int,
+                         decode_time: float = 0.0) -> Dict[str, object]:
+        """Rerank decoded n-best lists and score the reranked 1-best (see translate_and_rerank)."""
+        timings = {'time_decode': decode_time}
+
+        with self.tracer.stage('remove_bpe', lines=len(grouped) * n_best) as stage:
+            candidates, model_scores = parse_nbest(grouped, n_best)
+            candidates = [[c.replace('@@ ', '') for c in sentence] for sentence in candidates]
+            src_clean = [line.replace('@@ ', '') for line in src_lines]
+        timings['time_parse'] = stage.duration
+
+        qe_scores = None
+        with self.tracer.stage('comet_qe', lines=len(grouped) * n_best) as stage:
+            if self.qe_evaluator is not None and self.rerank_weights.get('qe'):
+                flat_qe = self.qe_evaluator.qe_score_pairs(
+                    [src for src in src_clean for _ in range(n_best)],
+                    [c for sentence in candidates for c in sentence],
+                    self.qe_cache)
+                qe_scores = np.array(flat_qe, dtype=np.float64).reshape(len(candidates), n_best)
+        timings['time_qe'] = stage.duration
+
+        with self.tracer.stage('rerank', lines=len(grouped)) as stage:
+            src_lengths = np.array([len(line.split()) for line in src_clean], dtype=np.float64)
+            best = rerank(model_scores, candidate_lengths(candidates), src_lengths,
+                          qe_scores, self.rerank_weights)
+            best_hypotheses = select(candidates, best)
+        timings['time_rerank'] = stage.duration
+
+        with self.tracer.stage('metrics', lines=len(best_hypotheses)) as stage:
+            clean_file = output_file.replace('.bpe.', '.')
+            with open(output_file, 'w', encoding='utf-8') as f:
+                for group in grouped:
+                    f.write(group + '\n')
+            with open(clean_file, 'w', encoding='utf-8') as f:
+                for line in best_hypotheses:
+                    f.write(line + '\n')
+            stats = SentenceStats(best_hypotheses, references, ('bleu', 'chrf'))
+            scores = stats.scores()
+        timings['time_score'] = stage.duration
+
+        changed = float(np.mean(best != 0)) if len(best) else 0.0
+        self.logger.info(f"Reranked {len(best)} {n_best}-best lists ({changed:.1%} changed from the top candidate); "
+                         + ", ".join(f"{stage[5:]} {seconds:.2f}s" for stage, seconds in timings.items()))
+        sentences = {'hypotheses': best_hypotheses, 'stats': stats.stats}
+        return {'output_file': clean_file, 'reranked_changed': changed, 'sentences': sentences,
+                **scores, **timings}
+
     def remove_bpe(self, file_path: str) -> str:
         """Remove BPE tokens from translated output"""
         output_path = file_path.replace('.bpe.', '.')
-        with open(file_path, 'r', encoding='utf-8') as infile, \
+        with self.tracer.stage('remove_bpe') as stage, \
+             open(file_path, 'r', encoding='utf-8') as infile, \
              open(output_path, 'w', encoding='utf-8') as outfile:
             for line in infile:
                 line = line.replace('@@ ', '')
                 outfile.write(line)
+                stage.add(lines=1)
         return output_path
 
     def evaluate(self, 
                 hypothesis_file: str, 
                 reference_file: str) -> Dict[str, float]:
         """Calculate BLEU and chrF scores"""
-        with open(hypothesis_file, 'r', encoding='utf-8') as f:
-            hypotheses = [line.strip() for line in f]
-        with open(reference_file, 'r', encoding='utf-8') as f:
-            references = [line.strip() for line in f]
-            
-        bleu_score = self.bleu.corpus_score(hypotheses, [references])
-        chrf_score = self.chrf.corpus_score(hypotheses, [references])
-        
-        return {
-            'bleu': bleu_score.score,
-            'chrf': chrf_score.score
+        hypotheses = read_lines(hypothesis_file)
+        references = read_lines(reference_file)
+
+        with self.tracer.stage('metrics', lines=len(hypotheses)):
+            return SentenceStats(hypotheses, references, ('bleu', 'chrf')).scores()
+
+    def write_pareto_report(self,
+                            results_df: pd.DataFrame,
+                            output_dir: str,
+                            latency_budget_ms: Optional[float] = None) -> pd.DataFrame:
+        """
+        Save the quality-vs-throughput Pareto frontier as CSV and, if matplotlib
+        is installed, as a plot; report the best cell within a latency budget.
+
+        Args:
+            results_df: Sweep results from run_batch_translation
+            output_dir: Directory of translation_results.csv
+            latency_budget_ms: Maximum decode time per sentence in milliseconds
+        """
+        timed = results_df[results_df['measured'].astype(bool)]
+        if len(timed) < len(results_df):
+            self.logger.info(f"{len(results_df) - len(timed)} cell(s) used cached translations "
+                             f"and are not in the Pareto report")
+        if timed.empty:
+            # Everything came from the cache, there is no throughput to compare
+            self.logger.info("No measured cells, skipping the Pareto report")
+            return timed
+        frontier = pareto_frontier(timed)
+        frontier_file = os.path.join(output_dir, "pareto_frontier.csv")
+        frontier.to_csv(frontier_file, index=False)
+        self.logger.info(f"Pareto frontier ({len(frontier)} of {len(timed)} cells) saved to {frontier_file}")
+
+        if latency_budget_ms is not None:
+            within = timed[timed['ms_per_sentence'] <= latency_budget_ms]
+            if within.empty:
+                self.logger.info(f"No configuration decodes within {latency_budget_ms:g} ms/sentence")
+            else:
+                best = within.loc[within['bleu'].idxmax()]
+                self.logger.info(f"Best within {latency_budget_ms:g} ms/sentence: {best['checkpoint']}, "
+                                 f"beam {best['beam_size']}, batch {best['batch_size']} ({best['batch_type']}), "
+                                 f"threads {best['threads'] or 'default'}: BLEU {best['bleu']:.2f} "
+                                 f"at {best['ms_per_sentence']:.2f} ms/sentence")
+
+        try:
+            import matplotlib
+            matplotlib.use('Agg')
+            import matplotlib.pyplot as plt
+        except ImportError:
+            self.logger.info("matplotlib is not installed, skipping the Pareto plot")
+            return frontier
+
+        fig, ax = plt.subplots(figsize=(7, 5))
+        ax.scatter(timed['sents_per_sec'], timed['bleu'], color='lightgray', label='All cells')
+        ax.plot(frontier['sents_per_sec'], frontier['bleu'], 'o-', color='tab:blue', label='Pareto frontier')
+        for _, row in frontier.iterrows():
+            ax.annotate(f"b{row['beam_size']}/{row['batch_size']}{row['batch_type'][0]}"
+                        + (f"/t{row['threads']:g}" if pd.notna(row['threads']) else ""),
+                        (row['sents_per_sec'], row['bleu']), fontsize=7,
+                        textcoords='offset points', xytext=(3, 3))
+        if latency_budget_ms is not None:
+            ax.axvline(1000 / latency_budget_ms, color='tab:red', linestyle='--',
+                       label=f'{latency_budget_ms:g} ms/sentence')
+        ax.set_xlabel('Sentences per second')
+        ax.set_ylabel('BLEU')
+        ax.legend()
+        fig.tight_layout()
+        plot_file = os.path.join(output_dir, "pareto_frontier.png")
+        fig.savefig(plot_file, dpi=150)
+        plt.close(fig)
+        self.logger.info(f"Pareto plot saved to {plot_file}")
+        return frontier
+
+    def _cell_name(self, cell: tuple) -> str:
+        """Name of a sweep cell, e.g. step6000_beam5_batch32"""
+        checkpoint, beam_size, (_, _, batch_label, _), threads = cell
+        name = f"{self._checkpoint_label(checkpoint)}_beam{beam_size}_{batch_label}"
+        return f"{name}_thr{threads}" if threads else name
+
+    def _cell_output(self, cell: tuple, output_dir: str) -> str:
+        """Log the start of a sweep cell and return its BPE output path"""
+        checkpoint, beam_size, (batch_type, batch_size, _, _), threads = cell
+        self.logger.info(f"Translating with checkpoint {checkpoint}, "
+                       f"beam_size={beam_size}, batch_size={batch_size}, batch_type={batch_type}"
+                       + (f", threads={threads}" if threads else ""))
+        return os.path.join(output_dir, f"trans_{self._cell_name(cell)}.bpe.txt")
+
+    def _store_result(self,
+                      cell: tuple,
+                      scores: Optional[Dict[str, object]],
+                      wall_time: float,
+                      decode_stats: Dict[str, float],
+                      n_best: int) -> None:
+        """Add the result row of a finished sweep cell and its sentences to the sentence store"""
+        if not scores:
+            return
+        checkpoint, beam_size, (batch_type, batch_size, _, efficiency), threads = cell
+        if self.sentence_store is not None:
+            self.sentence_store.add_cell(self._cell_name(cell), scores['sentences']['hypotheses'],
+                                         scores['sentences']['stats'], *self.sentence_lengths)
+        result = {
+            'cell': self._cell_name(cell),
+            'checkpoint': checkpoint,
+            'step': self._checkpoint_step(checkpoint),
+            'model_type': self.model_types.get(checkpoint, 'single'),
+            'beam_size': beam_size,
+            'batch_size': batch_size,
+            'batch_type': batch_type,
+            'padding_efficiency': efficiency,
+            'threads': threads,
+            'wall_time': wall_time,
+            'decode_time': decode_stats['decode_time'],
+            'measured': decode_stats['measured'],
+            'sents_per_sec': decode_stats['sents_per_sec'],
+            'tokens_per_sec': decode_stats['tokens_per_sec'],
+            'ms_per_sentence': 1000 / decode_stats['sents_per_sec'] if decode_stats['measured'] else None,
+            'decoder_peak_rss_mb': decode_stats['peak_rss_mb'],
+            'bleu': scores['bleu'],
+            'chrf': scores['chrf'],
+            'output_file': scores['output_file']
         }
+        if n_best > 1:
+            result['n_best'] = min(n_best, beam_size)
+            result.update({key: value for key, value in scores.items()
+                           if key.startswith('time_') or key == 'reranked_changed'})
+        self.results.append(result)
+
+    def _run_cell(self,
+                  cell: tuple,
+                  bpe_test: str,
+                  references: List[str],
+                  output_dir: str,
+                  n_best: int) -> None:
+        """Translate and score one sweep cell, streaming each line into the scorer"""
+        checkpoint, beam_size, (batch_type, batch_size, _, _), threads = cell
+        output_bpe = self._cell_output(cell, output_dir)
+        self.decode_threads = threads
+        self.cache_lookups = cell not in self.profiling_cells
+        cell_start = time.perf_counter()
+        if n_best > 1:
+            # Decode n-best lists and rerank them
+            scores = self.translate_and_rerank(checkpoint, bpe_test, output_bpe, references,
+                                               min(n_best, beam_size), beam_size,
+                                               batch_size, batch_type)
+        else:
+            # Translate, remove BPE and score in one streaming pass
+            scores = self.translate_and_score(checkpoint, bpe_test, output_bpe, references,
+                                              beam_size, batch_size, batch_type)
+        self._store_result(cell, scores, time.perf_counter() - cell_start, self.decode_stats, n_best)
+
+    def _run_pipeline(self,
+                      cells: List[tuple],
+                      bpe_test: str,
+                      references: List[str],
+                      output_dir: str,
+                      n_best: int,
+                      depth: int) -> None:
+        """Decode sweep cell i+1 while cell i is de-BPE'd, reranked and scored.
+
+        A decoder thread runs the cells one after another and hands the raw
+        hypotheses to this thread through a queue of at most `depth` decoded
+        cells, so decoding pauses when scoring falls behind. A cell's wall_time
+        is its decoding plus its scoring time.
+        """
+        src_lines = read_lines(bpe_test)
+        decoded = queue.Queue(maxsize=depth)
+        stop = threading.Event()
+
+        def put(item) -> bool:
+            # Give up once the consumer has stopped, instead of blocking forever
+            while not stop.is_set():
+                try:
+                    decoded.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def decode_cells() -> None:
+            try:
+                for cell in cells:
+                    checkpoint, beam_size, (batch_type, batch_size, _, _), threads = cell
+                    output_bpe = self._cell_output(cell, output_dir)
+                    self.decode_threads = threads
+                    self.cache_lookups = cell not in self.profiling_cells
+                    start = time.perf_counter()
+                    try:
+                        hypotheses = self._translate_lines(checkpoint, src_lines, beam_size, batch_size,
+                                                           batch_type, n_best=min(n_best, beam_size))
+                    except subprocess.CalledProcessError as e:
+                        self.logger.error(f"Translation failed for {checkpoint}: {e}")
+                        hypotheses = None
+                    if not put((cell, output_bpe, hypotheses, dict(self.decode_stats),
+                                time.perf_counter() - start)):
+                        return
+            except BaseException as e:
+                put(e)
+            finally:
+                put(None)
+
+        decoder = threading.Thread(target=decode_cells, name="decoder", daemon=True)
+        decoder.start()
+        try:
+            while True:
+                item = decoded.get()
+                if item is None:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                cell, output_bpe, hypotheses, decode_stats, decode_wall = item
+                if hypotheses is None:
+                    continue
+                start = time.perf_counter()
+                if n_best > 1:
+                    scores = self.rerank_and_score(src_lines, hypotheses, output_bpe, references,
+                                                   min(n_best, cell[1]), decode_wall)
+                else:
+                    scores = self.score_hypotheses(hypotheses, output_bpe, references)
+                self._store_result(cell, scores, decode_wall + time.perf_counter() - start,
+                                   decode_stats, n_best)
+        finally:
+            stop.set()
+            decoder.join()
 
     def run_batch_translation(self, 
                             test_src: str,
                             test_ref: str,
                             bpe_codes: str,
                             beam_sizes: List[int] = [5],
-                            batch_sizes: List[int] = [32]):
-        """Run translations with different checkpoints and parameters"""
+                            batch_sizes: List[int] = [32],
+                            token_budgets: List[int] = [],
+                            average_window: int = 0,
+                            average_count: int = 1,
+                            ensemble_size: int = 0,
+                            n_best: int = 1,
+                            thread_counts: List[Optional[int]] = [None],
+                            latency_budget_ms: Optional[float] = None,
+                            pipeline_depth: int = 2,
+                            src_vocab: Optional[str] = None,
+                            tgt_vocab: Optional[str] = None,
+                            vocab_check: bool = True):
+        """Run translations with different checkpoints and parameters.
+
+        batch_sizes are fixed sentence counts in file order; token_budgets are
+        additional cells that decode length-sorted input in token-budget batches.
+        average_window > 0 adds averaged models over the last average_count
+        sliding windows of checkpoints; ensemble_size > 0 adds one cell that
+        decodes the last ensemble_size checkpoints as an ensemble. With
+        n_best > 1 every cell decodes n-best lists and scores the reranked 1-best.
+        thread_counts adds a sweep over decoder CPU threads (None keeps the default).
+
+        With pipeline_depth > 0 a decoder thread decodes the next cells while
+        the finished ones are de-BPE'd and scored, with at most pipeline_depth
+        decoded cells waiting; 0 runs the cells one by one.
+
+        Every cell records its wall time, decode speed (sentences and target
+        tokens per second) and the decoder's peak memory. The cells on the
+        quality/speed Pareto frontier are saved to pareto_frontier.csv (and
+        plotted if matplotlib is installed); with latency_budget_ms the best
+        cell within that many milliseconds per sentence is reported.
+
+        Unless vocab_check is False, the encoded test set is checked against
+        the codes and src_vocab (and tgt_vocab, to catch a wrong language)
+        first, and VocabCheckError is raised before anything is decoded.
+
+        The hypotheses, sentence statistics and sentence scores of all cells
+        are saved as a SentenceStore (sentences.parquet) next to
+        translation_results.csv, whose 'cell' column names each cell in it.
+        """
         # Create output directory
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         output_dir = os.path.join(self.project_dir, f"translations_{timestamp}")
@@ -113,41 +790,65 @@ class BatchTranslator:
         # Apply BPE to test data
         bpe_test = os.path.join(output_dir, "test.bpe.ach")
         self.apply_bpe(test_src, bpe_codes, bpe_test)
+        if vocab_check:
+            with self.tracer.stage('vocab_check'):
+                precheck(bpe_test, bpe_codes, src_vocab, tgt_vocab, encoded=True, log=self.logger.info)
+
+        # Padding efficiency of every batching setting on this test set
+        lengths = read_lengths(bpe_test)
+        batch_settings = []
+        for batch_size in batch_sizes:
+            efficiency = padding_efficiency(lengths, fixed_size_batches(len(lengths), batch_size))
+            batch_settings.append(("sents", batch_size, f"batch{batch_size}", efficiency))
+        for max_tokens in token_budgets:
+            efficiency = padding_efficiency(lengths, token_budget_batches(lengths, max_tokens)[1])
+            batch_settings.append(("tokens", max_tokens, f"tok{max_tokens}", efficiency))
+        for batch_type, batch_size, _, efficiency in batch_settings:
+            self.logger.info(f"Padding efficiency with batch_type={batch_type}, "
+                             f"batch_size={batch_size}: {efficiency:.2%}")
         
+        references = read_lines(test_ref)
+        self.sentence_store = SentenceStore()
+        self.sentence_lengths = (read_lengths(test_src), read_lengths(test_ref))
+
         # Get all checkpoints
         checkpoints = self.get_checkpoints()
+        models = list(checkpoints)
+        if average_window > 0 and len(checkpoints) >= average_window:
+            averaged = self.build_averaged_checkpoints(checkpoints, average_window, average_count, output_dir)
+            self.model_types.update(dict.fromkeys(averaged, 'average'))
+            models += averaged
+        if ensemble_size > 1 and len(checkpoints) >= ensemble_size:
+            ensemble = '+'.join(checkpoints[-ensemble_size:])
+            self.model_types[ensemble] = 'ensemble'
+            models.append(ensemble)
         
         # Run translations with different parameters
-        for checkpoint in checkpoints:
-            for beam_size in beam_sizes:
-                for batch_size in batch_sizes:
-                    self.logger.info(f"Translating with checkpoint {checkpoint}, "
-                                   f"beam_size={beam_size}, batch_size={batch_size}")
-                    
-                    # Generate output path
-                    output_base = f"trans_step{checkpoint.split('_')[2].split('.')[0]}_beam{beam_size}_batch{batch_size}"
-                    output_bpe = os.path.join(output_dir, f"{output_base}.bpe.txt")
-                    
-                    # Translate
-                    if self.translate(checkpoint, bpe_test, output_bpe, beam_size, batch_size):
-                        # Remove BPE
-                        output_clean = self.remove_bpe(output_bpe)
-                        
-                        # Evaluate
-                        scores = self.evaluate(output_clean, test_ref)
-                        
-                        # Store results
-                        result = {
-                            'checkpoint': checkpoint,
-                            'step': int(checkpoint.split('_')[2].split('.')[0]),
-                            'beam_size': beam_size,
-                            'batch_size': batch_size,
-                            'bleu': scores['bleu'],
-                            'chrf': scores['chrf'],
-                            'output_file': output_clean
-                        }
-                        self.results.append(result)
+        cells = [(checkpoint, beam_size, batch_setting, threads)
+                 for checkpoint in models
+                 for beam_size in beam_sizes
+                 for batch_setting in batch_settings
+                 for threads in thread_counts]
+        # Other batch settings and thread counts only change the speed: decode them for real
+        self.profiling_cells = {cell for cell in cells
+                                if cell[2] != batch_settings[0] or cell[3] != thread_counts[0]}
+        first_result = len(self.results)
+        sweep_start = time.perf_counter()
+        if pipeline_depth > 0:
+            self._run_pipeline(cells, bpe_test, references, output_dir, n_best, pipeline_depth)
+        else:
+            for cell in cells:
+                self._run_cell(cell, bpe_test, references, output_dir, n_best)
+        sweep_time = time.perf_counter() - sweep_start
+        decode_time = sum(result['decode_time'] for result in self.results[first_result:])
+        self.logger.info(f"Swept {len(cells)} cells in {sweep_time:.2f}s "
+                         f"({decode_time:.2f}s of it decoding)")
         
+        if self.cache is not None:
+            cache_report = self.cache.report()
+            self.logger.info(f"Translation cache: {cache_report['hits']} hits, {cache_report['misses']} misses "
+                             f"(hit rate {cache_report['hit_rate']:.2%}), {cache_report['evicted']} evicted")
+
         # Create results summary
         results_df = pd.DataFrame(self.results)
         results_df = results_df.sort_values('bleu', ascending=False)
@@ -155,6 +856,9 @@ class BatchTranslator:
         # Save results
         results_file = os.path.join(output_dir, "translation_results.csv")
         results_df.to_csv(results_file, index=False)
+        store_file = self.sentence_store.save(output_dir)
+        self.logger.info(f"Per-sentence results saved to {store_file}")
+        self.write_pareto_report(results_df, output_dir, latency_budget_ms)
         
         # Print best results
         best_result = results_df.iloc[0]
@@ -162,7 +866,9 @@ class BatchTranslator:
         self.logger.info(f"Checkpoint: {best_result['checkpoint']}")
         self.logger.info(f"Step: {best_result['step']}")
         self.logger.info(f"Beam size: {best_result['beam_size']}")
-        self.logger.info(f"Batch size: {best_result['batch_size']}")
+        self.logger.info(f"Batch size: {best_result['batch_size']} ({best_result['batch_type']})")
+        if best_result['threads']:
+            self.logger.info(f"Threads: {best_result['threads']:g}")
         self.logger.info(f"BLEU score: {best_result['bleu']:.2f}")
         self.logger.info(f"chrF score: {best_result['chrf']:.2f}")
         self.logger.info(f"Output file: {best_result['output_file']}")
@@ -183,17 +889,84 @@ def main():
                        help='Beam sizes to try')
     parser.add_argument('--batch-sizes', type=int, nargs='+', default=[32],
                        help='Batch sizes to try')
+    parser.add_argument('--max-tokens', type=int, nargs='*', default=[],
+                       help='Token budgets to try with length-sorted batching')
+    parser.add_argument('--average-window', type=int, default=0,
+                       help='Also evaluate averages of this many consecutive checkpoints')
+    parser.add_argument('--average-count', type=int, default=1,
+                       help='Number of sliding averaging windows, ending at the latest checkpoints')
+    parser.add_argument('--ensemble-size', type=int, default=0,
+                       help='Also decode the latest N checkpoints as an ensemble in one pass')
+    parser.add_argument('--n-best', type=int, default=1,
+                       help='Decode n-best lists and rerank them (capped at the beam size)')
+    parser.add_argument('--rerank-weights', type=float, nargs=3, default=[1.0, 1.0, 0.0],
+                       metavar=('MODEL', 'LENGTH', 'QE'),
+                       help='Weights of model score, length penalty and QE score for reranking')
+    parser.add_argument('--rerank-qe-model', default=None,
+                       help='COMET-QE model for reranking, e.g. Unbabel/wmt20-comet-qe-da')
+    parser.add_argument('--qe-cache', default=None,
+                       help='Cache file for QE scores used in reranking')
+    parser.add_argument('--cache', default=None,
+                       help='Translation cache file; previously decoded source lines are reused')
+    parser.add_argument('--cache-max-mb', type=float, default=512,
+                       help='Size limit of the translation cache in MB')
+    parser.add_argument('--threads', type=int, nargs='+', default=[None],
+                       help='Decoder CPU thread counts to try (OMP_NUM_THREADS)')
+    parser.add_argument('--latency-budget', type=float, default=None,
+                       help='Report the best configuration decoding within this many ms per sentence')
+    parser.add_argument('--src-vocab', default=None,
+                       help='OpenNMT source vocab; the encoded test set is checked against it before decoding')
+    parser.add_argument('--tgt-vocab', default=None,
+                       help='OpenNMT target vocab, used to detect a test set in the wrong language')
+    parser.add_argument('--skip-vocab-check', action='store_true',
+                       help='Decode without checking BPE/vocabulary coverage first')
+    parser.add_argument('--pipeline-depth', type=int, default=2,
+                       help='Decoded cells that may wait for scoring while the next ones decode (0 runs cells one by one)')
+    parser.add_argument('--trace', default=None,
+                       help='Save a Chrome trace with the time and memory of every stage to this file')
+    add_backend_arguments(parser)
     
     args = parser.parse_args()
     
-    translator = BatchTranslator(args.project_dir)
-    results = translator.run_batch_translation(
-        args.test_src,
-        args.test_ref,
-        args.bpe_codes,
-        args.beam_sizes,
-        args.batch_sizes
-    )
+    qe_evaluator = None
+    if args.rerank_qe_model:
+        # COMET is only loaded when QE reranking is requested
+        from comet import download_model
+        from evaluation import eval
+        qe_evaluator = eval(None, None, None, download_model(args.rerank_qe_model))
+
+    rerank_weights = dict(zip(('model', 'length', 'qe'), args.rerank_weights))
+    translator = BatchTranslator(args.project_dir, args.cache, args.cache_max_mb,
+                                 rerank_weights, qe_evaluator, args.qe_cache,
+                                 Tracer(enabled=args.trace is not None), backend_from_args(args))
+    try:
+        results = translator.run_batch_translation(
+            args.test_src,
+            args.test_ref,
+            args.bpe_codes,
+            args.beam_sizes,
+            args.batch_sizes,
+            args.max_tokens,
+            args.average_window,
+            args.average_count,
+            args.ensemble_size,
+            args.n_best,
+            args.threads,
+            args.latency_budget,
+            args.pipeline_depth,
+            args.src_vocab,
+            args.tgt_vocab,
+            not args.skip_vocab_check
+        )
+    except VocabCheckError as e:
+        # Fail before any GPU time is spent
+        translator.logger.error(str(e))
+        raise SystemExit(1)
+
+    if args.trace:
+        translator.tracer.report(translator.logger.info)
+        translator.tracer.save(args.trace)
+        translator.logger.info(f"Trace saved to {args.trace}")
 
 if __name__ == "__main__":
     main()
@@ -205,4 +978,7 @@ if __name__ == "__main__":
 #     --test-ref processed_data_moses/salt.test.tk.lc.eng \
 #     --bpe-codes onmt_data/data.ach.codes \
 #     --beam-sizes 3 5 7 \
-#     --batch-sizes 16 32 64
\ No newline at end of file
+#     --batch-sizes 16 32 64 \
+#     --max-tokens 1024 2048 \
+#     --threads 1 4 8 \
+#     --latency-budget 50
\ No newline at end of file
@@ -0,0 +1,413 @@
+"""
+run_benchmarks.py times the preprocessing, BPE, analysis, evaluation and
+translation wrappers of this project on synthetic or scaled-up corpora.
+
+The corpora are either generated (Acholi/English-like bitext with Zipfian word
+frequencies and roughly matching sentence lengths) or made by repeating the
+bundled bibles/ files up to the requested size. Every benchmark is run
+--repeat times and its fastest run is reported, together with throughput and
+peak memory (from instrumentation.Tracer). Results are saved as JSON and can
+be compared against a saved baseline to catch regressions.
+
+Decoding uses translator_backends.LocalBackend (it copies the source, with an
+optional artificial latency), and evaluation uses a stub COMET model, so no
+model, GPU or OpenNMT installation is needed.
+"""
+import argparse
+import functools
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path[:0] = [REPO_DIR, os.path.join(REPO_DIR, "tools")]
+
+from instrumentation import Tracer
+from translator_backends import LocalBackend
+
+BIBLE_SRC = os.path.join(REPO_DIR, "bibles", "clean_ach-x-bible.txt")
+BIBLE_TGT = os.path.join(REPO_DIR, "bibles", "clean_eng-x-bible-newcentury.txt")
+
+ACH_ONSETS = ['', 'b', 'c', 'd', 'g', 'j', 'k', 'l', 'm', 'n', 'ng', 'ny', 'p', 'r', 't', 'w', 'y']
+ENG_ONSETS = ['', 'b', 'ch', 'd', 'f', 'h', 'l', 'm', 'n', 'p', 'r', 's', 'sh', 't', 'th', 'w']
+ENG_CODAS = ['', '', 'n', 'r', 's', 't', 'd', 'st', 'ng']
+VOWELS = ['a', 'e', 'i', 'o', 'u']
+
+
+def _make_vocab(rng: np.random.Generator, size: int, onsets: List[str], codas: List[str]) -> List[str]:
+    """Distinct pseudo-words built from 1-4 syllables."""
+    words, seen = [], set()
+    while len(words) < size:
+        syllables = rng.integers(1, 5)
+        word = ''.join(rng.choice(onsets) + rng.choice(VOWELS) + rng.choice(codas) for _ in range(syllables))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def synthetic_bitext(n_lines: int, seed: int = 0, vocab_size: int = 20000) -> Tuple[List[str], List[str]]:
+    """
+    Generate an Acholi/English-like parallel corpus.
+
+    Word frequencies follow a Zipf distribution, English sides are about 1.2
+    times longer than Acholi sides, most lines end in punctuation, and a few
+    proper names are shared by both sides (as in the real SALT data).
+
+    Returns:
+        Tuple of (Acholi-like lines, English-like lines)
+    """
+    rng = np.random.default_rng(seed)
+    ach_vocab = _make_vocab(rng, vocab_size, ACH_ONSETS, ['', '', '', 'n'])
+    eng_vocab = _make_vocab(rng, vocab_size, ENG_ONSETS, ENG_CODAS)
+    names = [word.capitalize() for word in _make_vocab(rng, 200, ENG_ONSETS, ENG_CODAS)]
+    ranks = np.arange(1, vocab_size + 1)
+    probs = 1.0 / ranks ** 1.1
+    probs /= probs.sum()
+
+    ach_lengths = np.clip(rng.lognormal(2.7, 0.5, n_lines).astype(int), 1, 120)
+    eng_lengths = np.clip((ach_lengths * rng.normal(1.2, 0.15, n_lines)).astype(int), 1, 150)
+    ach_ids = rng.choice(vocab_size, size=int(ach_lengths.sum()), p=probs)
+    eng_ids = rng.choice(vocab_size, size=int(eng_lengths.sum()), p=probs)
+    endings = rng.choice(['.', '.', '.', '?', '!', ''], size=n_lines)
+    with_name = rng.random(n_lines) < 0.2
+
+    ach_lines, eng_lines = [], []
+    ach_pos, eng_pos = 0, 0
+    for i in range(n_lines):
+        ach_words = [ach_vocab[j] for j in ach_ids[ach_pos:ach_pos + ach_lengths[i]]]
+        eng_words = [eng_vocab[j] for j in eng_ids[eng_pos:eng_pos + eng_lengths[i]]]
+        ach_pos += ach_lengths[i]
+        eng_pos += eng_lengths[i]
+        if with_name[i]:
+            name = names[rng.integers(len(names))]
+            ach_words.insert(rng.integers(len(ach_words) + 1), name)
+            eng_words.insert(rng.integers(len(eng_words) + 1), name)
+        ach_lines.append(' '.join(ach_words) + (' ' + endings[i] if endings[i] else ''))
+        eng_lines.append(' '.join(eng_words).capitalize() + (' ' + endings[i] if endings[i] else ''))
+    return ach_lines, eng_lines
+
+
+def scaled_bibles(n_lines: int) -> Tuple[List[str], List[str]]:
+    """Repeat the bundled Acholi/English bibles up to n_lines parallel lines."""
+    with open(BIBLE_SRC, 'r', encoding='utf-8') as f:
+        ach = [line.rstrip('\n') for line in f]
+    with open(BIBLE_TGT, 'r', encoding='utf-8') as f:
+        eng = [line.rstrip('\n') for line in f]
+    n_pairs = min(len(ach), len(eng))
+    repeats = -(-n_lines // n_pairs)
+    return (ach[:n_pairs] * repeats)[:n_lines], (eng[:n_pairs] * repeats)[:n_lines]
+
+
+def _write(lines: List[str], path: str) -> str:
+    with open(path, 'w', encoding='utf-8') as f:
+        for line in lines:
+            f.write(line + '\n')
+    return path
+
+
+class _StubPrediction:
+    def __init__(self, scores: List[float]) -> None:
+        self.scores = scores
+        self.system_score = statistics.mean(scores) if scores else 0.0
+
+
+class StubCometModel:
+    """Stands in for a loaded COMET model: scores a sample by its hyp/ref length ratio."""
+
+    def predict(self, samples: List[dict], batch_size: int = 16, gpus: int = 0, **kwargs) -> _StubPrediction:
+        return _StubPrediction([min(len(s['mt']), len(s.get('ref', s['src']))) /
+                                max(len(s['mt']), len(s.get('ref', s['src'])), 1) for s in samples])
+
+
+class BenchmarkRunner:
+    def __init__(self, work_dir: str, n_lines: int, source: str = "synthetic",
+                 bpe_operations: int = 4000, repeat: int = 3, seed: int = 0,
+                 decode_latency_ms: float = 0.0) -> None:
+        """
+        Prepare the benchmark corpora.
+
+        Args:
+            work_dir: Directory for corpora and outputs
+            n_lines: Number of training lines; dev/test sets are a tenth of it
+            source: "synthetic" or "bibles" (repeat the bundled bibles)
+            bpe_operations: BPE merge operations for learn_bpe
+            repeat: Runs per benchmark, the fastest is reported
+            seed: Seed of the synthetic corpus
+            decode_latency_ms: Artificial latency of the local decoder per token
+                and beam hypothesis
+        """
+        self.work_dir = work_dir
+        self.n_lines = n_lines
+        self.source = source
+        self.bpe_operations = bpe_operations
+        self.repeat = repeat
+        self.backend = LocalBackend(latency_ms=decode_latency_ms)
+        self.tracer = Tracer()
+        self.results: Dict[str, dict] = {}
+
+        n_eval = max(n_lines // 10, 1)
+        if source == "bibles":
+            ach, eng = scaled_bibles(n_lines + n_eval)
+        else:
+            ach, eng = synthetic_bitext(n_lines + n_eval, seed)
+        self.files = {
+            'train_ach': _write(ach[:n_lines], os.path.join(work_dir, "train.ach")),
+            'train_eng': _write(eng[:n_lines], os.path.join(work_dir, "train.eng")),
+            'test_ach': _write(ach[n_lines:], os.path.join(work_dir, "test.ach")),
+            'test_eng': _write(eng[n_lines:], os.path.join(work_dir, "test.eng")),
+        }
+        self.n_eval = n_eval
+        self.preprocessor = None
+
+    def run(self, name: str, fn: Callable[[], None], lines: int, tokens: Optional[int] = None) -> None:
+        """Time fn repeat times as stage `name` and keep the fastest run."""
+        times = []
+        peak_rss = 0.0
+        for _ in range(self.repeat):
+            counters = {'lines': lines} if tokens is None else {'lines': lines, 'tokens': tokens}
+            with self.tracer.stage(name, **counters) as stage:
+                fn()
+            times.append(stage.duration)
+            peak_rss = max(peak_rss, stage.peak_rss / 2 ** 20)
+        best = min(times)
+        self.results[name] = {
+            'seconds': best,
+            'median_seconds': statistics.median(times),
+            'runs': len(times),
+            'lines': lines,
+            'lines_per_sec': lines / best if best > 0 else 0.0,
+            'peak_rss_mb': peak_rss,
+        }
+        if tokens is not None:
+            self.results[name]['tokens_per_sec'] = tokens / best if best > 0 else 0.0
+        print(f"{name}: {best:.3f}s (median {statistics.median(times):.3f}s), "
+              f"{self.results[name]['lines_per_sec']:.0f} lines/s, peak RSS {peak_rss:.1f} MB")
+
+    def skip(self, name: str, reason: str) -> None:
+        print(f"{name}: skipped ({reason})")
+
+    def _tokens(self, path: str) -> int:
+        with open(path, 'r', encoding='utf-8') as f:
+            return sum(len(line.split()) for line in f)
+
+    def bench_bpe(self) -> None:
+        from preprocess_onmt import ONMTPreprocessor
+        self.preprocessor = ONMTPreprocessor('ach', 'eng',
+                                             src_bpe_operations=self.bpe_operations,
+                                             tgt_bpe_operations=self.bpe_operations)
+        self.preprocessor.logger.setLevel('WARNING')
+        self.preprocessor.set_file_paths(self.files['train_ach'], self.files['train_eng'],
+                                         self.files['test_ach'], self.files['test_eng'],
+                                         os.path.join(self.work_dir, "onmt_data"), "data")
+        tokens = self._tokens(self.files['train_ach']) + self._tokens(self.files['train_eng'])
+        self.run('learn_bpe', self.preprocessor.learn_bpe, 2 * self.n_lines, tokens)
+        self.run('apply_bpe', self.preprocessor.apply_bpe, 2 * (self.n_lines + self.n_eval))
+
+    def bench_tools(self) -> None:
+        from analyze_line_endings import analyze_line_endings
+        from analyze_overlap import load_corpus, get_word_overlap, analyze_overlap
+
+        def overlap():
+            vocab, words = {}, []
+            ach_tokens, ach_offsets = load_corpus(self.files['train_ach'], 3, vocab, words)
+            eng_tokens, _ = load_corpus(self.files['train_eng'], 3, vocab, words)
+            analyze_overlap(ach_tokens, ach_offsets, get_word_overlap(ach_tokens, eng_tokens), len(words))
+
+        self.run('analyze_overlap', overlap, self.n_lines)
+        self.run('analyze_line_endings',
+                 lambda: analyze_line_endings(self.files['train_ach'], self.files['train_eng']), self.n_lines)
+        try:
+            from analyze_vocabulary import analyze_vocab
+        except ImportError as e:
+            self.skip('analyze_vocabulary', e)
+            return
+        self.run('analyze_vocabulary', lambda: analyze_vocab(self.files['train_ach']), self.n_lines)
+
+    def bench_evaluation(self) -> None:
+        try:
+            from evaluation import eval
+        except ImportError as e:
+            self.skip('full_evaluation', e)
+            return
+        # The "translation" is the reference with every fifth word dropped
+        with open(self.files['test_eng'], 'r', encoding='utf-8') as f:
+            hypotheses = [' '.join(w for i, w in enumerate(line.split()) if i % 5 != 4) for line in f]
+        hyp_file = _write(hypotheses, os.path.join(self.work_dir, "test.hyp.eng"))
+
+        def evaluate():
+            ev = eval(self.files['test_ach'], hyp_file, self.files['test_eng'], StubCometModel(), comet_gpus=0)
+            ev.full_evaluation()
+
+        self.run('full_evaluation', evaluate, self.n_eval)
+
+    def bench_batch_translate(self) -> None:
+        from batch_translate import BatchTranslator
+        if self.preprocessor is None:
+            self.skip('batch_translate', "needs the BPE codes of bench_bpe")
+            return
+        project_dir = os.path.join(self.work_dir, "project")
+        model_dir = os.path.join(project_dir, "onmt_data", "onmt_model")
+        os.makedirs(model_dir, exist_ok=True)
+        for step in (1000, 2000):
+            open(os.path.join(model_dir, f"model_step_{step}.pt"), 'w').close()
+
+        def translate():
+            translator = BatchTranslator(project_dir, backend=self.backend)
+            translator.logger.setLevel('WARNING')
+            translator.run_batch_translation(self.files['test_ach'], self.files['test_eng'],
+                                             self.preprocessor.src_bpe_codes_path,
+                                             beam_sizes=[5], batch_sizes=[32], token_budgets=[2048])
+
+        # Two checkpoints x two batch settings
+        self.run('batch_translate', translate, 4 * self.n_eval)
+
+    def bench_bootstrap(self) -> None:
+        try:
+            from bootstrap_evaluation import OpenNMTBootstrapEvaluator
+            from evaluation import eval
+        except ImportError as e:
+            self.skip('bootstrap', e)
+            return
+        model_dir = os.path.join(self.work_dir, "bootstrap_models")
+        os.makedirs(model_dir, exist_ok=True)
+        models = []
+        for name in ("baseline.pt", "experimental.pt"):
+            models.append(os.path.join(model_dir, name))
+            with open(models[-1], 'w') as f:
+                f.write(name)
+        iterations = 20
+
+        def bootstrap():
+            evaluator = OpenNMTBootstrapEvaluator(self.files['test_ach'], models[0], models[1],
+                                                  self.files['test_eng'],
+                                                  functools.partial(eval, comet_gpus=0),
+                                                  n_iterations=iterations,
+                                                  cache_path=os.path.join(self.work_dir, "bootstrap_cache.sqlite"),
+                                                  comet_model=StubCometModel(), backend=self.backend)
+            evaluator.run_bootstrap(seed=0, chunk_size=5)
+
+        # Both systems are translated and scored on every resample
+        self.run('bootstrap', bootstrap, 2 * iterations * self.n_eval)
+
+    def run_all(self, benchmarks: List[str]) -> Dict[str, object]:
+        for name in benchmarks:
+            getattr(self, f"bench_{name}")()
+        return {
+            'meta': {
+                'date': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'git_commit': _git_commit(),
+                'source': self.source,
+                'lines': self.n_lines,
+                'bpe_operations': self.bpe_operations,
+                'repeat': self.repeat,
+            },
+            'benchmarks': self.results,
+        }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict, tolerance: float = 0.1) -> List[str]:
+    """
+    Compare benchmark times against a baseline.
+
+    Returns:
+        Names of the benchmarks that got slower than tolerance allows
+    """
+    regressions = []
+    print(f"\n{'benchmark':<24}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, current in results['benchmarks'].items():
+        if name not in baseline['benchmarks']:
+            print(f"{name:<24}{'-':>12}{current['seconds']:>11.3f}s{'new':>10}")
+            continue
+        before = baseline['benchmarks'][name]['seconds']
+        change = current['seconds'] / before - 1 if before > 0 else 0.0
+        flag = ''
+        if change > tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<24}{before:>11.3f}s{current['seconds']:>11.3f}s{change:>+10.1%}{flag}")
+    for key in ('lines', 'source', 'bpe_operations'):
+        if baseline['meta'].get(key) != results['meta'][key]:
+            print(f"Note: baseline was run with {key}={baseline['meta'].get(key)}, this run with {results['meta'][key]}")
+    return regressions
+
+
+BENCHMARKS = ['bpe', 'tools', 'evaluation', 'batch_translate', 'bootstrap']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark preprocessing, BPE, analysis, evaluation and translation wrappers')
+    parser.add_argument('--lines', type=int, default=20000, help='Training lines (dev/test sets are a tenth)')
+    parser.add_argument('--source', choices=['synthetic', 'bibles'], default='synthetic',
+                        help='Generate a synthetic bitext or repeat the bundled bibles')
+    parser.add_argument('--bpe-operations', type=int, default=4000, help='BPE merge operations')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per benchmark (the fastest is reported)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic corpus')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=BENCHMARKS, help='Benchmarks to run')
+    parser.add_argument('--output', default=None, help='Where to save the results (JSON)')
+    parser.add_argument('--baseline', default=None, help='Saved results to compare against')
+    parser.add_argument('--save-baseline', default=None, help='Also save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Allowed slowdown before a regression is reported')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Exit with status 1 on regressions')
+    parser.add_argument('--trace', default=None, help='Save a Chrome trace of all runs')
+    parser.add_argument('--keep', action='store_true', help='Keep the generated corpora and outputs')
+    parser.add_argument('--decode-latency-ms', type=float, default=0.0,
+                        help='Artificial decoding latency per token and beam hypothesis of the local backend')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="mt_bench_")
+    try:
+        runner = BenchmarkRunner(work_dir, args.lines, args.source, args.bpe_operations, args.repeat, args.seed,
+                                 args.decode_latency_ms)
+        results = runner.run_all(args.only)
+        if args.trace:
+            runner.tracer.save(args.trace)
+    finally:
+        if args.keep:
+            print(f"Benchmark files kept in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = args.output or os.path.join(BENCH_DIR, "results",
+                                         f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    for path in filter(None, (output, args.save_baseline)):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\nSlower than the baseline: {', '.join(regressions)}")
+            if args.fail_on_regression:
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
+
+# Example:
+# python benchmarks/run_benchmarks.py --lines 20000 --save-baseline benchmarks/baseline.json
+# python benchmarks/run_benchmarks.py --lines 20000 --baseline benchmarks/baseline.json --fail-on-regression
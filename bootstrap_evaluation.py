@@ -1,14 +1,76 @@
 """bootstrap_evaluation.py contains code for performing bootstrap evaluation of machine translation output"""
+import argparse
 import numpy as np
-import statistics
+import json
+import math
 import time
 from datetime import datetime
 import subprocess
 import os
 import shutil
 from pathlib import Path
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+from statistics import NormalDist
 import tempfile
-from evaluation import eval
+import uuid
+from typing import Optional
+from corpus_store import read_lines
+from translation_cache import TranslationCache
+from metric_stats import SentenceStats
+from instrumentation import Tracer
+from translator_backends import OpenNMTBackend, TranslatorBackend, add_backend_arguments, backend_from_args
+
+METRICS = ('bleu', 'meteor', 'comet')
+
+# tmpfs mount, keeps sample files in memory
+SHM_DIR = "/dev/shm"
+
+
+class RunningStats:
+    def __init__(self) -> None:
+        """Streaming mean and variance (Welford), mergeable across workers (Chan et al.)."""
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def merge(self, other: 'RunningStats') -> None:
+        """Add the values summarized by another accumulator."""
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+
+    def to_dict(self) -> dict:
+        return {'count': self.count, 'mean': self.mean, 'm2': self.m2}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'RunningStats':
+        stats = cls()
+        stats.count, stats.mean, stats.m2 = data['count'], data['mean'], data['m2']
+        return stats
+
+    @property
+    def variance(self) -> float:
+        """Sample variance (like statistics.variance)."""
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
 
 
 class OpenNMTBootstrapEvaluator:
@@ -22,7 +84,12 @@ class OpenNMTBootstrapEvaluator:
                  batch_size: int = 32,
                  beam_size: int = 7,
                  gpu: str = "1",
-                 temp_dir: str = "bootstrap_temp") -> None:
+                 temp_dir: Optional[str] = None,
+                 cache_path: Optional[str] = None,
+                 comet_model: Optional[str] = None,
+                 checkpoint_path: Optional[str] = None,
+                 tracer: Optional[Tracer] = None,
+                 backend: Optional[TranslatorBackend] = None) -> None:
         """
         Initialize the bootstrap evaluator for comparing two OpenNMT models.
         
@@ -35,8 +102,21 @@ class OpenNMTBootstrapEvaluator:
             n_iterations: Number of bootstrap iterations
             batch_size: Batch size for OpenNMT translation
             beam_size: Beam size for OpenNMT translation
-            gpu: GPU device to use (e.g., "0" or "-1" for CPU)
-            temp_dir: Directory for temporary files
+            gpu: GPU device to use (e.g., "0" or "-1" for CPU) when no backend is given
+            temp_dir: Parent directory of the evaluator's workspace, a uniquely named
+                directory for the sample files that exists while run_bootstrap
+                runs; defaults to /dev/shm when it is available, otherwise the
+                system temp directory
+            cache_path: Optional translation cache file; sentences already decoded
+                with the same model and beam size are not decoded again
+            comet_model: Path to the COMET model; it is loaded once per process
+                and the loaded model is passed to eval_class
+            checkpoint_path: Optional JSONL log the results of every finished chunk
+                are appended to; a run started with an existing log resumes
+                after its last chunk
+            tracer: Optional Tracer recording the translate and metric stages;
+                stages run in worker processes are sent back with each chunk
+            backend: Translator backend; defaults to onmt_translate on the given GPU
         """
         self.src_file = src_file
         self.baseline_model = baseline_model_path
@@ -47,10 +127,17 @@ class OpenNMTBootstrapEvaluator:
         self.batch_size = batch_size
         self.beam_size = beam_size
         self.gpu = gpu
+        self.backend = backend or OpenNMTBackend(gpu)
+        self.cache = TranslationCache(cache_path) if cache_path else None
+        self.comet_model = comet_model
+        self.checkpoint_path = checkpoint_path
+        self.tracer = tracer or Tracer(enabled=False)
         
-        # Create temp directory if it doesn't exist
-        self.temp_dir = Path(temp_dir)
-        self.temp_dir.mkdir(parents=True, exist_ok=True)
+        # Parent of the private workspace run_bootstrap creates, so concurrent evaluators never share files
+        if temp_dir is None and os.access(SHM_DIR, os.W_OK):
+            temp_dir = SHM_DIR
+        self.workspace_parent = temp_dir
+        self.temp_dir: Optional[Path] = None
         
         # Load source and reference data
         self.src_lines = self._read_file(src_file)
@@ -63,9 +150,8 @@ class OpenNMTBootstrapEvaluator:
         self.n_sentences = len(self.src_lines)
 
     def _read_file(self, filepath: str) -> list[str]:
-        """Read lines from a file and strip whitespace."""
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return [line.strip() for line in f]
+        """Read lines from a text file or memory-mapped corpus and strip whitespace."""
+        return read_lines(filepath)
 
     def _write_temp_file(self, lines: list[str], filepath: str) -> None:
         """Write lines to a temporary file."""
@@ -73,36 +159,42 @@ class OpenNMTBootstrapEvaluator:
             for line in lines:
                 f.write(line + '\n')
 
-    def _translate_with_onmt(self, model_path: str, src_file: str, output_file: str) -> None:
-        """Run OpenNMT translation."""
-        cmd = [
-            "onmt_translate",
-            "-model", model_path,
-            "-src", src_file,
-            "-output", output_file,
-            "-gpu", self.gpu,
-            "-batch_size", str(self.batch_size),
-            "-beam_size", str(self.beam_size),
-            "-replace_unk"
-        ]
-        
+    def _run_backend(self, model_path: str, src_lines: list[str]) -> list[str]:
+        """Translate source lines with the translator backend (onmt_translate by default)."""
         try:
-            subprocess.run(cmd, check=True, capture_output=True, text=True)
+            hypotheses = list(self.backend.translate([model_path], src_lines, self.beam_size, self.batch_size))
         except subprocess.CalledProcessError as e:
             print(f"Translation error: {e.stderr}")
             raise
 
+        if len(hypotheses) != len(src_lines):
+            raise RuntimeError(f"{self.backend.name} backend returned {len(hypotheses)} lines "
+                               f"for {len(src_lines)} source lines")
+        return hypotheses
+
+    def _translate_lines(self, model_path: str, src_lines: list[str]) -> list[str]:
+        """Translate source lines, decoding every distinct line once and skipping cached ones."""
+        if self.cache is not None:
+            options = {'beam_size': self.beam_size, **self.backend.cache_options}
+            return self.cache.translate(model_path, options, src_lines,
+                                        lambda lines: self._run_backend(model_path, lines))
+
+        # Resamples repeat sentences, decode each of them only once
+        unique = list(dict.fromkeys(src_lines))
+        translations = dict(zip(unique, self._run_backend(model_path, unique)))
+        return [translations[line] for line in src_lines]
+
     def evaluate_models_on_sample(self, sample_indices: list[int]) -> tuple[tuple[float, float, float], tuple[float, float, float]]:
         """
         Evaluate both models on a bootstrap sample.
         Returns tuples of (BLEU, METEOR, COMET) scores for both systems.
         """
-        # Create temporary files for this sample
-        iteration_id = int(time.time() * 1000)  # Use timestamp for unique files
-        temp_src = self.temp_dir / f"src_{iteration_id}.txt"
-        temp_base_out = self.temp_dir / f"base_out_{iteration_id}.txt"
-        temp_exp_out = self.temp_dir / f"exp_out_{iteration_id}.txt"
-        temp_ref = self.temp_dir / f"ref_{iteration_id}.txt"
+        # Files for the scorer, uniquely named within the workspace
+        sample_id = uuid.uuid4().hex
+        temp_src = self.temp_dir / f"src_{sample_id}.txt"
+        temp_base_out = self.temp_dir / f"base_out_{sample_id}.txt"
+        temp_exp_out = self.temp_dir / f"exp_out_{sample_id}.txt"
+        temp_ref = self.temp_dir / f"ref_{sample_id}.txt"
 
         try:
             # Write sampled sentences to temporary files
@@ -113,17 +205,27 @@ class OpenNMTBootstrapEvaluator:
             self._write_temp_file(sampled_ref, temp_ref)
 
             # Generate translations with both models
-            self._translate_with_onmt(self.baseline_model, temp_src, temp_base_out)
-            self._translate_with_onmt(self.experimental_model, temp_src, temp_exp_out)
+            for model_path, output_file in ((self.baseline_model, temp_base_out),
+                                            (self.experimental_model, temp_exp_out)):
+                with self.tracer.stage('translate', lines=len(sampled_src)):
+                    self._write_temp_file(self._translate_lines(model_path, sampled_src), output_file)
+
+            # A COMET checkpoint is loaded on the first sample of this process and reused
+            comet_model = self.comet_model
+            if isinstance(comet_model, (str, os.PathLike)):
+                from evaluation import load_comet_model  # only needed with a checkpoint (COMET, nltk)
+                comet_model = load_comet_model(comet_model)
 
             # Evaluate baseline system
-            base_eval = self.eval_class(str(temp_src), str(temp_base_out), str(temp_ref))
-            base_eval.full_evaluation()
+            with self.tracer.stage('metrics', lines=len(sampled_src), system='baseline'):
+                base_eval = self.eval_class(str(temp_src), str(temp_base_out), str(temp_ref), comet_model)
+                base_eval.full_evaluation()
             base_scores = (base_eval.bleu_score, base_eval.meteor_score, base_eval.comet_score)
 
             # Evaluate experimental system
-            exp_eval = self.eval_class(str(temp_src), str(temp_exp_out), str(temp_ref))
-            exp_eval.full_evaluation()
+            with self.tracer.stage('metrics', lines=len(sampled_src), system='experimental'):
+                exp_eval = self.eval_class(str(temp_src), str(temp_exp_out), str(temp_ref), comet_model)
+                exp_eval.full_evaluation()
             exp_scores = (exp_eval.bleu_score, exp_eval.meteor_score, exp_eval.comet_score)
 
             return base_scores, exp_scores
@@ -134,81 +236,293 @@ class OpenNMTBootstrapEvaluator:
                 if file.exists():
                     file.unlink()
 
-    def run_bootstrap(self) -> dict:
+    def _run_chunk(self, seed: np.random.SeedSequence, n_iterations: int) -> dict:
+        """
+        Run one chunk of bootstrap iterations.
+
+        Args:
+            seed: Seed of this chunk, spawned from the master seed
+            n_iterations: Number of iterations in the chunk
+
+        Returns:
+            Dictionary with the win counts, running score statistics and the
+            translation cache lookups of the chunk
+        """
+        rng = np.random.default_rng(seed)
+        wins = {metric: {'baseline': 0, 'experimental': 0, 'tie': 0} for metric in METRICS}
+        stats = {system: {metric: RunningStats() for metric in METRICS}
+                 for system in ('baseline', 'experimental')}
+        cache_before = (self.cache.hits, self.cache.misses) if self.cache is not None else (0, 0)
+        trace_start = len(self.tracer.events)
+
+        for _ in range(n_iterations):
+            # Generate bootstrap sample indices
+            indices = rng.integers(0, self.n_sentences, size=self.n_sentences)
+
+            # Evaluate both systems
+            base_scores, exp_scores = self.evaluate_models_on_sample(indices)
+
+            for metric_idx, metric in enumerate(METRICS):
+                stats['baseline'][metric].add(base_scores[metric_idx])
+                stats['experimental'][metric].add(exp_scores[metric_idx])
+
+                # Count wins
+                if base_scores[metric_idx] > exp_scores[metric_idx]:
+                    wins[metric]['baseline'] += 1
+                elif exp_scores[metric_idx] > base_scores[metric_idx]:
+                    wins[metric]['experimental'] += 1
+                else:
+                    wins[metric]['tie'] += 1
+
+        cache_after = (self.cache.hits, self.cache.misses) if self.cache is not None else (0, 0)
+        return {
+            'iterations': n_iterations,
+            'wins': wins,
+            'stats': stats,
+            'cache_hits': cache_after[0] - cache_before[0],
+            'cache_misses': cache_after[1] - cache_before[1],
+            'trace': self.tracer.events[trace_start:],
+        }
+
+    def _checkpoint_header(self, seed: int, chunk_size: int) -> dict:
+        """Settings a checkpoint log must match to be resumed."""
+        return {
+            'seed': seed,
+            'iterations': self.n_iterations,
+            'chunk_size': chunk_size,
+            'total_sentences': self.n_sentences,
+            'baseline_model': self.baseline_model,
+            'experimental_model': self.experimental_model,
+            'beam_size': self.beam_size,
+        }
+
+    def _load_checkpoint(self) -> tuple[Optional[dict], list[dict]]:
+        """Read the header and the logged chunk results of the checkpoint log."""
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return None, []
+        header, partials = None, []
+        valid_bytes = 0
+        with open(self.checkpoint_path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                valid_bytes += len(line)
+                if header is None:
+                    header = record
+                    continue
+                record['stats'] = {system: {metric: RunningStats.from_dict(values)
+                                            for metric, values in metrics.items()}
+                                   for system, metrics in record['stats'].items()}
+                partials.append(record)
+        if valid_bytes < os.path.getsize(self.checkpoint_path):
+            # Drop a record cut off by a crash, so new records start on a clean line
+            os.truncate(self.checkpoint_path, valid_bytes)
+        return header, partials
+
+    def _append_checkpoint(self, record: dict) -> None:
+        """Append one record to the checkpoint log and flush it to disk."""
+        with open(self.checkpoint_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _chunk_results(self, chunk_seeds: list, chunk_sizes: list[int], n_workers: int):
+        """
+        Yield the partial results of all chunks in chunk order.
+
+        With several workers, at most two chunks per worker are submitted ahead,
+        so closing the generator (e.g. on an early stop) cancels the rest.
+        """
+        if n_workers <= 1:
+            for seed, size in zip(chunk_seeds, chunk_sizes):
+                yield self._run_chunk(seed, size)
+            return
+
+        chunks = zip(chunk_seeds, chunk_sizes)
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            pending = deque(executor.submit(self._run_chunk, seed, size)
+                            for seed, size in islice(chunks, 2 * n_workers))
+            try:
+                while pending:
+                    partial = pending.popleft().result()
+                    for seed, size in islice(chunks, 1):
+                        pending.append(executor.submit(self._run_chunk, seed, size))
+                    yield partial
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def run_bootstrap(self,
+                      seed: Optional[int] = None,
+                      n_workers: int = 1,
+                      chunk_size: int = 10,
+                      adaptive: bool = False,
+                      min_iterations: int = 100,
+                      alpha: float = 0.05,
+                      decision_metric: str = 'bleu',
+                      stop_confidence: float = 0.99) -> dict:
         """
         Run bootstrap resampling evaluation.
-        Returns a dictionary with detailed results and statistics.
+
+        Iterations are split into chunks of chunk_size, and every chunk draws its
+        samples from its own seed spawned from the master seed. The chunks do not
+        depend on the number of workers and their partial results are merged in
+        chunk order, so the results for a given seed are identical for any n_workers.
+
+        In adaptive mode n_iterations is a hard cap: after every chunk (and at
+        least min_iterations) the Wilson interval of the decision metric's
+        p-value is checked, and the run stops as soon as it lies entirely below
+        or entirely above alpha.
+
+        Args:
+            seed: Master seed; a random one is drawn (and reported) when not given
+            n_workers: Number of worker processes running chunks in parallel
+            chunk_size: Number of iterations per chunk
+            adaptive: Stop early once significance at alpha is settled
+            min_iterations: Iterations to run before the first stopping check
+            alpha: Significance level of the stopping decision
+            decision_metric: Metric whose p-value decides when to stop
+            stop_confidence: Confidence level of the interval on the p-value
+
+        Returns:
+            A dictionary with detailed results and statistics.
         """
-        print(f"Starting bootstrap evaluation with {self.n_iterations} iterations...")
+        print(f"Starting bootstrap evaluation with {self.n_iterations} iterations"
+              f"{' (adaptive)' if adaptive else ''}...")
         start_time = time.time()
-        
-        # Initialize result storage
-        wins = {'bleu': {'baseline': 0, 'experimental': 0, 'tie': 0},
-                'meteor': {'baseline': 0, 'experimental': 0, 'tie': 0},
-                'comet': {'baseline': 0, 'experimental': 0, 'tie': 0}}
-        
-        scores = {'baseline': {'bleu': [], 'meteor': [], 'comet': []},
-                 'experimental': {'bleu': [], 'meteor': [], 'comet': []}}
-        
+        if self.workspace_parent is not None:
+            os.makedirs(self.workspace_parent, exist_ok=True)
+        self.temp_dir = Path(tempfile.mkdtemp(prefix=f"bootstrap_{os.getpid()}_", dir=self.workspace_parent))
+
         try:
-            # Run bootstrap iterations
-            for i in range(self.n_iterations):
-                if (i + 1) % 10 == 0:
-                    print(f"Completed {i + 1} iterations...")
-                
-                # Generate bootstrap sample indices
-                indices = np.random.choice(self.n_sentences, size=self.n_sentences, replace=True)
-                
-                # Evaluate both systems
-                base_scores, exp_scores = self.evaluate_models_on_sample(indices)
-                
-                # Record scores
-                for metric_idx, metric in enumerate(['bleu', 'meteor', 'comet']):
-                    scores['baseline'][metric].append(base_scores[metric_idx])
-                    scores['experimental'][metric].append(exp_scores[metric_idx])
-                    
-                    # Count wins
-                    if base_scores[metric_idx] > exp_scores[metric_idx]:
-                        wins[metric]['baseline'] += 1
-                    elif exp_scores[metric_idx] > base_scores[metric_idx]:
-                        wins[metric]['experimental'] += 1
-                    else:
-                        wins[metric]['tie'] += 1
+            header, logged = self._load_checkpoint()
+            if header is not None and seed is None:
+                # Resume with the seed of the interrupted run
+                seed = header['seed']
+            master_seed = np.random.SeedSequence(seed)
+            chunk_sizes = [min(chunk_size, self.n_iterations - start)
+                           for start in range(0, self.n_iterations, chunk_size)]
+            chunk_seeds = master_seed.spawn(len(chunk_sizes))
+
+            if self.checkpoint_path:
+                expected = self._checkpoint_header(master_seed.entropy, chunk_size)
+                if header is None:
+                    self._append_checkpoint(expected)
+                elif header != expected:
+                    raise ValueError(f"Checkpoint {self.checkpoint_path} was written with different settings: "
+                                     f"{header} (expected {expected})")
+                elif logged:
+                    print(f"Resuming from {self.checkpoint_path}: "
+                          f"{sum(partial['iterations'] for partial in logged)} iterations already done")
+
+            # Initialize result storage
+            wins = {metric: {'baseline': 0, 'experimental': 0, 'tie': 0} for metric in METRICS}
+            stats = {system: {metric: RunningStats() for metric in METRICS}
+                     for system in ('baseline', 'experimental')}
+            completed = 0
+            stopped_early = False
+            resumed = len(logged)
+            run_start = time.time()
+
+            # Logged chunks are replayed in order, so a resumed run gives the same results
+            partials = self._chunk_results(chunk_seeds[resumed:], chunk_sizes[resumed:], n_workers)
+            try:
+                for chunk_index, partial in enumerate(chain(logged, partials)):
+                    new_chunk = chunk_index >= resumed
+                    trace = partial.pop('trace', [])
+                    if n_workers > 1:
+                        # Stages run in a worker process
+                        self.tracer.add_events(trace)
+                    if new_chunk and self.checkpoint_path:
+                        self._append_checkpoint({
+                            **partial,
+                            'chunk': chunk_index,
+                            'stats': {system: {metric: values.to_dict() for metric, values in metrics.items()}
+                                      for system, metrics in partial['stats'].items()},
+                        })
+                    for metric in METRICS:
+                        for outcome, count in partial['wins'][metric].items():
+                            wins[metric][outcome] += count
+                        for system in stats:
+                            stats[system][metric].merge(partial['stats'][system][metric])
+                    if self.cache is not None and n_workers > 1 and new_chunk:
+                        self.cache.hits += partial['cache_hits']
+                        self.cache.misses += partial['cache_misses']
+                    completed += partial['iterations']
+
+                    if new_chunk:
+                        done_now = completed - sum(chunk_sizes[:resumed])
+                        elapsed = time.time() - run_start
+                        eta = elapsed / done_now * (self.n_iterations - completed)
+                        print(f"Completed {completed}/{self.n_iterations} iterations "
+                              f"({elapsed:.0f}s elapsed, ETA {eta:.0f}s)")
+
+                    if adaptive and min_iterations <= completed < self.n_iterations:
+                        decision = wins[decision_metric]
+                        p_value_ci = wilson_interval(decision['baseline'] + decision['tie'] / 2,
+                                                     completed, stop_confidence)
+                        if p_value_ci[1] < alpha or p_value_ci[0] > alpha:
+                            stopped_early = True
+                            print(f"Stopping early: {decision_metric} p-value interval "
+                                  f"[{p_value_ci[0]:.4f}, {p_value_ci[1]:.4f}] excludes {alpha}")
+                            break
+            finally:
+                partials.close()
 
             # Calculate final statistics
             results = {
-                'iterations': self.n_iterations,
+                'iterations': completed,
+                'max_iterations': self.n_iterations,
+                'stopped_early': stopped_early,
+                'seed': master_seed.entropy,
                 'total_sentences': self.n_sentences,
                 'time_taken': time.time() - start_time,
                 'metrics': {}
             }
+            if adaptive:
+                results['decision_metric'] = decision_metric
+                decision = wins[decision_metric]
+                results['p_value_ci'] = wilson_interval(decision['baseline'] + decision['tie'] / 2,
+                                                        completed, stop_confidence)
+            if self.cache is not None:
+                results['cache'] = self.cache.report()
             
-            for metric in ['bleu', 'meteor', 'comet']:
+            for metric in METRICS:
                 results['metrics'][metric] = {
-                    'baseline_mean': statistics.mean(scores['baseline'][metric]),
-                    'experimental_mean': statistics.mean(scores['experimental'][metric]),
-                    'baseline_std': statistics.stdev(scores['baseline'][metric]),
-                    'experimental_std': statistics.stdev(scores['experimental'][metric]),
+                    'baseline_mean': stats['baseline'][metric].mean,
+                    'experimental_mean': stats['experimental'][metric].mean,
+                    'baseline_std': stats['baseline'][metric].std,
+                    'experimental_std': stats['experimental'][metric].std,
                     'baseline_wins': wins[metric]['baseline'],
                     'experimental_wins': wins[metric]['experimental'],
                     'ties': wins[metric]['tie'],
-                    'experimental_win_ratio': wins[metric]['experimental'] / self.n_iterations,
-                    'p_value': (wins[metric]['baseline'] + wins[metric]['tie'] / 2) / self.n_iterations
+                    'experimental_win_ratio': wins[metric]['experimental'] / completed,
+                    'p_value': (wins[metric]['baseline'] + wins[metric]['tie'] / 2) / completed
                 }
             
             return results
 
         finally:
-            # Clean up temp directory
-            if self.temp_dir.exists():
-                shutil.rmtree(self.temp_dir)
+            # Remove this run's workspace (and nothing else)
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+            self.temp_dir = None
 
     def print_results(self, results: dict) -> None:
         """Print formatted results of the bootstrap evaluation."""
         print("\n=== Bootstrap Evaluation Results ===")
-        print(f"Number of iterations: {results['iterations']}")
+        print(f"Number of iterations: {results['iterations']} of {results['max_iterations']}"
+              f"{' (stopped early)' if results['stopped_early'] else ''}")
+        if 'p_value_ci' in results:
+            low, high = results['p_value_ci']
+            print(f"{results['decision_metric'].upper()} p-value interval: [{low:.4f}, {high:.4f}]")
+        print(f"Seed: {results['seed']}")
         print(f"Total sentences: {results['total_sentences']}")
         print(f"Time taken: {results['time_taken']:.2f} seconds\n")
+        if 'cache' in results:
+            print(f"Translation cache hit rate: {results['cache']['hit_rate']:.2%} "
+                  f"({results['cache']['hits']} hits, {results['cache']['misses']} misses)\n")
         
         for metric, stats in results['metrics'].items():
             print(f"\n{metric.upper()} Scores:")
@@ -221,24 +535,206 @@ class OpenNMTBootstrapEvaluator:
             print(f"Approximate p-value: {stats['p_value']:.4f}")
 
 
-# Enter correct paths
-evaluator = OpenNMTBootstrapEvaluator(
-    src_file="processed_data_moses/salt.test.tk.lc.ach",
-    baseline_model_path="onmt_data/onmt_model",
-    experimental_model_path="onmt_data_oskar/onmt_model",
-    ref_file="processed_data_moses/salt.test.tk.lc.eng",
-    eval_class=eval,  
-    n_iterations=1000,
-    batch_size=32,
-    beam_size=5,
-    gpu="0"
-)
+def wilson_interval(successes: float, n: int, confidence: float = 0.99) -> tuple[float, float]:
+    """Wilson score interval of a binomial proportion."""
+    if n == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = successes / n
+    denominator = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denominator
+    half_width = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+def resample_counts(rng: np.random.Generator, n_sentences: int, n_samples: int) -> np.ndarray:
+    """
+    Draw bootstrap samples as a count matrix.
+
+    Returns:
+        Array of shape (n_samples, n_sentences) with how often each sentence
+        was drawn in each sample
+    """
+    indices = rng.integers(0, n_sentences, size=(n_samples, n_sentences))
+    offsets = (np.arange(n_samples) * n_sentences)[:, None]
+    return np.bincount((indices + offsets).ravel(),
+                       minlength=n_samples * n_sentences).reshape(n_samples, n_sentences)
+
+
+def load_system_stats(hyp_files: list[str], ref_file: str, metrics: tuple = ('bleu', 'chrf')) -> dict:
+    """Compute per-sentence metric statistics for the output of several systems."""
+    references = read_lines(ref_file)
+    return {Path(hyp_file).stem: SentenceStats(read_lines(hyp_file), references, metrics)
+            for hyp_file in hyp_files}
+
+
+def multi_system_bootstrap(system_stats: dict,
+                           metric: str = 'bleu',
+                           n_iterations: int = 1000,
+                           seed: Optional[int] = None,
+                           alpha: float = 0.05,
+                           chunk_size: int = 500) -> dict:
+    """
+    Paired bootstrap resampling over K systems at once.
+
+    All systems are scored on the same resampled test sets, drawn once as a
+    shared count matrix. Scores come from the precomputed sentence statistics
+    (see metric_stats.SentenceStats), so no system is re-translated or re-scored.
+
+    Args:
+        system_stats: SentenceStats per system name, all over the same test set
+        metric: Metric to compare ('bleu', 'chrf' or 'chrf++')
+        n_iterations: Number of bootstrap samples
+        seed: Seed for the resampling
+        alpha: Significance level for the confidence intervals
+        chunk_size: Number of samples scored at once (bounds memory use)
+
+    Returns:
+        Dictionary with per-system means, standard deviations and confidence
+        intervals, and K x K matrices of win rates, p-values and difference intervals.
+        Entry [i][j] of 'win_rate' is how often system i scored higher than system j,
+        and 'p_value' [i][j] is the approximate p-value of system i being better than j.
+    """
+    start_time = time.time()
+    names = list(system_stats)
+    n_sentences = len(system_stats[names[0]])
+    assert all(len(stats) == n_sentences for stats in system_stats.values()), \
+        "All systems must be scored on the same test set"
+
+    rng = np.random.default_rng(seed)
+    scores = np.empty((len(names), n_iterations))
+    for start in range(0, n_iterations, chunk_size):
+        counts = resample_counts(rng, n_sentences, min(chunk_size, n_iterations - start))
+        for k, name in enumerate(names):
+            scores[k, start:start + len(counts)] = system_stats[name].weighted_scores(metric, counts)
+
+    # Pairwise comparisons over the shared samples: (K, K, n_iterations)
+    diffs = scores[:, None, :] - scores[None, :, :]
+    wins = (diffs > 0).mean(axis=2)
+    ties = (diffs == 0).mean(axis=2)
+    quantiles = [100 * alpha / 2, 100 * (1 - alpha / 2)]
+
+    return {
+        'systems': names,
+        'metric': metric,
+        'iterations': n_iterations,
+        'total_sentences': n_sentences,
+        'time_taken': time.time() - start_time,
+        'actual': [system_stats[name].score(metric) for name in names],
+        'mean': scores.mean(axis=1).tolist(),
+        'std': scores.std(axis=1, ddof=1).tolist(),
+        'ci': np.percentile(scores, quantiles, axis=1).T.tolist(),
+        'win_rate': wins.tolist(),
+        'p_value': (1 - wins - ties / 2).tolist(),
+        'diff_ci': np.moveaxis(np.percentile(diffs, quantiles, axis=2), 0, -1).tolist(),
+    }
+
+
+def print_multi_system_results(results: dict, alpha: float = 0.05) -> None:
+    """Print formatted results of a multi-system bootstrap."""
+    names = results['systems']
+    print("\n=== Multi-System Bootstrap Results ===")
+    print(f"Metric: {results['metric'].upper()}")
+    print(f"Number of iterations: {results['iterations']}")
+    print(f"Total sentences: {results['total_sentences']}")
+    print(f"Time taken: {results['time_taken']:.2f} seconds\n")
+
+    width = max(len(name) for name in names)
+    for k, name in enumerate(names):
+        low, high = results['ci'][k]
+        print(f"{name:<{width}}  {results['actual'][k]:.4f}  "
+              f"mean {results['mean'][k]:.4f} (±{results['std'][k]:.4f})  CI [{low:.4f}, {high:.4f}]")
+
+    print(f"\nSignificantly better pairs (p < {alpha}):")
+    for i, better in enumerate(names):
+        for j, worse in enumerate(names):
+            if i != j and results['p_value'][i][j] < alpha:
+                low, high = results['diff_ci'][i][j]
+                print(f"{better} > {worse}: win rate {results['win_rate'][i][j]:.4f}, "
+                      f"p = {results['p_value'][i][j]:.4f}, difference CI [{low:.4f}, {high:.4f}]")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Paired bootstrap significance testing of MT systems')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    models_parser = subparsers.add_parser('models', help='Compare two OpenNMT models by re-translating resamples')
+    models_parser.add_argument('--src', default="processed_data_moses/salt.test.tk.lc.ach", help='Source file')
+    models_parser.add_argument('--ref', default="processed_data_moses/salt.test.tk.lc.eng", help='Reference file')
+    models_parser.add_argument('--baseline-model', default="onmt_data/onmt_model", help='Baseline model')
+    models_parser.add_argument('--experimental-model', default="onmt_data_oskar/onmt_model", help='Experimental model')
+    models_parser.add_argument('--comet-model', default="Unbabel/wmt20-comet-qe-da", help='COMET model')
+    models_parser.add_argument('--iterations', type=int, default=1000, help='Bootstrap iterations')
+    models_parser.add_argument('--batch-size', type=int, default=32, help='Translation batch size')
+    models_parser.add_argument('--beam-size', type=int, default=5, help='Translation beam size')
+    models_parser.add_argument('--cache', default=None, help='Translation cache file')
+    models_parser.add_argument('--checkpoint', default=None,
+                               help='JSONL log of finished chunks; an interrupted run resumes from it')
+    models_parser.add_argument('--seed', type=int, default=None, help='Master random seed')
+    models_parser.add_argument('--workers', type=int, default=1, help='Worker processes running iterations in parallel')
+    models_parser.add_argument('--chunk-size', type=int, default=10, help='Iterations per work chunk')
+    models_parser.add_argument('--adaptive', action='store_true',
+                               help='Stop before --iterations once significance is settled')
+    models_parser.add_argument('--min-iterations', type=int, default=100, help='Iterations before stopping early')
+    models_parser.add_argument('--alpha', type=float, default=0.05, help='Significance level')
+    models_parser.add_argument('--decision-metric', choices=['bleu', 'meteor', 'comet'], default='bleu',
+                               help='Metric that decides when to stop')
+    add_backend_arguments(models_parser)
+
+    systems_parser = subparsers.add_parser('systems', help='Compare the existing output of many systems at once')
+    systems_parser.add_argument('--ref', required=True, help='Reference file')
+    systems_parser.add_argument('--hyps', nargs='+', required=True, help='De-BPE\'d output of every system')
+    systems_parser.add_argument('--metric', choices=['bleu', 'chrf', 'chrf++'], default='bleu', help='Metric')
+    systems_parser.add_argument('--iterations', type=int, default=1000, help='Bootstrap iterations')
+    systems_parser.add_argument('--seed', type=int, default=None, help='Random seed')
+    systems_parser.add_argument('--alpha', type=float, default=0.05, help='Significance level')
+
+    for subparser in (models_parser, systems_parser):
+        subparser.add_argument('--trace', default=None,
+                               help='Save a Chrome trace with the time and memory of every stage to this file')
+
+    args = parser.parse_args()
+    tracer = Tracer(enabled=args.trace is not None)
+
+    if args.command == 'systems':
+        with tracer.stage('sentence_stats', systems=len(args.hyps)):
+            system_stats = load_system_stats(args.hyps, args.ref, (args.metric,))
+        with tracer.stage('bootstrap', iterations=args.iterations):
+            results = multi_system_bootstrap(system_stats, args.metric, args.iterations, args.seed, args.alpha)
+        print_multi_system_results(results, args.alpha)
+    else:
+        from comet import download_model
+        from evaluation import eval
+        evaluator = OpenNMTBootstrapEvaluator(
+            src_file=args.src,
+            baseline_model_path=args.baseline_model,
+            experimental_model_path=args.experimental_model,
+            ref_file=args.ref,
+            eval_class=eval,
+            n_iterations=args.iterations,
+            batch_size=args.batch_size,
+            beam_size=args.beam_size,
+            gpu=args.gpu,
+            backend=backend_from_args(args),
+            cache_path=args.cache,
+            checkpoint_path=args.checkpoint,
+            comet_model=download_model(args.comet_model),
+            tracer=tracer
+        )
+
+        # Run the bootstrap evaluation
+        results = evaluator.run_bootstrap(seed=args.seed, n_workers=args.workers, chunk_size=args.chunk_size,
+                                          adaptive=args.adaptive, min_iterations=args.min_iterations,
+                                          alpha=args.alpha, decision_metric=args.decision_metric)
+
+        # Print the results
+        evaluator.print_results(results)
 
-# Run the bootstrap evaluation
-results = evaluator.run_bootstrap()
+    if args.trace:
+        tracer.report()
+        tracer.save(args.trace)
+        print(f"Trace saved to {args.trace}")
 
-# Print the results
-evaluator.print_results(results)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,312 @@
+"""
+bpe_tuner.py ranks BPE merge counts and vocabulary sizes with cheap corpus
+proxies, so only the most promising settings need a full training run.
+
+Built on ONMTPreprocessor (same files, languages and minimum frequencies):
+    - The train/dev files of both languages are converted once to memory-mapped
+      token-ID corpora (corpus_store.py) in a cache directory; word frequency
+      tables are bincounts over them and are reused by later runs.
+    - BPE is learned once per language from the frequency table (learn_bpe
+      with is_dict=True) at the largest merge count; every smaller count is the
+      prefix of those codes (BPE(codes, merges=N)), so no candidate is relearned.
+    - Each candidate segments the word types (not the running text) and scores:
+        mean_length     mean subwords per sentence (decoder steps, memory)
+        unk_rate        dev subword tokens outside the vocabulary (<unk>)
+        tail_mass       train subword tokens of rare or dropped types
+                        (embeddings that are barely trained)
+        ratio_variance  variance of log(target/source) subword lengths
+    - Candidates are ranked by a weighted mean of their per-proxy ranks.
+"""
+import argparse
+import json
+import os
+from collections import Counter
+from itertools import product
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from subword_nmt.apply_bpe import BPE
+from subword_nmt.learn_bpe import learn_bpe
+from corpus_store import MmapCorpus, text_to_corpus
+from instrumentation import Tracer
+from preprocess_onmt import ONMTPreprocessor
+
+PROXIES = ('mean_length', 'unk_rate', 'tail_mass', 'ratio_variance')
+DEFAULT_WEIGHTS = {'mean_length': 1.0, 'unk_rate': 1.0, 'tail_mass': 1.0, 'ratio_variance': 1.0}
+
+
+class BPETuner:
+    def __init__(self,
+                 preprocessor: ONMTPreprocessor,
+                 cache_dir: Optional[str] = None,
+                 rare_threshold: int = 10) -> None:
+        """
+        Score BPE settings for the files of a preprocessor (see set_file_paths).
+
+        Args:
+            preprocessor: ONMTPreprocessor with its file paths set
+            cache_dir: Directory for the token-ID corpora and learned codes;
+                defaults to OUTPUT_DIR/bpe_tuner_cache
+            rare_threshold: Subword types seen fewer times in training count
+                towards the tail mass
+        """
+        self.preprocessor = preprocessor
+        self.langs = (preprocessor.src_lang, preprocessor.tgt_lang)
+        self.min_frequency = {preprocessor.src_lang: preprocessor.src_min_frequency,
+                              preprocessor.tgt_lang: preprocessor.tgt_min_frequency}
+        self.cache_dir = cache_dir or os.path.join(preprocessor.output_dir, "bpe_tuner_cache")
+        self.rare_threshold = rare_threshold
+        self.logger = preprocessor.logger
+        self.tracer = preprocessor.tracer
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.corpora: Dict[Tuple[str, str], MmapCorpus] = {}
+        # Word frequencies per language, indexed by the token IDs of the cached corpora
+        self.train_counts: Dict[str, np.ndarray] = {}
+        self.dev_counts: Dict[str, np.ndarray] = {}
+        # Per (lang, merges): subword lengths of every word type and subword frequencies
+        self._segmentations: Dict[Tuple[str, int], dict] = {}
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.cache_dir, "manifest.json")
+
+    def _load_manifest(self) -> dict:
+        if os.path.exists(self._manifest_path()):
+            with open(self._manifest_path(), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {}
+
+    def _save_manifest(self, manifest: dict) -> None:
+        with open(self._manifest_path(), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1)
+
+    @staticmethod
+    def _source_key(path: str) -> str:
+        """Identifies a file version, so cached tables are rebuilt when it changes."""
+        stat = os.stat(path)
+        return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def load_corpora(self) -> None:
+        """Convert (or reuse) the train/dev corpora and count word frequencies."""
+        manifest = self._load_manifest()
+        for lang in self.langs:
+            train_path = self.preprocessor.files[f"train_{lang}"]
+            dev_path = self.preprocessor.files[f"dev_{lang}"]
+            key = f"{self._source_key(train_path)}|{self._source_key(dev_path)}"
+            train_prefix = os.path.join(self.cache_dir, f"train.{lang}")
+            dev_prefix = os.path.join(self.cache_dir, f"dev.{lang}")
+            with self.tracer.stage('tuner_corpus', lang=lang) as stage:
+                if manifest.get(f"corpus.{lang}") == key:
+                    train, dev = MmapCorpus(train_prefix), MmapCorpus(dev_prefix)
+                    self.logger.info(f"Using cached {lang} frequency tables")
+                else:
+                    train = text_to_corpus(train_path, train_prefix)
+                    # The dev corpus extends the train vocabulary, so IDs are shared
+                    dev = text_to_corpus(dev_path, dev_prefix, train.vocab)
+                    manifest[f"corpus.{lang}"] = key
+                    # Codes learned from the old tables are stale
+                    manifest.pop(f"codes.{lang}", None)
+                    self._save_manifest(manifest)
+                stage.add(lines=len(train) + len(dev))
+            self.corpora[('train', lang)] = train
+            self.corpora[('dev', lang)] = dev
+            self.train_counts[lang] = np.bincount(train.ids, minlength=len(dev.vocab))
+            self.dev_counts[lang] = np.bincount(dev.ids, minlength=len(dev.vocab))
+        assert len(self.corpora[('train', self.langs[0])]) == len(self.corpora[('train', self.langs[1])]), \
+            "Source and target training files must have the same number of lines"
+
+    def learn_codes(self, lang: str, max_merges: int) -> str:
+        """Learn BPE codes for the largest merge count from the frequency table (cached)."""
+        manifest = self._load_manifest()
+        codes_path = os.path.join(self.cache_dir, f"codes.{lang}")
+        cached = manifest.get(f"codes.{lang}")
+        if cached is not None and cached >= max_merges and os.path.exists(codes_path):
+            return codes_path
+
+        vocab = self.corpora[('dev', lang)].vocab
+        counts = self.train_counts[lang]
+        dictionary = [f"{vocab[i]} {counts[i]}\n" for i in np.flatnonzero(counts)]
+        self.logger.info(f"Learning {max_merges} BPE merges for {lang} from {len(dictionary)} word types...")
+        with self.tracer.stage('tuner_learn_bpe', lang=lang, lines=len(dictionary)), \
+             open(codes_path, 'w', encoding='utf-8') as codes_file:
+            learn_bpe(dictionary, codes_file, num_symbols=max_merges, is_dict=True)
+        manifest[f"codes.{lang}"] = max_merges
+        self._save_manifest(manifest)
+        return codes_path
+
+    def segment(self, lang: str, merges: int, codes_path: str) -> dict:
+        """Segment every word type with the first `merges` codes."""
+        key = (lang, merges)
+        if key in self._segmentations:
+            return self._segmentations[key]
+        vocab = self.corpora[('dev', lang)].vocab
+        train_counts, dev_counts = self.train_counts[lang], self.dev_counts[lang]
+        with open(codes_path, 'r', encoding='utf-8') as codes_file:
+            bpe = BPE(codes_file, merges=merges)
+
+        lengths = np.zeros(len(vocab), dtype=np.int64)
+        train_subwords: Counter = Counter()
+        dev_subwords: Counter = Counter()
+        with self.tracer.stage('tuner_segment', lang=lang, merges=merges, lines=len(vocab)):
+            for i, word in enumerate(vocab):
+                subwords = bpe.segment_tokens([word])
+                lengths[i] = len(subwords)
+                for subword in subwords:
+                    if train_counts[i]:
+                        train_subwords[subword] += int(train_counts[i])
+                    if dev_counts[i]:
+                        dev_subwords[subword] += int(dev_counts[i])
+
+            # Subwords per sentence: sum of the word lengths between line offsets
+            train = self.corpora[('train', lang)]
+            cumulative = np.concatenate([[0], np.cumsum(lengths[train.ids])])
+            sentence_lengths = cumulative[train.offsets[1:]] - cumulative[train.offsets[:-1]]
+
+        self._segmentations[key] = {
+            'train_subwords': train_subwords,
+            'dev_subwords': dev_subwords,
+            'sentence_lengths': sentence_lengths,
+            'subwords_per_word': float(lengths @ train_counts) / max(int(train_counts.sum()), 1),
+        }
+        return self._segmentations[key]
+
+    def side_proxies(self, lang: str, merges: int, vocab_size: Optional[int], codes_path: str) -> dict:
+        """Proxies of one language side for a merge count and vocabulary size."""
+        segmentation = self.segment(lang, merges, codes_path)
+        train_subwords = segmentation['train_subwords']
+        dev_subwords = segmentation['dev_subwords']
+        # OpenNMT keeps the most frequent types, above the minimum frequency
+        kept = [(s, n) for s, n in train_subwords.most_common(vocab_size) if n >= self.min_frequency[lang]]
+        kept_types = {s for s, _ in kept}
+        train_total = sum(train_subwords.values())
+        dev_total = sum(dev_subwords.values())
+        well_trained = sum(n for _, n in kept if n >= self.rare_threshold)
+        return {
+            'vocab': len(kept_types),
+            'subwords_per_word': segmentation['subwords_per_word'],
+            'mean_length': float(segmentation['sentence_lengths'].mean()) if train_total else 0.0,
+            'unk_rate': (sum(n for s, n in dev_subwords.items() if s not in kept_types) / dev_total
+                         if dev_total else 0.0),
+            'tail_mass': 1 - well_trained / train_total if train_total else 0.0,
+        }
+
+    def tune(self,
+             src_merges: List[int],
+             tgt_merges: List[int],
+             vocab_sizes: Optional[List[int]] = None,
+             weights: Optional[Dict[str, float]] = None) -> pd.DataFrame:
+        """
+        Score every combination of source/target merge counts (and vocabulary sizes).
+
+        Args:
+            src_merges: Candidate BPE merge counts for the source language
+            tgt_merges: Candidate BPE merge counts for the target language
+            vocab_sizes: Candidate vocabulary sizes (both sides); by default every
+                subword type above the minimum frequency is kept
+            weights: Weight of each proxy in the ranking (see PROXIES)
+
+        Returns:
+            One row per candidate, best first, with the proxies of both sides and the rank score
+        """
+        weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+        if not self.corpora:
+            self.load_corpora()
+        src_lang, tgt_lang = self.langs
+        codes = {src_lang: self.learn_codes(src_lang, max(src_merges)),
+                 tgt_lang: self.learn_codes(tgt_lang, max(tgt_merges))}
+
+        rows = []
+        for src_n, tgt_n, vocab_size in product(src_merges, tgt_merges, vocab_sizes or [None]):
+            src = self.side_proxies(src_lang, src_n, vocab_size, codes[src_lang])
+            tgt = self.side_proxies(tgt_lang, tgt_n, vocab_size, codes[tgt_lang])
+            src_lengths = self._segmentations[(src_lang, src_n)]['sentence_lengths']
+            tgt_lengths = self._segmentations[(tgt_lang, tgt_n)]['sentence_lengths']
+            row = {'src_merges': src_n, 'tgt_merges': tgt_n,
+                   'src_vocab': src['vocab'], 'tgt_vocab': tgt['vocab']}
+            for proxy in ('subwords_per_word', 'mean_length', 'unk_rate', 'tail_mass'):
+                row[f'src_{proxy}'] = src[proxy]
+                row[f'tgt_{proxy}'] = tgt[proxy]
+            row['mean_length'] = (src['mean_length'] + tgt['mean_length']) / 2
+            row['unk_rate'] = (src['unk_rate'] + tgt['unk_rate']) / 2
+            row['tail_mass'] = (src['tail_mass'] + tgt['tail_mass']) / 2
+            row['ratio_variance'] = float(np.var(np.log((tgt_lengths + 1) / (src_lengths + 1))))
+            rows.append(row)
+
+        # Vocabulary sizes above the number of subword types give the same candidate
+        results = pd.DataFrame(rows).drop_duplicates(['src_merges', 'tgt_merges', 'src_vocab', 'tgt_vocab'])
+        # Lower is better for every proxy; ranks make them comparable
+        total_weight = sum(weights[p] for p in PROXIES) or 1.0
+        results['score'] = sum(weights[p] * results[p].rank(pct=True) for p in PROXIES) / total_weight
+        return results.sort_values('score').reset_index(drop=True)
+
+    def apply(self, best: pd.Series) -> None:
+        """Set a candidate's merge counts and vocabulary sizes on the preprocessor."""
+        self.preprocessor.src_bpe_operations = int(best['src_merges'])
+        self.preprocessor.tgt_bpe_operations = int(best['tgt_merges'])
+        self.preprocessor.src_vocab_size = int(best['src_vocab'])
+        self.preprocessor.tgt_vocab_size = int(best['tgt_vocab'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rank BPE merge counts and vocabulary sizes with cheap corpus proxies')
+    parser.add_argument('--train-src', required=True, help='Training source file')
+    parser.add_argument('--train-tgt', required=True, help='Training target file')
+    parser.add_argument('--dev-src', required=True, help='Validation source file')
+    parser.add_argument('--dev-tgt', required=True, help='Validation target file')
+    parser.add_argument('--src-lang', default='src', help='Source language code')
+    parser.add_argument('--tgt-lang', default='tgt', help='Target language code')
+    parser.add_argument('--output-dir', default='onmt_data', help='Directory for the cache and the ranking')
+    parser.add_argument('--merges', type=int, nargs='+', default=[2000, 3000, 4000, 5000, 6000, 7000, 8000],
+                        help='Candidate merge counts for both languages')
+    parser.add_argument('--src-merges', type=int, nargs='+', default=None, help='Source merge counts (default --merges)')
+    parser.add_argument('--tgt-merges', type=int, nargs='+', default=None, help='Target merge counts (default --merges)')
+    parser.add_argument('--vocab-sizes', type=int, nargs='*', default=None,
+                        help='Candidate vocabulary sizes (default: all types above the minimum frequency)')
+    parser.add_argument('--src-min-frequency', type=int, default=2, help='Minimum token frequency for source')
+    parser.add_argument('--tgt-min-frequency', type=int, default=1, help='Minimum token frequency for target')
+    parser.add_argument('--rare-threshold', type=int, default=10, help='Subword types seen less often count as tail')
+    parser.add_argument('--weights', type=float, nargs=4, default=[1.0, 1.0, 1.0, 1.0],
+                        metavar=('LENGTH', 'UNK', 'TAIL', 'RATIO'), help='Weights of the proxies in the ranking')
+    parser.add_argument('--top', type=int, default=10, help='Candidates to print')
+    parser.add_argument('--trace', default=None,
+                        help='Save a Chrome trace with the time and memory of every stage to this file')
+    args = parser.parse_args()
+
+    preprocessor = ONMTPreprocessor(args.src_lang, args.tgt_lang,
+                                    src_min_frequency=args.src_min_frequency,
+                                    tgt_min_frequency=args.tgt_min_frequency,
+                                    tracer=Tracer(enabled=args.trace is not None))
+    preprocessor.set_file_paths(os.path.abspath(args.train_src), os.path.abspath(args.train_tgt),
+                                os.path.abspath(args.dev_src), os.path.abspath(args.dev_tgt),
+                                args.output_dir, "data")
+    tuner = BPETuner(preprocessor, rare_threshold=args.rare_threshold)
+    results = tuner.tune(args.src_merges or args.merges, args.tgt_merges or args.merges,
+                         args.vocab_sizes, dict(zip(PROXIES, args.weights)))
+
+    output_file = os.path.join(args.output_dir, "bpe_tuning.csv")
+    results.to_csv(output_file, index=False)
+    columns = ['src_merges', 'tgt_merges', 'src_vocab', 'tgt_vocab', *PROXIES, 'score']
+    print(results[columns].head(args.top).to_string(float_format=lambda x: f"{x:.4f}"))
+    print(f"\n{len(results)} candidates ranked, saved to {output_file}")
+
+    tuner.apply(results.iloc[0])
+    print("\nBest candidate for preprocess_onmt.py:")
+    print(f"  --src-bpe-operations {preprocessor.src_bpe_operations} --tgt-bpe-operations {preprocessor.tgt_bpe_operations} "
+          f"--src-vocab-size {preprocessor.src_vocab_size} --tgt-vocab-size {preprocessor.tgt_vocab_size}")
+
+    if args.trace:
+        preprocessor.tracer.report(preprocessor.logger.info)
+        preprocessor.tracer.save(args.trace)
+        preprocessor.logger.info(f"Trace saved to {args.trace}")
+
+
+if __name__ == "__main__":
+    main()
+
+# Example:
+# python bpe_tuner.py \
+#   --train-src processed_data_moses/salt.train.tk.lc.clean.ach \
+#   --train-tgt processed_data_moses/salt.train.tk.lc.clean.eng \
+#   --dev-src processed_data_moses/salt.dev.tk.lc.ach \
+#   --dev-tgt processed_data_moses/salt.dev.tk.lc.eng \
+#   --src-lang ach --tgt-lang en --merges 3000 5000 7000 9000 --vocab-sizes 5000 7000
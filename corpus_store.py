@@ -0,0 +1,285 @@
+"""
+corpus_store.py contains a memory-mapped binary format for tokenized corpora.
+
+A corpus saved under PREFIX consists of three files:
+    PREFIX.ids.npy      token IDs of all lines, concatenated (uint32)
+    PREFIX.offsets.npy  line boundaries, line i is ids[offsets[i]:offsets[i+1]] (int64)
+    PREFIX.vocab.txt    one token per line, the line number is the token ID
+
+The .npy files are opened with mmap_mode='r', so random access to a line is O(1)
+and worker processes opening the same corpus share the pages through the OS
+page cache instead of each holding a private copy. read_lines returns a lazy
+view that decodes a line only when it is accessed, and token counts and line
+lengths are computed on the ID arrays without building any strings.
+"""
+import argparse
+import os
+from collections import Counter
+from collections.abc import Sequence
+from typing import Dict, Iterator, List, Optional, Union
+import numpy as np
+
+# Lines decoded per numpy gather when iterating over a corpus
+DECODE_BLOCK = 4096
+
+IDS_SUFFIX = ".ids.npy"
+OFFSETS_SUFFIX = ".offsets.npy"
+VOCAB_SUFFIX = ".vocab.txt"
+
+
+def is_corpus(path: str) -> bool:
+    """Check whether path is the prefix of a saved corpus."""
+    path = os.fspath(path)
+    return os.path.exists(path + IDS_SUFFIX) and os.path.exists(path + OFFSETS_SUFFIX)
+
+
+def read_vocab(vocab_path: str) -> List[str]:
+    """Read a vocabulary file with one token per line."""
+    with open(vocab_path, 'r', encoding='utf-8') as f:
+        return [line.rstrip('\n') for line in f]
+
+
+class MmapCorpus:
+    def __init__(self, prefix: str) -> None:
+        """
+        Read-only view of a corpus saved with text_to_corpus.
+
+        Args:
+            prefix: Path prefix the corpus files were saved under
+        """
+        self.prefix = prefix
+        self.ids = np.load(prefix + IDS_SUFFIX, mmap_mode='r')
+        self.offsets = np.load(prefix + OFFSETS_SUFFIX, mmap_mode='r')
+        self.vocab = read_vocab(prefix + VOCAB_SUFFIX)
+        # Token strings indexable by an ID array, so decoding is one gather per line or block
+        self._tokens = np.array(self.vocab, dtype=object)
+
+    def __getstate__(self) -> dict:
+        # Pickle the prefix only, every process maps the files itself
+        return {'prefix': self.prefix}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state['prefix'])
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        """Return the token IDs of line i as a view into the memory map."""
+        if i < 0:
+            i += len(self)
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def tokens(self, i: int) -> List[str]:
+        """Return line i as a list of tokens."""
+        return self._tokens[self[i]].tolist()
+
+    def line(self, i: int) -> str:
+        """Return line i as a space-joined string."""
+        return ' '.join(self.tokens(i))
+
+    def lines(self, start: int = 0, stop: Optional[int] = None) -> Iterator[str]:
+        """Iterate over lines start..stop as strings, decoding DECODE_BLOCK lines at a time."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        for block_start in range(start, stop, DECODE_BLOCK):
+            block_stop = min(block_start + DECODE_BLOCK, stop)
+            offsets = np.asarray(self.offsets[block_start:block_stop + 1])
+            tokens = self._tokens[self.ids[offsets[0]:offsets[-1]]].tolist()
+            bounds = (offsets - offsets[0]).tolist()
+            for begin, end in zip(bounds, bounds[1:]):
+                yield ' '.join(tokens[begin:end])
+
+    def lengths(self) -> np.ndarray:
+        """Return the number of tokens in every line."""
+        return np.diff(self.offsets)
+
+    def token_counts(self) -> Counter:
+        """Return the frequency of every token, counted on the ID array."""
+        counts = np.bincount(self.ids, minlength=len(self.vocab))
+        return Counter({self.vocab[i]: int(counts[i]) for i in np.flatnonzero(counts)})
+
+
+class CorpusLines(Sequence):
+    def __init__(self, corpus: MmapCorpus) -> None:
+        """
+        Read-only sequence of the lines of a corpus, as returned by read_lines.
+
+        A line is decoded from the memory map when it is accessed, so holding
+        the view (or pickling it to a worker, which reopens the files) costs no
+        more than the corpus' page cache.
+
+        Args:
+            corpus: The corpus to view
+        """
+        self.corpus = corpus
+
+    def __len__(self) -> int:
+        return len(self.corpus)
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step == 1:
+                return list(self.corpus.lines(start, stop))
+            return [self.corpus.line(j) for j in range(start, stop, step)]
+        if not -len(self) <= i < len(self):
+            raise IndexError(f"line {i} out of range for a corpus of {len(self)} lines")
+        return self.corpus.line(i)
+
+    def __iter__(self) -> Iterator[str]:
+        return self.corpus.lines()
+
+
+def text_to_corpus(text_path: str, prefix: str, vocab: Optional[List[str]] = None) -> MmapCorpus:
+    """
+    Convert a whitespace-tokenized text file (e.g. .tk.lc or .bpe) to the binary format.
+
+    The file is streamed twice: once to build the vocabulary and count tokens,
+    and once to fill the preallocated memory-mapped arrays, so the conversion
+    never holds the whole corpus as Python objects.
+
+    Args:
+        text_path: Path to the tokenized text file
+        prefix: Path prefix for the output files
+        vocab: Optional existing vocabulary to extend, so that several files
+            (e.g. train/dev/test of one language) share token IDs
+    """
+    vocab = list(vocab) if vocab else []
+    token_to_id: Dict[str, int] = {token: i for i, token in enumerate(vocab)}
+    n_tokens = 0
+    n_lines = 0
+
+    with open(text_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            n_lines += 1
+            for token in line.split():
+                n_tokens += 1
+                if token not in token_to_id:
+                    token_to_id[token] = len(vocab)
+                    vocab.append(token)
+
+    directory = os.path.dirname(prefix)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    ids = np.lib.format.open_memmap(prefix + IDS_SUFFIX, mode='w+', dtype=np.uint32, shape=(n_tokens,))
+    offsets = np.lib.format.open_memmap(prefix + OFFSETS_SUFFIX, mode='w+', dtype=np.int64, shape=(n_lines + 1,))
+    offsets[0] = 0
+    position = 0
+    with open(text_path, 'r', encoding='utf-8') as f:
+        for i, line in enumerate(f):
+            line_ids = [token_to_id[token] for token in line.split()]
+            ids[position:position + len(line_ids)] = line_ids
+            position += len(line_ids)
+            offsets[i + 1] = position
+    ids.flush()
+    offsets.flush()
+    del ids, offsets
+
+    with open(prefix + VOCAB_SUFFIX, 'w', encoding='utf-8') as f:
+        for token in vocab:
+            f.write(token + '\n')
+
+    return MmapCorpus(prefix)
+
+
+def corpus_to_text(prefix: str, text_path: str) -> None:
+    """Write a saved corpus back to a whitespace-tokenized text file."""
+    with open(text_path, 'w', encoding='utf-8') as f:
+        f.writelines(iter_lines(prefix))
+
+
+def read_lines(path: str) -> Sequence:
+    """
+    Read a corpus as a sequence of stripped lines.
+
+    Accepts either a plain text file or the prefix of a saved binary corpus,
+    so scripts can be pointed at whichever representation exists. A text file
+    is read into a list; a binary corpus is returned as a lazy CorpusLines view.
+    """
+    if is_corpus(path):
+        return CorpusLines(MmapCorpus(path))
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f]
+
+
+def iter_lines(path: str) -> Iterator[str]:
+    """Stream the lines of a text file or saved corpus, each ending in a newline."""
+    if is_corpus(path):
+        for line in MmapCorpus(path).lines():
+            yield line + '\n'
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        yield from f
+
+
+def count_lines(path: str) -> int:
+    """Number of lines of a text file or saved corpus."""
+    if is_corpus(path):
+        return len(MmapCorpus(path))
+    with open(path, 'rb') as f:
+        return sum(1 for _ in f)
+
+
+def read_lengths(path: str) -> np.ndarray:
+    """Number of whitespace-separated tokens of every line of a text file or saved corpus."""
+    if is_corpus(path):
+        return np.asarray(MmapCorpus(path).lengths())
+    with open(path, 'r', encoding='utf-8') as f:
+        return np.fromiter((len(line.split()) for line in f), dtype=np.int64)
+
+
+def count_tokens(path: str) -> Counter:
+    """Token frequencies of a text file or saved corpus (a bincount over the IDs for a corpus)."""
+    if is_corpus(path):
+        return MmapCorpus(path).token_counts()
+    counts = Counter()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            counts.update(line.split())
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert tokenized text files to and from the memory-mapped corpus format')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    encode_parser = subparsers.add_parser('encode', help='Convert a text file to the binary format')
+    encode_parser.add_argument('input', help='Tokenized text file (.tk.lc, .bpe, ...)')
+    encode_parser.add_argument('prefix', help='Output prefix')
+    encode_parser.add_argument('--vocab', help='Existing vocabulary file to extend')
+
+    decode_parser = subparsers.add_parser('decode', help='Convert a binary corpus back to text')
+    decode_parser.add_argument('prefix', help='Corpus prefix')
+    decode_parser.add_argument('output', help='Output text file')
+
+    info_parser = subparsers.add_parser('info', help='Print corpus statistics')
+    info_parser.add_argument('prefix', help='Corpus prefix')
+
+    args = parser.parse_args()
+
+    if args.command == 'encode':
+        vocab = read_vocab(args.vocab) if args.vocab else None
+        corpus = text_to_corpus(args.input, args.prefix, vocab)
+        print(f"Saved {len(corpus)} lines, {len(corpus.ids)} tokens, {len(corpus.vocab)} types to {args.prefix}.*")
+    elif args.command == 'decode':
+        corpus_to_text(args.prefix, args.output)
+        print(f"Text saved to {args.output}")
+    else:
+        corpus = MmapCorpus(args.prefix)
+        lengths = corpus.lengths()
+        print(f"Lines: {len(corpus)}")
+        print(f"Tokens: {len(corpus.ids)}")
+        print(f"Vocabulary size: {len(corpus.vocab)}")
+        if len(lengths):
+            print(f"Mean line length: {lengths.mean():.2f}")
+            print(f"Max line length: {lengths.max()}")
+
+
+if __name__ == "__main__":
+    main()
+
+# Example:
+# python corpus_store.py encode processed_data_moses/salt.train.tk.lc.ach corpora/salt.train.ach
+# python corpus_store.py encode onmt_data/train.bpe.ach corpora/train.bpe.ach
+# python corpus_store.py decode corpora/train.bpe.ach /tmp/train.bpe.ach
@@ -1,14 +1,90 @@
 import nltk.translate.meteor_score as meteor
 # import nltk.translate.ribes_score as ribes
-import nltk.translate.bleu_score as bleu
+from metric_stats import SentenceStats
+from instrumentation import Tracer
+from translation_cache import TranslationCache
+from corpus_store import read_lines
 import nltk
 from comet import download_model, load_from_checkpoint
 import statistics
+import time
+import argparse
+import hashlib
+import json
+import os
+from typing import Iterator, Optional
 
 #Unbabel/XCOMET-XL
 #Unbabel/wmt22-comet-da
+
+# COMET models loaded in this process, by checkpoint path
+_comet_models = {}
+_wordnet_downloaded = False
+
+
+def load_comet_model(model):
+    """returns the loaded COMET model of a checkpoint path, loading each checkpoint only once per process.
+    anything else (an already loaded model) is returned as is."""
+    if not isinstance(model, (str, os.PathLike)):
+        return model
+    path = os.path.abspath(os.fspath(model))
+    if path not in _comet_models:
+        _comet_models[path] = load_from_checkpoint(path)
+    return _comet_models[path]
+
+
+def download_wordnet() -> None:
+    """downloads the wordnet data for METEOR once per process"""
+    global _wordnet_downloaded
+    if not _wordnet_downloaded:
+        nltk.download('wordnet')
+        _wordnet_downloaded = True
+
+
+class QECache:
+    def __init__(self, cache_file: str) -> None:
+        """a persistent cache of reference-free (QE) COMET scores, stored as one json object per line.
+        entries are keyed by the COMET model and the (src, mt) pair.
+
+        Args:
+            cache_file (str): path to the jsonl cache file, created if it does not exist
+        """
+        self.cache_file = cache_file
+        self.scores = {}
+        if os.path.exists(cache_file):
+            with open(cache_file, encoding='utf-8') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.scores[entry["key"]] = entry["score"]
+
+    @staticmethod
+    def model_key(model) -> Optional[str]:
+        """stable identifier of a COMET model: the hash of its checkpoint file, as in TranslationCache.
+        an already loaded model object has none (its str() changes every run), so None is returned."""
+        if isinstance(model, (str, os.PathLike)):
+            return TranslationCache.model_hash(os.fspath(model))
+        return None
+
+    @staticmethod
+    def key(model: str, src: str, mt: str) -> str:
+        return hashlib.sha1(f"{model}\t{src}\t{mt}".encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[float]:
+        return self.scores.get(key)
+
+    def add(self, entries: dict) -> None:
+        """adds {key: score} entries and appends them to the cache file"""
+        self.scores.update(entries)
+        with open(self.cache_file, 'a', encoding='utf-8') as f:
+            for key, score in entries.items():
+                f.write(json.dumps({"key": key, "score": score}) + "\n")
+
+
 class eval:
-    def __init__(self, source_file, translation_out, refference_file, model) -> None:
+    def __init__(self, source_file, translation_out, refference_file, model,
+                 comet_batch_size: int = 16, comet_gpus: int = 1, comet_threads: Optional[int] = None,
+                 comet_workers: Optional[int] = None, comet_chunk_batches: int = 8,
+                 tracer: Optional[Tracer] = None) -> None:
         """this class contains methods to evaluate the quality of a machine translation. to use it, pass three files of paralell translation
         one file conatins the untranslated source text, one is a reliable paralell translation of the source file, 
         and one contains a machine traslated attempt att translating the source file
@@ -22,9 +98,19 @@ class eval:
             refference_file (str): path to a flie where the paralell refference translation of the source
             model (str, optional): a comet model aquired with comet.download_model(["model name"]). Normally "Unbabel/wmt20-comet-qe-da". 
             others include "Unbabel/wmt22-comet-da" https://huggingface.co/Unbabel for more.
+            an already loaded model (anything with a comet-style predict method) can be passed instead of a path.
+            comet_batch_size (int, optional): number of samples per COMET forward pass.
+            comet_gpus (int, optional): number of GPUs for COMET, 0 runs on CPU.
+            comet_threads (int, optional): number of torch CPU threads, None keeps the torch default.
+            comet_workers (int, optional): number of dataloader worker processes for COMET.
+            comet_chunk_batches (int, optional): batches passed to comet_model.predict per call; 
+            results are returned (and throughput logged) after every call.
+            tracer (Tracer, optional): records the time and memory of every metric.
         """
         
         self.bleu_score = float
+        self.chrf_score = float
+        self.sentence_stats = None
         self.comet_score = float
         self.comet_score_list = []
         self.meteor_score = float
@@ -34,21 +120,32 @@ class eval:
         self.trans = translation_out
         self.ref = refference_file
         self.model_path = model
-        self.comet_model = load_from_checkpoint(self.model_path)
+        self.comet_batch_size = comet_batch_size
+        self.comet_gpus = comet_gpus
+        self.comet_threads = comet_threads
+        self.comet_workers = comet_workers
+        self.comet_chunk_batches = comet_chunk_batches
+        self.tracer = tracer or Tracer(enabled=False)
+        # a path is loaded with comet (once per process), anything else is used as an already loaded model
+        self.comet_model = load_comet_model(model)
         
-        nltk.download('wordnet')
+        download_wordnet()
 
-    def bleu(self, hypothesis: list[list[str]], refferences: list[list[str]]) -> float:
-        """calculates BLEU-score for all lines
+    def bleu(self, hypothesis: list[list[str]], refferences: list[list[list[str]]]) -> float:
+        """calculates BLEU-score for all lines, using the same sacrebleu statistics as batch_translate.py.
+        the per-sentence BLEU and chrF statistics are kept in self.sentence_stats for scoring subsets later.
 
         Args:
             hypothesis (list[list[str]]): list of machine translated tokenised line 
-            refferences (list[list[str]]): list of tokenized reference line. 
+            refferences (list[list[list[str]]]): list of tokenized reference lines (one reference per line). 
 
         Returns:
-            BLEU-score(float): combined score of all translated line. 
+            BLEU-score(float): combined score of all translated line (0-100). 
         """
-        return bleu.corpus_bleu(list_of_references=refferences, hypotheses=hypothesis)
+        self.sentence_stats = SentenceStats([" ".join(hyp) for hyp in hypothesis],
+                                            [" ".join(refs[0]) for refs in refferences],
+                                            ('bleu', 'chrf'))
+        return self.sentence_stats.score('bleu')
     
     def meteor (self,  hypothesis: list[str], refferences: list[list[str]]) -> list[float]:
 
@@ -81,31 +178,102 @@ class eval:
         Returns:
             list(float)
         """
+        scores = [None] * len(data)
+        for i, score in self.comet_stream(data):
+            scores[i] = score
+        return scores
+
+    def comet_stream(self, data: list[dict]) -> Iterator[tuple[int, float]]:
+        """scores the samples in chunks of length-sorted batches and yields (index, score) pairs 
+        as soon as each chunk is done. the index is the position of the sample in data.
+
+        Args:
+            data (list[dict]): samples in the same format as for comet()
+
+        Yields:
+            tuple(int, float): index of the sample in data and its COMET score
+        """
+        if self.comet_threads:
+            import torch
+            torch.set_num_threads(self.comet_threads)
 
-        model_output = self.comet_model.predict(samples=data)
-        return model_output.scores
+        # sorting by length keeps padding within a batch small
+        order = sorted(range(len(data)), key=lambda i: sum(len(value) for value in data[i].values()))
+        chunk_size = self.comet_batch_size * self.comet_chunk_batches
+        done = 0
+        start_time = time.time()
+        for start in range(0, len(order), chunk_size):
+            chunk = order[start:start + chunk_size]
+            chunk_start = time.time()
+            model_output = self.comet_model.predict(samples=[data[i] for i in chunk],
+                                                    batch_size=self.comet_batch_size,
+                                                    gpus=self.comet_gpus,
+                                                    num_workers=self.comet_workers,
+                                                    progress_bar=False,
+                                                    length_batching=False)
+            elapsed = time.time() - chunk_start
+            done += len(chunk)
+            print(f"COMET: {done}/{len(data)} samples, "
+                  f"{len(chunk) / elapsed if elapsed > 0 else 0:.1f} samples/sec in this chunk, "
+                  f"{done / (time.time() - start_time):.1f} samples/sec overall")
+            for i, score in zip(chunk, model_output.scores):
+                yield i, score
     
+    def qe_score_pairs(self, src_lines: list[str], mt_lines: list[str], cache_file: Optional[str] = None) -> list[float]:
+        """scores (src, mt) pairs with a reference-free COMET (QE) model. identical pairs are only scored once, 
+        and pairs found in the cache are not scored again. useful for quality filtering n-best lists or back-translated data.
+
+        Args:
+            src_lines (list[str]): source sentences
+            mt_lines (list[str]): machine translations, paralell to src_lines
+            cache_file (str, optional): path to a QECache jsonl file
+
+        Returns:
+            list[float]: one QE score per pair, in the original order
+        """
+        cache = QECache(cache_file) if cache_file else None
+        model_key = QECache.model_key(self.model_path)
+        if cache is not None and model_key is None:
+            print("QE: the COMET model was passed as a loaded object, not a checkpoint path; not caching its scores")
+            cache = None
+        keys = [QECache.key(model_key or "", src.strip(), mt.strip()) for src, mt in zip(src_lines, mt_lines)]
+
+        # deduplicate identical pairs and drop the ones already in the cache
+        unique = {}
+        for key, src, mt in zip(keys, src_lines, mt_lines):
+            if key not in unique and (cache is None or cache.get(key) is None):
+                unique[key] = {"src": src.strip(), "mt": mt.strip()}
+        print(f"QE: {len(keys)} pairs, {len(set(keys))} unique, {len(unique)} to score")
+
+        new_scores = dict(zip(unique, self.comet(list(unique.values())))) if unique else {}
+        if cache is not None and new_scores:
+            cache.add(new_scores)
+        return [new_scores[key] if key in new_scores else cache.get(key) for key in keys]
+
+    def qe_evaluation(self, cache_file: Optional[str] = None):
+        """makes a reference-free evaluation of the translation using only the COMET-QE model
+        """
+        src = read_lines(self.src)
+        hypothesis = read_lines(self.trans)
+
+        with self.tracer.stage('comet_qe', lines=len(hypothesis)):
+            self.comet_score_list = self.qe_score_pairs(src, hypothesis, cache_file)
+        self.comet_score = statistics.mean(self.comet_score_list)
+        print ("COMET-QE score: ", self.comet_score)
+
     def full_evaluation(self, do_you_want_to_run_comet=True):
-        """makes a full evaluation of the translation using METEOR, COMET and BLEU
+        """makes a full evaluation of the translation using METEOR, COMET, BLEU and chrF
         """
-        src = []
-        hypothesis = []
-        bleu_refference = []
-        refference = []
-        with open (self.src) as f:
-            for line in f:
-                src.append(line)
-        with open (self.trans) as g:
-            for line in g:
-                hypothesis.append(line.split())
-        with open (self.ref) as h:
-            for line in h:
-                bleu_refference.append([line.split()])
-                refference.append(line.split())
+        # every file may also be the prefix of a memory-mapped corpus (corpus_store.py)
+        src = read_lines(self.src)
+        hypothesis = [line.split() for line in read_lines(self.trans)]
+        refference = [line.split() for line in read_lines(self.ref)]
+        bleu_refference = [[ref] for ref in refference]
         
         
-        for hyp, ref in zip (hypothesis, refference):       
-            self.meteor_score_list.append(self.meteor(refferences=[ref], hypothesis=hyp))
+        with self.tracer.stage('meteor', lines=len(hypothesis)):
+            for hyp, ref in zip (hypothesis, refference):       
+                self.meteor_score_list.append(self.meteor(refferences=[ref], hypothesis=hyp))
         if do_you_want_to_run_comet:
             print("running comet")
             comet_data = []
@@ -114,30 +282,68 @@ class eval:
                 comet_data.append({"src":src, "mt": " ".join(hyp), "ref": " ".join(ref)})
         
         if do_you_want_to_run_comet:    
-            self.comet_score_list = (self.comet(comet_data))
+            with self.tracer.stage('comet', lines=len(comet_data)):
+                self.comet_score_list = (self.comet(comet_data))
             self.comet_score = statistics.mean(self.comet_score_list)
         
         self.meteor_score = statistics.mean(self.meteor_score_list)
-        self.bleu_score = self.bleu(hypothesis=hypothesis, refferences=bleu_refference)
+        with self.tracer.stage('bleu_chrf', lines=len(hypothesis), tokens=sum(len(hyp) for hyp in hypothesis)):
+            self.bleu_score = self.bleu(hypothesis=hypothesis, refferences=bleu_refference)
+            self.chrf_score = self.sentence_stats.score('chrf')
         
         # printing out the resiults for now. make better output later.       
         print ("COMET score: ", self.comet_score)
         print ("METEOR score: ", self.meteor_score)
         print ("BLEU score: ",  self.bleu_score)
+        print ("chrF score: ",  self.chrf_score)
 
 
 
 
-if __name__ =="__main__":
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate machine translation output with BLEU, chrF, METEOR and COMET')
+    parser.add_argument('--src', default="processed_data_moses/salt.test.tk.lc.ach",
+                        help='Source file')
+    parser.add_argument('--hyp', default="translations_20241102_175428/trans_step8000_beam5_batch32.txt",
+                        help='Machine translation output')
+    parser.add_argument('--ref', default="processed_data_moses/salt.test.tk.lc.eng",
+                        help='Reference file (not needed with --qe-only)')
+    parser.add_argument('--comet-model', default="Unbabel/wmt20-comet-qe-da",
+                        help='COMET model to download and use')
+    parser.add_argument('--qe-only', action='store_true',
+                        help='Only score (src, mt) pairs with the reference-free COMET model')
+    parser.add_argument('--qe-cache', default=None,
+                        help='Cache file for QE scores (jsonl)')
+    parser.add_argument('--no-comet', action='store_true',
+                        help='Skip COMET in the full evaluation')
+    parser.add_argument('--comet-batch-size', type=int, default=16,
+                        help='Samples per COMET batch')
+    parser.add_argument('--comet-gpus', type=int, default=1,
+                        help='GPUs for COMET, 0 for CPU')
+    parser.add_argument('--comet-threads', type=int, default=None,
+                        help='Torch CPU threads for COMET')
+    parser.add_argument('--comet-workers', type=int, default=None,
+                        help='Dataloader workers for COMET')
+    parser.add_argument('--trace', default=None,
+                        help='Save a Chrome trace with the time and memory of every metric to this file')
+    args = parser.parse_args()
 
-    # so far, this is the interface. make an argparse later
-    source_file = "processed_data_moses/salt.test.tk.lc.ach"
-    translation_out = "translations_20241102_175428/trans_step8000_beam5_batch32.txt"
-    refference_file  = "processed_data_moses/salt.test.tk.lc.eng"
-    
-    comet_model = download_model("Unbabel/wmt20-comet-qe-da")
-    ev = eval(source_file, translation_out, refference_file, comet_model)
-   
-    
-    ev.full_evaluation()
-   
\ No newline at end of file
+    comet_model = download_model(args.comet_model)
+    ev = eval(args.src, args.hyp, None if args.qe_only else args.ref, comet_model,
+              comet_batch_size=args.comet_batch_size, comet_gpus=args.comet_gpus,
+              comet_threads=args.comet_threads, comet_workers=args.comet_workers,
+              tracer=Tracer(enabled=args.trace is not None))
+
+    if args.qe_only:
+        ev.qe_evaluation(args.qe_cache)
+    else:
+        ev.full_evaluation(not args.no_comet)
+
+    if args.trace:
+        ev.tracer.report()
+        ev.tracer.save(args.trace)
+        print(f"Trace saved to {args.trace}")
+
+
+if __name__ =="__main__":
+    main()
@@ -1,24 +1,34 @@
 """extract_data.py contains a script for extracting parallel data from a
 multilingual dataset (https://huggingface.co/datasets/Sunbird/salt)"""
 # If needed run: pip install datasets
+import argparse
 import os
+from typing import Optional
 from datasets import load_dataset
+from instrumentation import Tracer
+
+def prepare_data(tracer: Optional[Tracer] = None):
+    tracer = tracer or Tracer(enabled=False)
 
-def prepare_data():
     # Load multilingual dataset for each split
-    train_data = load_dataset("Sunbird/salt", "text-all", split="train")
-    dev_data = load_dataset("Sunbird/salt", "text-all", split="dev")
-    test_data = load_dataset("Sunbird/salt", "text-all", split="test")
+    with tracer.stage('load_dataset', split='train'):
+        train_data = load_dataset("Sunbird/salt", "text-all", split="train")
+    with tracer.stage('load_dataset', split='dev'):
+        dev_data = load_dataset("Sunbird/salt", "text-all", split="dev")
+    with tracer.stage('load_dataset', split='test'):
+        test_data = load_dataset("Sunbird/salt", "text-all", split="test")
 
     # Create data directory if it does not exist
     os.makedirs('data', exist_ok=True)
 
     # Function to write data to files
     def write_to_files(data, ach_file, eng_file):
-        with open(ach_file, 'w', encoding='utf-8') as f_ach, open(eng_file, 'w', encoding='utf-8') as f_eng:
+        with tracer.stage('write_files', file=os.path.basename(ach_file)) as stage, \
+             open(ach_file, 'w', encoding='utf-8') as f_ach, open(eng_file, 'w', encoding='utf-8') as f_eng:
             for item in data:
                 f_ach.write(item['ach_text'] + '\n')
                 f_eng.write(item['eng_text'] + '\n')
+                stage.add(lines=1)
 
     # Write train, dev, and test data to files
     write_to_files(train_data, "data/salt.train.ach", "data/salt.train.en")
@@ -31,4 +41,14 @@ def prepare_data():
     print(f"Test set: salt.test.ach, salt.test.en ({len(test_data)} pairs)")
 
 if __name__ == '__main__':
-    prepare_data()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Extract the Acholi-English part of the SALT dataset')
+    parser.add_argument('--trace', default=None,
+                        help='Save a Chrome trace with the time and memory of every stage to this file')
+    args = parser.parse_args()
+
+    tracer = Tracer(enabled=args.trace is not None)
+    prepare_data(tracer)
+    if args.trace:
+        tracer.report()
+        tracer.save(args.trace)
+        print(f"Trace saved to {args.trace}")
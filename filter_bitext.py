@@ -0,0 +1,400 @@
+"""
+filter_bitext.py removes misaligned and mixed-language pairs from a tokenized
+parallel corpus (e.g. the SALT and Bible training data before preprocess_onmt.py).
+
+Pairs are read in batches and every batch is encoded once as a flat array of
+code points, from which all features are computed with numpy:
+    - token counts and the length ratio of the two sides
+    - script ratio: the share of Latin letters among the letters of each side
+      (digits and punctuation are neutral)
+    - end-punctuation mismatch, as in tools/analyze_line_endings.py
+    - language ID margin: a character n-gram naive Bayes model (CharNgramLID,
+      trained with the train-lid command on a few thousand lines per
+      language) scores every side, the margin is the log-likelihood per n-gram
+      of the expected language minus the best other language
+The thresholds are applied in the same streaming pass, kept pairs are written
+to the output files, and a breakdown of the rejection reasons is logged.
+"""
+import argparse
+import logging
+from collections import Counter
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+from instrumentation import Tracer
+from tools.analyze_line_endings import END_PUNCT
+
+DEFAULT_THRESHOLDS = {
+    'min_tokens': 1,
+    'max_tokens': 80,
+    'max_length_ratio': 3.0,
+    'min_script_ratio': 0.9,
+    'min_lid_margin': 0.0,
+}
+
+REASONS = ('empty', 'too_long', 'length_ratio', 'script', 'punct_mismatch', 'language_id')
+
+NEWLINE = ord('\n')
+SPACE_CODES = np.array([ord(' '), ord('\t'), ord('\r'), NEWLINE], dtype=np.uint32)
+END_PUNCT_CODES = np.array([ord(p) for p in END_PUNCT], dtype=np.uint32)
+HASH_MULTIPLIER = 1000003
+
+
+class EncodedBatch:
+    def __init__(self, lines: Sequence[str]) -> None:
+        """
+        Lines of one side as a flat code point array.
+
+        Every line is stripped, lowercased and stored as " line \\n", so word
+        boundaries are spaces and n-grams never cross lines.
+        """
+        stripped = [line.strip().lower() for line in lines]
+        self.n_lines = len(stripped)
+        self.chars = np.array([len(line) for line in stripped], dtype=np.int64)
+        segment_lengths = self.chars + 3
+        self.starts = np.concatenate([[0], np.cumsum(segment_lengths)[:-1]]).astype(np.int64)
+        text = ''.join(f" {line} \n" for line in stripped)
+        self.codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+        self.line_of = np.repeat(np.arange(self.n_lines), segment_lengths)
+
+    def per_line(self, mask: np.ndarray, weights: Optional[np.ndarray] = None) -> np.ndarray:
+        """Sum a per-position mask (or weights) over every line."""
+        return np.bincount(self.line_of[mask], weights=None if weights is None else weights[mask],
+                           minlength=self.n_lines)
+
+    def token_counts(self) -> np.ndarray:
+        is_space = np.isin(self.codes, SPACE_CODES)
+        # A token starts where a non-space follows a space (every line starts with one)
+        starts = np.zeros(len(self.codes), dtype=bool)
+        starts[1:] = ~is_space[1:] & is_space[:-1]
+        return self.per_line(starts)
+
+    def script_ratio(self) -> np.ndarray:
+        """Share of Latin letters (ASCII and Latin-1/Extended, e.g. ŋ) among all letters."""
+        c = self.codes
+        ascii_letter = ((c >= ord('a')) & (c <= ord('z'))) | ((c >= ord('A')) & (c <= ord('Z')))
+        latin = ascii_letter | ((c >= 0xC0) & (c <= 0x24F) & (c != 0xD7) & (c != 0xF7))
+        # Non-ASCII outside Latin and general punctuation counts as a foreign letter
+        foreign = (c >= 0x80) & ~latin & ~((c >= 0x2000) & (c <= 0x206F)) & ~((c >= 0x80) & (c <= 0xBF))
+        n_latin = self.per_line(latin)
+        n_letters = n_latin + self.per_line(foreign)
+        return np.divide(n_latin, n_letters, out=np.ones(self.n_lines), where=n_letters > 0)
+
+    def end_punct(self) -> np.ndarray:
+        """Whether each line ends with end punctuation (see tools/analyze_line_endings.py)."""
+        last = self.starts + self.chars  # position of the last character, after the leading space
+        return (self.chars > 0) & np.isin(self.codes[last], END_PUNCT_CODES)
+
+    def ngram_hashes(self, orders: Sequence[int], buckets: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Hashed character n-grams of every order and the line each one belongs to."""
+        codes = self.codes.astype(np.int64)
+        hashes, lines = [], []
+        for n in orders:
+            if len(codes) < n:
+                continue
+            windows = len(codes) - n + 1
+            h = np.full(windows, n, dtype=np.int64)
+            for k in range(n):
+                h = (h * HASH_MULTIPLIER + codes[k:k + windows]) % buckets
+            # Windows ending on (or crossing) a line break are not n-grams of a line
+            valid = (self.line_of[:windows] == self.line_of[n - 1:]) & (self.codes[n - 1:] != NEWLINE)
+            hashes.append(h[valid])
+            lines.append(self.line_of[:windows][valid])
+        if not hashes:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(hashes), np.concatenate(lines)
+
+
+class CharNgramLID:
+    def __init__(self,
+                 langs: List[str],
+                 log_probs: np.ndarray,
+                 orders: Sequence[int] = (1, 2, 3),
+                 buckets: int = 1 << 18) -> None:
+        """
+        Character n-gram naive Bayes language identifier over hashed n-grams.
+
+        Args:
+            langs: Language codes, one row of log_probs each
+            log_probs: Smoothed log probability of every n-gram bucket per language
+            orders: N-gram orders
+            buckets: Number of hash buckets
+        """
+        self.langs = list(langs)
+        self.log_probs = log_probs.astype(np.float32)
+        self.orders = tuple(orders)
+        self.buckets = buckets
+
+    @classmethod
+    def train(cls,
+              texts: Dict[str, Iterable[str]],
+              orders: Sequence[int] = (1, 2, 3),
+              buckets: int = 1 << 18,
+              batch_size: int = 10000) -> 'CharNgramLID':
+        """Count the n-grams of example lines per language (add-one smoothing)."""
+        log_probs = np.zeros((len(texts), buckets), dtype=np.float64)
+        for i, lines in enumerate(texts.values()):
+            counts = np.zeros(buckets, dtype=np.float64)
+            lines = iter(lines)
+            while True:
+                batch = list(islice(lines, batch_size))
+                if not batch:
+                    break
+                hashes, _ = EncodedBatch(batch).ngram_hashes(orders, buckets)
+                counts += np.bincount(hashes, minlength=buckets)
+            log_probs[i] = np.log((counts + 1) / (counts.sum() + buckets))
+        return cls(list(texts), log_probs, orders, buckets)
+
+    def save(self, path: str) -> None:
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, langs=np.array(self.langs), log_probs=self.log_probs,
+                                orders=np.array(self.orders), buckets=np.array(self.buckets))
+
+    @classmethod
+    def load(cls, path: str) -> 'CharNgramLID':
+        with np.load(path) as model:
+            return cls([str(lang) for lang in model['langs']], model['log_probs'],
+                       tuple(int(n) for n in model['orders']), int(model['buckets']))
+
+    def scores(self, batch: EncodedBatch) -> np.ndarray:
+        """Mean log probability per n-gram of every line (rows) under every language (columns)."""
+        hashes, lines = batch.ngram_hashes(self.orders, self.buckets)
+        counts = np.bincount(lines, minlength=batch.n_lines)
+        totals = np.stack([np.bincount(lines, weights=self.log_probs[i, hashes], minlength=batch.n_lines)
+                           for i in range(len(self.langs))], axis=1)
+        return totals / np.maximum(counts, 1)[:, None]
+
+    def margin(self, batch: EncodedBatch, lang: str) -> np.ndarray:
+        """Score of the expected language minus the best other language (negative: looks foreign)."""
+        if lang not in self.langs:
+            raise ValueError(f"The language ID model has no '{lang}' (it knows {', '.join(self.langs)})")
+        scores = self.scores(batch)
+        i = self.langs.index(lang)
+        others = np.delete(scores, i, axis=1)
+        return scores[:, i] - others.max(axis=1) if others.shape[1] else np.zeros(batch.n_lines)
+
+    def predict(self, lines: Sequence[str]) -> List[str]:
+        return [self.langs[i] for i in self.scores(EncodedBatch(lines)).argmax(axis=1)]
+
+
+class BitextFilter:
+    def __init__(self,
+                 src_lang: str,
+                 tgt_lang: str,
+                 lid: Optional[CharNgramLID] = None,
+                 thresholds: Optional[Dict[str, float]] = None,
+                 reject_punct_mismatch: bool = False,
+                 batch_size: int = 10000,
+                 tracer: Optional[Tracer] = None) -> None:
+        """
+        Streaming filter for a parallel corpus.
+
+        Args:
+            src_lang: Source language code (as known to the language ID model)
+            tgt_lang: Target language code
+            lid: Language ID model; without one the language ID check is skipped
+            thresholds: Overrides of DEFAULT_THRESHOLDS
+            reject_punct_mismatch: Reject pairs where only one side ends with
+                end punctuation (otherwise they are only counted)
+            batch_size: Pairs scored at once
+            tracer: Records the time and memory of every batch
+        """
+        self.src_lang = src_lang
+        self.tgt_lang = tgt_lang
+        self.lid = lid
+        self.thresholds = {**DEFAULT_THRESHOLDS, **(thresholds or {})}
+        self.reject_punct_mismatch = reject_punct_mismatch
+        self.batch_size = batch_size
+        self.tracer = tracer or Tracer(enabled=False)
+        self.logger = logging.getLogger(__name__)
+
+    def features(self, src_lines: Sequence[str], tgt_lines: Sequence[str]) -> pd.DataFrame:
+        """Per-pair features of a batch."""
+        src, tgt = EncodedBatch(src_lines), EncodedBatch(tgt_lines)
+        src_tokens, tgt_tokens = src.token_counts(), tgt.token_counts()
+        longer, shorter = np.maximum(src_tokens, tgt_tokens), np.minimum(src_tokens, tgt_tokens)
+        features = pd.DataFrame({
+            'src_tokens': src_tokens,
+            'tgt_tokens': tgt_tokens,
+            'length_ratio': longer / np.maximum(shorter, 1),
+            'src_script': src.script_ratio(),
+            'tgt_script': tgt.script_ratio(),
+            'punct_mismatch': src.end_punct() != tgt.end_punct(),
+        })
+        if self.lid is not None:
+            features['src_lid'] = self.lid.margin(src, self.src_lang)
+            features['tgt_lid'] = self.lid.margin(tgt, self.tgt_lang)
+        return features
+
+    def reasons(self, features: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """Boolean mask per rejection reason (a pair can have several)."""
+        t = self.thresholds
+        shorter = features[['src_tokens', 'tgt_tokens']].min(axis=1)
+        longer = features[['src_tokens', 'tgt_tokens']].max(axis=1)
+        reasons = {
+            'empty': (shorter < t['min_tokens']).to_numpy(),
+            'too_long': (longer > t['max_tokens']).to_numpy(),
+            'length_ratio': ((features['length_ratio'] > t['max_length_ratio']) & (shorter > 0)).to_numpy(),
+            'script': (features[['src_script', 'tgt_script']].min(axis=1) < t['min_script_ratio']).to_numpy(),
+            'punct_mismatch': features['punct_mismatch'].to_numpy(),
+        }
+        if 'src_lid' in features:
+            reasons['language_id'] = (features[['src_lid', 'tgt_lid']].min(axis=1) < t['min_lid_margin']).to_numpy()
+        return reasons
+
+    def _batches(self, src_file, tgt_file) -> Iterable[Tuple[List[str], List[str]]]:
+        while True:
+            src_lines = list(islice(src_file, self.batch_size))
+            tgt_lines = list(islice(tgt_file, self.batch_size))
+            if len(src_lines) != len(tgt_lines):
+                raise ValueError("Source and target files have a different number of lines")
+            if not src_lines:
+                return
+            yield src_lines, tgt_lines
+
+    def filter_files(self,
+                     src_input: str,
+                     tgt_input: str,
+                     src_output: str,
+                     tgt_output: str,
+                     rejected_output: Optional[str] = None) -> Counter:
+        """
+        Filter a parallel corpus in one streaming pass.
+
+        Args:
+            src_input: Tokenized source file
+            tgt_input: Tokenized target file (same number of lines)
+            src_output: Kept source lines
+            tgt_output: Kept target lines
+            rejected_output: Optional TSV with the reasons, source and target of every rejected pair
+
+        Returns:
+            Counter with 'total', 'kept', 'rejected', the number of pairs per
+            reason and 'flagged_punct_mismatch' when mismatches are only counted
+        """
+        counts = Counter()
+        rejects = [r for r in REASONS if r != 'punct_mismatch' or self.reject_punct_mismatch]
+        with open(src_input, 'r', encoding='utf-8') as src_file, \
+             open(tgt_input, 'r', encoding='utf-8') as tgt_file, \
+             open(src_output, 'w', encoding='utf-8') as src_out, \
+             open(tgt_output, 'w', encoding='utf-8') as tgt_out:
+            rejected_file = open(rejected_output, 'w', encoding='utf-8') if rejected_output else None
+            try:
+                if rejected_file:
+                    rejected_file.write("reasons\tsource\ttarget\n")
+                for src_lines, tgt_lines in self._batches(src_file, tgt_file):
+                    with self.tracer.stage('filter_batch', lines=len(src_lines)):
+                        reasons = self.reasons(self.features(src_lines, tgt_lines))
+                        rejected = np.zeros(len(src_lines), dtype=bool)
+                        for reason in rejects:
+                            if reason in reasons:
+                                rejected |= reasons[reason]
+                                counts[reason] += int(reasons[reason].sum())
+                        if not self.reject_punct_mismatch:
+                            counts['flagged_punct_mismatch'] += int(reasons['punct_mismatch'].sum())
+                        for i in np.flatnonzero(~rejected):
+                            src_out.write(src_lines[i])
+                            tgt_out.write(tgt_lines[i])
+                        if rejected_file:
+                            for i in np.flatnonzero(rejected):
+                                labels = ','.join(r for r in rejects if r in reasons and reasons[r][i])
+                                rejected_file.write(f"{labels}\t{src_lines[i].strip()}\t{tgt_lines[i].strip()}\n")
+                    counts['total'] += len(src_lines)
+                    counts['rejected'] += int(rejected.sum())
+            finally:
+                if rejected_file:
+                    rejected_file.close()
+        counts['kept'] = counts['total'] - counts['rejected']
+        return counts
+
+    def log_breakdown(self, counts: Counter) -> None:
+        """Log the kept and rejected pairs and the pairs per reason."""
+        total = max(counts['total'], 1)
+        self.logger.info(f"Kept {counts['kept']} of {counts['total']} pairs, "
+                         f"rejected {counts['rejected']} ({counts['rejected'] / total:.2%})")
+        for reason in REASONS:
+            if counts[reason]:
+                self.logger.info(f"  {reason}: {counts[reason]} ({counts[reason] / total:.2%})")
+        if counts['flagged_punct_mismatch']:
+            self.logger.info(f"  end punctuation mismatch (kept): {counts['flagged_punct_mismatch']} "
+                             f"({counts['flagged_punct_mismatch'] / total:.2%})")
+
+
+def _read_lines(path: str, max_lines: Optional[int]) -> Iterable[str]:
+    with open(path, 'r', encoding='utf-8') as f:
+        yield from islice(f, max_lines)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Filter misaligned and mixed-language pairs from a parallel corpus')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    train_parser = subparsers.add_parser('train-lid', help='Train the character n-gram language ID model')
+    train_parser.add_argument('--lang', nargs=2, action='append', required=True, metavar=('LANG', 'FILE'),
+                              help='Language code and example text (repeat for every language)')
+    train_parser.add_argument('--output', default='lid_model.npz', help='Model file')
+    train_parser.add_argument('--max-lines', type=int, default=50000, help='Example lines per language')
+    train_parser.add_argument('--orders', type=int, nargs='+', default=[1, 2, 3], help='Character n-gram orders')
+    train_parser.add_argument('--buckets', type=int, default=1 << 18, help='Hash buckets')
+
+    filter_parser = subparsers.add_parser('filter', help='Filter a parallel corpus')
+    filter_parser.add_argument('--src', required=True, help='Tokenized source file')
+    filter_parser.add_argument('--tgt', required=True, help='Tokenized target file')
+    filter_parser.add_argument('--src-lang', default='ach', help='Source language code')
+    filter_parser.add_argument('--tgt-lang', default='en', help='Target language code')
+    filter_parser.add_argument('--output-suffix', default='filtered',
+                               help='Kept pairs are written to SRC.SUFFIX and TGT.SUFFIX')
+    filter_parser.add_argument('--rejected', default=None, help='TSV file for the rejected pairs and their reasons')
+    filter_parser.add_argument('--lid-model', default=None, help='Language ID model from train-lid (skipped without)')
+    filter_parser.add_argument('--min-tokens', type=int, default=DEFAULT_THRESHOLDS['min_tokens'],
+                               help='Minimum tokens per side')
+    filter_parser.add_argument('--max-tokens', type=int, default=DEFAULT_THRESHOLDS['max_tokens'],
+                               help='Maximum tokens per side')
+    filter_parser.add_argument('--max-length-ratio', type=float, default=DEFAULT_THRESHOLDS['max_length_ratio'],
+                               help='Maximum ratio of the longer to the shorter side in tokens')
+    filter_parser.add_argument('--min-script-ratio', type=float, default=DEFAULT_THRESHOLDS['min_script_ratio'],
+                               help='Minimum share of Latin letters per side')
+    filter_parser.add_argument('--min-lid-margin', type=float, default=DEFAULT_THRESHOLDS['min_lid_margin'],
+                               help='Minimum language ID margin per side (log probability per n-gram)')
+    filter_parser.add_argument('--reject-punct-mismatch', action='store_true',
+                               help='Reject pairs where only one side ends with . ! or ? (counted only by default)')
+    filter_parser.add_argument('--batch-size', type=int, default=10000, help='Pairs scored at once')
+    filter_parser.add_argument('--trace', default=None,
+                               help='Save a Chrome trace with the time and memory of every batch to this file')
+    args = parser.parse_args()
+
+    if args.command == 'train-lid':
+        lid = CharNgramLID.train({lang: _read_lines(path, args.max_lines) for lang, path in args.lang},
+                                 args.orders, args.buckets)
+        lid.save(args.output)
+        print(f"Language ID model for {', '.join(lid.langs)} saved to {args.output}")
+        return
+
+    thresholds = {'min_tokens': args.min_tokens, 'max_tokens': args.max_tokens,
+                  'max_length_ratio': args.max_length_ratio, 'min_script_ratio': args.min_script_ratio,
+                  'min_lid_margin': args.min_lid_margin}
+    tracer = Tracer(enabled=args.trace is not None)
+    bitext_filter = BitextFilter(args.src_lang, args.tgt_lang,
+                                 CharNgramLID.load(args.lid_model) if args.lid_model else None,
+                                 thresholds, args.reject_punct_mismatch, args.batch_size, tracer)
+    src_output = f"{args.src}.{args.output_suffix}"
+    tgt_output = f"{args.tgt}.{args.output_suffix}"
+    counts = bitext_filter.filter_files(args.src, args.tgt, src_output, tgt_output, args.rejected)
+    bitext_filter.log_breakdown(counts)
+    bitext_filter.logger.info(f"Kept pairs saved to {src_output} and {tgt_output}")
+    if args.trace:
+        tracer.report(bitext_filter.logger.info)
+        tracer.save(args.trace)
+
+
+if __name__ == "__main__":
+    main()
+
+# Example:
+# python filter_bitext.py train-lid --lang ach processed_data_moses/salt.dev.tk.lc.ach \
+#     --lang en processed_data_moses/salt.dev.tk.lc.eng --output lid_model.npz
+# python filter_bitext.py filter --src processed_data_moses/salt.train.tk.lc.clean.ach \
+#     --tgt processed_data_moses/salt.train.tk.lc.clean.eng --lid-model lid_model.npz \
+#     --rejected processed_data_moses/rejected.tsv
@@ -0,0 +1,255 @@
+"""
+instrumentation.py contains a small tracing layer for timing pipeline stages.
+
+A Tracer wraps each stage (learn_bpe, apply_bpe, translate, metrics, ...) in a
+context manager that records its wall time, the peak resident memory of the
+process while it ran, and line/token counters reported by the stage. The stages
+of a run are saved as a Chrome trace (open in chrome://tracing or
+https://ui.perfetto.dev) together with a per-stage summary.
+
+Peak memory is sampled by a background thread from /proc/self/statm; where that
+is not available, the process-wide peak from resource.getrusage is used instead.
+ChildMemoryWatcher does the same for a subprocess such as onmt_translate.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+_STATM = "/proc/self/statm"
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (peak RSS where /proc is missing)."""
+    try:
+        with open(_STATM, 'r') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        if resource is None:
+            return 0
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def process_peak_rss(pid: int) -> int:
+    """Peak resident set size of another process in bytes (VmHWM), 0 if unavailable."""
+    try:
+        with open(f"/proc/{pid}/status", 'r') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        value = fields.get('VmHWM') or fields.get('VmRSS')
+        return int(value.split()[0]) * 1024 if value else 0
+    except (OSError, ValueError):
+        return 0
+
+
+class ChildMemoryWatcher:
+    def __init__(self, pid: int, interval: float = 0.05) -> None:
+        """
+        Samples the peak memory of a child process (e.g. onmt_translate) until stopped.
+
+        Where /proc is not available, the largest peak of all finished children
+        from resource.getrusage is reported instead.
+        """
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+
+    def _watch(self) -> None:
+        while True:
+            self.peak = max(self.peak, process_peak_rss(self.pid))
+            if self._stop.wait(self.interval):
+                break
+
+    def stop(self) -> int:
+        """Stop sampling and return the peak in bytes."""
+        self._stop.set()
+        self._thread.join()
+        if self.peak == 0 and resource is not None:
+            peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            self.peak = peak if sys.platform == 'darwin' else peak * 1024
+        return self.peak
+
+
+class Stage:
+    def __init__(self, name: str, counters: dict) -> None:
+        """A running (or finished) stage; counters can be updated while it runs."""
+        self.name = name
+        self.counters = dict(counters)
+        self.start = time.time()
+        self.duration = 0.0
+        # Seconds of nested work traced elsewhere, not counted in duration
+        self.excluded = 0.0
+        self.rss_start = current_rss()
+        self.peak_rss = self.rss_start
+
+    def add(self, **counters) -> None:
+        """Add to the stage's counters, e.g. stage.add(lines=1, tokens=12)."""
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def exclude(self, seconds: float) -> None:
+        """Leave time spent inside this stage, but recorded as another stage
+        (see Tracer.record), out of its duration so it is not counted twice."""
+        self.excluded += seconds
+
+
+class Tracer:
+    def __init__(self, enabled: bool = True, sample_interval: float = 0.05) -> None:
+        """
+        Collects stage timings, memory and counters of one run.
+
+        Args:
+            enabled: A disabled tracer still hands out Stage objects but records
+                nothing, so instrumented code does not need to check for it
+            sample_interval: Seconds between memory samples
+        """
+        self.enabled = enabled
+        self.sample_interval = sample_interval
+        self.events: List[dict] = []
+        self._init_runtime()
+
+    def _init_runtime(self) -> None:
+        self._lock = threading.Lock()
+        self._active: List[Stage] = []
+        self._sampler: Optional[threading.Thread] = None
+
+    def __getstate__(self) -> dict:
+        # Worker processes get an empty tracer and send their events back
+        state = {key: value for key, value in self.__dict__.items()
+                 if key not in ('_lock', '_active', '_sampler')}
+        state['events'] = []
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._init_runtime()
+
+    def _sample(self) -> None:
+        while True:
+            time.sleep(self.sample_interval)
+            rss = current_rss()
+            with self._lock:
+                for stage in self._active:
+                    stage.peak_rss = max(stage.peak_rss, rss)
+                if self._active:
+                    self.events.append({'name': 'rss_mb', 'ph': 'C', 'ts': time.time() * 1e6,
+                                        'pid': os.getpid(), 'args': {'rss_mb': rss / 2 ** 20}})
+
+    @contextmanager
+    def stage(self, name: str, **counters) -> Iterator[Stage]:
+        """
+        Time a pipeline stage.
+
+        Args:
+            name: Stage name, e.g. 'apply_bpe'
+            counters: Initial counters (e.g. lines=...), more can be added
+                through the yielded Stage
+        """
+        stage = Stage(name, counters)
+        if not self.enabled:
+            # Still timed, so callers can use stage.duration
+            start = time.perf_counter()
+            try:
+                yield stage
+            finally:
+                stage.duration = time.perf_counter() - start - stage.excluded
+            return
+
+        with self._lock:
+            self._active.append(stage)
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample, daemon=True)
+                self._sampler.start()
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.duration = time.perf_counter() - start - stage.excluded
+            rss = current_rss()
+            with self._lock:
+                self._active.remove(stage)
+                stage.peak_rss = max(stage.peak_rss, rss)
+                self.events.append({
+                    'name': name,
+                    'cat': 'stage',
+                    'ph': 'X',
+                    'ts': stage.start * 1e6,
+                    'dur': stage.duration * 1e6,
+                    'pid': os.getpid(),
+                    'tid': threading.get_ident(),
+                    'args': {**stage.counters,
+                             'peak_rss_mb': stage.peak_rss / 2 ** 20,
+                             'rss_delta_mb': (rss - stage.rss_start) / 2 ** 20},
+                })
+
+    def record(self, name: str, seconds: float, **counters) -> None:
+        """Record time accumulated outside a stage block, e.g. per-line work
+        interleaved with decoding, as a stage that ended now."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.events.append({'name': name, 'cat': 'stage', 'ph': 'X',
+                                'ts': (time.time() - seconds) * 1e6, 'dur': seconds * 1e6,
+                                'pid': os.getpid(), 'tid': threading.get_ident(),
+                                'args': {**counters, 'peak_rss_mb': current_rss() / 2 ** 20}})
+
+    def add_events(self, events: List[dict]) -> None:
+        """Add events recorded by another process (e.g. a worker's tracer)."""
+        with self._lock:
+            self.events.extend(events)
+
+    def summary(self) -> List[Dict[str, object]]:
+        """Total time, calls, peak memory and summed counters per stage name."""
+        rows: Dict[str, Dict[str, object]] = {}
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            if event['ph'] != 'X':
+                continue
+            row = rows.setdefault(event['name'], {'stage': event['name'], 'calls': 0,
+                                                  'seconds': 0.0, 'peak_rss_mb': 0.0})
+            row['calls'] += 1
+            row['seconds'] += event['dur'] / 1e6
+            for key, value in event['args'].items():
+                if key == 'peak_rss_mb':
+                    row[key] = max(row[key], value)
+                elif isinstance(value, (int, float)) and key != 'rss_delta_mb':
+                    row[key] = row.get(key, 0) + value
+        for row in rows.values():
+            if row['seconds'] > 0:
+                for key in ('lines', 'tokens'):
+                    if key in row:
+                        row[f'{key}_per_sec'] = row[key] / row['seconds']
+        return list(rows.values())
+
+    def report(self, log=print) -> None:
+        """Log one line per stage with its time, memory and throughput."""
+        for row in self.summary():
+            throughput = ", ".join(f"{row[key]:.1f} {key.replace('_per_sec', '')}/s"
+                                   for key in ('lines_per_sec', 'tokens_per_sec') if key in row)
+            log(f"{row['stage']}: {row['seconds']:.2f}s in {row['calls']} call(s), "
+                f"peak RSS {row['peak_rss_mb']:.1f} MB" + (f", {throughput}" if throughput else ""))
+
+    def save(self, path: str) -> None:
+        """Write the events as a Chrome trace with the summary under 'otherData'."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            events = sorted(self.events, key=lambda event: event['ts'])
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                       'otherData': {'summary': self.summary(), 'argv': sys.argv}}, f, indent=1)
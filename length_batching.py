@@ -0,0 +1,139 @@
+"""
+length_batching.py contains a pre-decode stage that sorts translation input by
+length so that batches are filled up to a token budget instead of a fixed number
+of sentences, and restores the original order of the decoder output afterwards.
+
+Sorting keeps sentences of similar length together, which reduces the padding
+the decoder computes on when short and long sentences share a batch.
+"""
+import argparse
+from typing import List, Tuple
+import numpy as np
+
+
+def line_lengths(lines: List[str]) -> np.ndarray:
+    """Return the number of whitespace-separated tokens in every line."""
+    return np.fromiter((len(line.split()) for line in lines), dtype=np.int64, count=len(lines))
+
+
+def fixed_size_batches(n_lines: int, batch_size: int) -> List[np.ndarray]:
+    """Batches of batch_size sentences in file order (the current onmt_translate setup)."""
+    return [np.arange(start, min(start + batch_size, n_lines)) for start in range(0, n_lines, batch_size)]
+
+
+def token_budget_batches(lengths: np.ndarray, max_tokens: int) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """
+    Sort sentences by length and group them into batches whose padded size
+    (number of sentences x longest sentence) stays within max_tokens.
+
+    Returns:
+        Tuple of (sort order, list of batches as arrays of original line indices)
+    """
+    order = np.argsort(lengths, kind='stable')
+    batches = []
+    start = 0
+    for end in range(1, len(order) + 1):
+        # Lengths are ascending, so the newest sentence is always the longest
+        padded = (end - start) * max(int(lengths[order[end - 1]]), 1)
+        if padded > max_tokens and end - 1 > start:
+            batches.append(order[start:end - 1])
+            start = end - 1
+    if start < len(order):
+        batches.append(order[start:])
+    return order, batches
+
+
+def padding_efficiency(lengths: np.ndarray, batches: List[np.ndarray]) -> float:
+    """Fraction of real tokens among all (padded) token positions of the batches."""
+    real = sum(int(lengths[batch].sum()) for batch in batches)
+    padded = sum(len(batch) * int(lengths[batch].max()) for batch in batches if len(batch))
+    return real / padded if padded else 1.0
+
+
+def sort_lines(lines: List[str]) -> Tuple[List[str], np.ndarray]:
+    """Return the lines sorted by length together with the sort order."""
+    order = np.argsort(line_lengths(lines), kind='stable')
+    return [lines[i] for i in order], order
+
+
+def restore_order(sorted_lines: List[str], order: np.ndarray, n_best: int = 1) -> List[str]:
+    """
+    Put decoder output for length-sorted input back into the original order.
+
+    Args:
+        sorted_lines: Decoder output, n_best consecutive lines per input sentence
+        order: The sort order returned by sort_lines
+        n_best: Number of output lines per input sentence
+    """
+    restored = [None] * len(sorted_lines)
+    for sorted_idx, original_idx in enumerate(order):
+        restored[original_idx * n_best:(original_idx + 1) * n_best] = \
+            sorted_lines[sorted_idx * n_best:(sorted_idx + 1) * n_best]
+    return restored
+
+
+def batching_report(lengths: np.ndarray, batch_size: int, max_tokens: int) -> dict:
+    """Compare fixed-sentence batching in file order with sorted token-budget batching."""
+    fixed = fixed_size_batches(len(lengths), batch_size)
+    _, budget = token_budget_batches(lengths, max_tokens)
+    return {
+        'sentences': len(lengths),
+        'tokens': int(lengths.sum()),
+        'fixed_batches': len(fixed),
+        'fixed_padding_efficiency': padding_efficiency(lengths, fixed),
+        'sorted_batches': len(budget),
+        'sorted_padding_efficiency': padding_efficiency(lengths, budget),
+    }
+
+
+def _read(path: str) -> List[str]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.rstrip('\n') for line in f]
+
+
+def _write(lines: List[str], path: str) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        for line in lines:
+            f.write(line + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Length-sorted batching around onmt_translate')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    sort_parser = subparsers.add_parser('sort', help='Sort a source file by length')
+    sort_parser.add_argument('--src', required=True, help='BPE-encoded source file')
+    sort_parser.add_argument('--output', required=True, help='Sorted source file')
+    sort_parser.add_argument('--order', required=True, help='Where to save the sort order (.npy)')
+
+    restore_parser = subparsers.add_parser('restore', help='Restore the original order of translations')
+    restore_parser.add_argument('--hyp', required=True, help='Translations of the sorted source')
+    restore_parser.add_argument('--order', required=True, help='Sort order saved by the sort command')
+    restore_parser.add_argument('--output', required=True, help='Translations in original order')
+    restore_parser.add_argument('--n-best', type=int, default=1, help='Output lines per source sentence')
+
+    report_parser = subparsers.add_parser('report', help='Compare padding of fixed and token-budget batching')
+    report_parser.add_argument('--src', required=True, help='BPE-encoded source file')
+    report_parser.add_argument('--batch-size', type=int, default=32, help='Sentences per fixed batch')
+    report_parser.add_argument('--max-tokens', type=int, default=2048, help='Token budget per sorted batch')
+
+    args = parser.parse_args()
+
+    if args.command == 'sort':
+        sorted_lines, order = sort_lines(_read(args.src))
+        _write(sorted_lines, args.output)
+        np.save(args.order, order)
+    elif args.command == 'restore':
+        order = np.load(args.order)
+        _write(restore_order(_read(args.hyp), order, args.n_best), args.output)
+    else:
+        report = batching_report(line_lengths(_read(args.src)), args.batch_size, args.max_tokens)
+        print(f"Sentences: {report['sentences']}, tokens: {report['tokens']}")
+        print(f"Fixed batching ({args.batch_size} sentences): {report['fixed_batches']} batches, "
+              f"padding efficiency {report['fixed_padding_efficiency']:.2%}")
+        print(f"Sorted batching ({args.max_tokens} tokens): {report['sorted_batches']} batches, "
+              f"padding efficiency {report['sorted_padding_efficiency']:.2%}")
+
+
+if __name__ == "__main__":
+    main()
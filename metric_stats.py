@@ -0,0 +1,215 @@
+"""
+metric_stats.py contains sentence-level sufficient statistics for BLEU, chrF and chrF++.
+
+Statistics are extracted once per sentence with sacrebleu's own n-gram code and
+kept as integer matrices (one row per sentence). Corpus scores for any subset of
+sentences -- bootstrap samples, domain slices, length buckets -- are then a sum
+over rows followed by the metric's closed-form score, so nothing is re-tokenized
+or re-counted. Scores of a single subset go through sacrebleu's
+_compute_score_from_stats and are identical to corpus_score; bleu_from_stats and
+chrf_from_stats score many aggregated rows at once with NumPy.
+"""
+from typing import Dict, Iterable, List, Optional, Sequence
+import numpy as np
+from sacrebleu.metrics import BLEU, CHRF
+
+METRICS = ('bleu', 'chrf', 'chrf++')
+
+# sacrebleu's log of zero precision
+_LOG_ZERO = -9999999999
+
+
+def make_metric(name: str):
+    """Create the sacrebleu metric object for a metric name (default settings)."""
+    if name == 'bleu':
+        return BLEU()
+    if name == 'chrf':
+        return CHRF()
+    if name == 'chrf++':
+        return CHRF(word_order=2)
+    raise ValueError(f"Unknown metric: {name}")
+
+
+def segment_statistics(metric, hypothesis: str, ref_info: dict) -> List[int]:
+    """Sufficient statistics of one hypothesis against its cached reference info."""
+    return metric._compute_segment_statistics(metric._preprocess_segment(hypothesis), ref_info)
+
+
+class SentenceStats:
+    def __init__(self,
+                 hypotheses: Sequence[str],
+                 references: Sequence[str],
+                 metrics: Iterable[str] = METRICS) -> None:
+        """
+        Per-sentence sufficient statistics for a set of metrics.
+
+        Args:
+            hypotheses: Detokenized (de-BPE'd) system output, one line per sentence
+            references: One reference line per sentence
+            metrics: Metric names, any of 'bleu', 'chrf' and 'chrf++'
+        """
+        assert len(hypotheses) == len(references), \
+            "Hypotheses and references must have the same number of lines"
+        self.metrics = {name: make_metric(name) for name in metrics}
+        self.stats: Dict[str, np.ndarray] = {}
+        for name, metric in self.metrics.items():
+            rows = metric._extract_corpus_statistics(list(hypotheses), [list(references)])
+            self.stats[name] = np.array(rows, dtype=np.int64).reshape(len(hypotheses), -1)
+
+    @classmethod
+    def from_stats(cls, stats: Dict[str, np.ndarray]) -> 'SentenceStats':
+        """Wrap statistics matrices computed earlier (e.g. loaded from a SentenceStore)."""
+        sentence_stats = cls.__new__(cls)
+        sentence_stats.metrics = {name: make_metric(name) for name in stats}
+        sentence_stats.stats = {name: np.asarray(rows, dtype=np.int64) for name, rows in stats.items()}
+        return sentence_stats
+
+    def __len__(self) -> int:
+        return len(next(iter(self.stats.values())))
+
+    def aggregate(self, metric: str, indices: Optional[Sequence[int]] = None) -> np.ndarray:
+        """Sum of the statistics over the given sentence indices (all by default).
+
+        Indices may repeat, as in a bootstrap sample.
+        """
+        stats = self.stats[metric]
+        return stats.sum(axis=0) if indices is None else stats[np.asarray(indices)].sum(axis=0)
+
+    def score(self, metric: str, indices: Optional[Sequence[int]] = None) -> float:
+        """Corpus-level score over a subset of sentences, identical to sacrebleu's corpus_score."""
+        totals = [int(x) for x in self.aggregate(metric, indices)]
+        return self.metrics[metric]._compute_score_from_stats(totals).score
+
+    def scores(self, indices: Optional[Sequence[int]] = None) -> Dict[str, float]:
+        """Corpus-level scores of every metric over a subset of sentences."""
+        return {name: self.score(name, indices) for name in self.metrics}
+
+    def group_scores(self, metric: str, groups: Dict[str, Sequence[int]]) -> Dict[str, float]:
+        """Scores of several named subsets, e.g. length buckets or domains."""
+        return {group: self.score(metric, indices) for group, indices in groups.items()}
+
+    def weighted_scores(self, metric: str, weights: np.ndarray) -> np.ndarray:
+        """
+        Score many subsets at once.
+
+        Args:
+            metric: Metric name
+            weights: Matrix of shape (n_subsets, n_sentences) with how many times
+                each sentence occurs in each subset (e.g. bootstrap resample counts)
+
+        Returns:
+            Array with one score per subset
+        """
+        totals = np.asarray(weights, dtype=np.int64) @ self.stats[metric]
+        return scores_from_stats(self.metrics[metric], totals)
+
+    def sentence_scores(self, metric: str) -> np.ndarray:
+        """Sentence-level scores (each sentence scored as its own corpus)."""
+        return scores_from_stats(self.metrics[metric], self.stats[metric])
+
+
+def bleu_from_stats(totals: np.ndarray, max_ngram_order: int = 4) -> np.ndarray:
+    """
+    Vectorized BLEU with sacrebleu's default settings (exp smoothing, no effective order).
+
+    Args:
+        totals: Matrix of aggregated BLEU statistics, one row per subset, in
+            sacrebleu's layout [sys_len, ref_len, correct_1..N, total_1..N]
+    """
+    totals = np.atleast_2d(totals).astype(np.float64)
+    sys_len, ref_len = totals[:, 0], totals[:, 1]
+    correct = totals[:, 2:2 + max_ngram_order]
+    total = totals[:, 2 + max_ngram_order:]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bp = np.where(sys_len < ref_len,
+                      np.where(sys_len > 0, np.exp(1 - ref_len / sys_len), 0.0),
+                      1.0)
+
+        # Orders after the first one without hypothesis n-grams are skipped (precision 0)
+        active = np.cumprod(total > 0, axis=1).astype(bool)
+        # NIST smoothing: the k-th order without matches gets 1 / 2^k
+        smooth = 2.0 ** np.cumsum((correct == 0) & active, axis=1)
+        precisions = np.where(correct > 0, 100. * correct / total, 100. / (smooth * total))
+        precisions = np.where(active, precisions, 0.0)
+        log_precisions = np.where(precisions > 0, np.log(precisions), _LOG_ZERO)
+
+    # Sum order by order, in the same order as sacrebleu
+    log_sum = np.zeros(len(totals))
+    for n in range(max_ngram_order):
+        log_sum = log_sum + log_precisions[:, n]
+    scores = bp * np.exp(log_sum / max_ngram_order)
+    return np.where(correct.any(axis=1), scores, 0.0)
+
+
+def chrf_from_stats(totals: np.ndarray, beta: int = 2) -> np.ndarray:
+    """
+    Vectorized chrF/chrF++ with sacrebleu's default (effective order) averaging.
+
+    Args:
+        totals: Matrix of aggregated chrF statistics, one row per subset, with a
+            [hyp, ref, match] triple for every character (and word) order
+        beta: Recall weight
+    """
+    totals = np.atleast_2d(totals).astype(np.float64)
+    eps = 1e-16
+    factor = beta ** 2
+    avg_prec = np.zeros(len(totals))
+    avg_rec = np.zeros(len(totals))
+    effective_order = np.zeros(len(totals))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i in range(totals.shape[1] // 3):
+            n_hyp, n_ref, n_match = totals[:, 3 * i], totals[:, 3 * i + 1], totals[:, 3 * i + 2]
+            prec = np.where(n_hyp > 0, n_match / n_hyp, eps)
+            rec = np.where(n_ref > 0, n_match / n_ref, eps)
+            valid = (n_hyp > 0) & (n_ref > 0)
+            avg_prec = avg_prec + np.where(valid, prec, 0.0)
+            avg_rec = avg_rec + np.where(valid, rec, 0.0)
+            effective_order = effective_order + valid
+
+        avg_prec = np.where(effective_order > 0, avg_prec / effective_order, 0.0)
+        avg_rec = np.where(effective_order > 0, avg_rec / effective_order, 0.0)
+        scores = (1 + factor) * avg_prec * avg_rec / ((factor * avg_prec) + avg_rec)
+    return np.where(avg_prec + avg_rec > 0, 100 * scores, 0.0)
+
+
+def scores_from_stats(metric, totals: np.ndarray) -> np.ndarray:
+    """Vectorized scores for a sacrebleu metric object from aggregated statistics."""
+    if isinstance(metric, BLEU):
+        return bleu_from_stats(totals, metric.max_ngram_order)
+    return chrf_from_stats(totals, metric.beta)
+
+
+class StreamingScorer:
+    def __init__(self, metrics: Dict[str, object], references: List[str]) -> None:
+        """
+        Accumulates corpus-level statistics one hypothesis at a time.
+
+        Args:
+            metrics: sacrebleu metric objects by name (e.g. BLEU(), CHRF())
+            references: Reference line for every sentence index
+        """
+        self.metrics = metrics
+        self.ref_cache = {name: metric._cache_references([references]) for name, metric in metrics.items()}
+        self.rows = {name: [None] * len(references) for name in metrics}
+        self.totals = {name: None for name in metrics}
+        self.count = 0
+
+    def add(self, index: int, hypothesis: str) -> None:
+        """Add the statistics of the hypothesis for sentence `index`."""
+        for name, metric in self.metrics.items():
+            stats = segment_statistics(metric, hypothesis, self.ref_cache[name][index])
+            self.rows[name][index] = stats
+            totals = self.totals[name]
+            self.totals[name] = stats if totals is None else [a + b for a, b in zip(totals, stats)]
+        self.count += 1
+
+    def score(self) -> Dict[str, float]:
+        """Corpus-level scores over all hypotheses added so far."""
+        return {name: metric._compute_score_from_stats(self.totals[name]).score
+                for name, metric in self.metrics.items()}
+
+    def sentence_stats(self, name: str) -> np.ndarray:
+        """Per-sentence statistics matrix of one metric (all sentences must have been added)."""
+        return np.array(self.rows[name], dtype=np.int64)
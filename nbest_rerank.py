@@ -0,0 +1,92 @@
+"""
+nbest_rerank.py contains vectorized reranking of n-best translation lists.
+
+onmt_translate with -n_best K -with_score writes K lines per source sentence,
+each "hypothesis<TAB>score". The candidates of all sentences are held in
+(n_sentences, K) arrays and reranked at once with a weighted mix of:
+    - the decoder's model score (log-probability)
+    - a length penalty on the hypothesis/source length ratio
+    - an optional reference-free QE score (COMET-QE), scored in one large batch
+"""
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+DEFAULT_WEIGHTS = {'model': 1.0, 'length': 1.0, 'qe': 0.0}
+
+
+def parse_nbest(grouped: List[str], n_best: int) -> Tuple[List[List[str]], np.ndarray]:
+    """
+    Split decoder output into candidates and model scores.
+
+    Args:
+        grouped: One entry per source sentence with its n_best output lines
+            ("hypothesis<TAB>score") joined by newlines
+        n_best: Number of candidates per sentence
+
+    Returns:
+        Tuple of (candidates per sentence, model scores of shape (n_sentences, n_best))
+    """
+    candidates = []
+    scores = np.full((len(grouped), n_best), -np.inf)
+    for i, group in enumerate(grouped):
+        sentence_candidates = []
+        for j, line in enumerate(group.split('\n')[:n_best]):
+            hypothesis, _, score = line.rpartition('\t')
+            if not _:
+                hypothesis, score = line, 'nan'
+            sentence_candidates.append(hypothesis)
+            scores[i, j] = float(score)
+        # Pad short lists so every sentence has n_best entries
+        sentence_candidates += [''] * (n_best - len(sentence_candidates))
+        candidates.append(sentence_candidates)
+    return candidates, scores
+
+
+def candidate_lengths(candidates: List[List[str]]) -> np.ndarray:
+    """Token counts of all candidates as an (n_sentences, n_best) array."""
+    return np.array([[len(c.split()) for c in sentence] for sentence in candidates], dtype=np.float64)
+
+
+def length_penalty(hyp_lengths: np.ndarray, src_lengths: np.ndarray,
+                   log_ratio: Optional[float] = None) -> np.ndarray:
+    """
+    Negative distance of each candidate's log length ratio from the expected ratio.
+
+    Args:
+        hyp_lengths: (n_sentences, n_best) candidate lengths
+        src_lengths: (n_sentences,) source lengths
+        log_ratio: Expected log(target/source) length ratio; estimated from the
+            decoder's top candidates when not given
+    """
+    ratios = np.log((hyp_lengths + 1) / (src_lengths[:, None] + 1))
+    if log_ratio is None:
+        log_ratio = float(np.mean(ratios[:, 0])) if len(ratios) else 0.0
+    return -np.abs(ratios - log_ratio)
+
+
+def rerank(model_scores: np.ndarray,
+           hyp_lengths: np.ndarray,
+           src_lengths: np.ndarray,
+           qe_scores: Optional[np.ndarray] = None,
+           weights: Optional[Dict[str, float]] = None,
+           log_ratio: Optional[float] = None) -> np.ndarray:
+    """
+    Pick the best candidate of every sentence.
+
+    Returns:
+        Array with the index of the selected candidate per sentence
+    """
+    weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+    with np.errstate(invalid='ignore'):
+        combined = weights['model'] * np.nan_to_num(model_scores, nan=0.0, neginf=-1e9)
+        combined = combined + weights['length'] * length_penalty(hyp_lengths, src_lengths, log_ratio)
+        if qe_scores is not None and weights['qe']:
+            combined = combined + weights['qe'] * qe_scores
+    # Padded (missing) candidates are never selected
+    combined = np.where(np.isneginf(model_scores), -np.inf, combined)
+    return np.argmax(combined, axis=1)
+
+
+def select(candidates: List[List[str]], best: np.ndarray) -> List[str]:
+    """Return the selected candidate of every sentence."""
+    return [sentence[j] for sentence, j in zip(candidates, best)]
@@ -3,15 +3,59 @@ This script does the following:
     Creates a .yaml config-file for pretraining operations
     Encodes data using Byte Pair Encoding (subword-nmt)
     Creates a vocabulary for use with OpenNMT
+    Checks the encoded dev sets against the vocabulary before training
+
+With --num-shards the training data is split into line-aligned shards, so no
+step holds the whole corpus in memory: the word counts of the shards are
+computed in parallel (--workers) and merged, BPE is learned from the merged
+frequency table, the shards are encoded in parallel, and the config lists
+every encoded shard pair as its own corpus. Training and dev files can also
+be given as prefixes of memory-mapped corpora (corpus_store.py). The vocabulary is built from the
+first lines of the encoded shards, written out as a single corpus, so it is
+sampled exactly as it would be from the unsharded data.
 """
 import argparse
 import yaml
 import logging
 import subprocess
 import os
-from typing import Dict
+from collections import Counter
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
 from subword_nmt.learn_bpe import learn_bpe
 from subword_nmt.apply_bpe import BPE
+from corpus_store import count_lines, count_tokens, is_corpus, iter_lines
+from instrumentation import Tracer
+from vocab_check import VocabCheckError, precheck
+
+
+def count_words(path: str) -> Counter:
+    """Word frequencies of a tokenized file, counted the way learn_bpe does
+    (or on the token IDs of a saved corpus)."""
+    if is_corpus(path):
+        return count_tokens(path)
+    counts = Counter()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            for word in line.strip('\r\n ').split(' '):
+                if word:
+                    counts[word] += 1
+    return counts
+
+
+def encode_file(codes_path: str, input_path: str, output_path: str) -> Tuple[int, int]:
+    """Apply BPE codes to a text file or saved corpus; returns its line and subword counts."""
+    with open(codes_path, 'r', encoding='utf-8') as codes_file:
+        bpe = BPE(codes_file)
+    lines = tokens = 0
+    with open(output_path, 'w', encoding='utf-8') as outfile:
+        for line in iter_lines(input_path):
+            encoded = bpe.process_line(line)
+            outfile.write(encoded)
+            lines += 1
+            tokens += len(encoded.split())
+    return lines, tokens
 
 
 class ONMTPreprocessor:
@@ -46,7 +90,11 @@ class ONMTPreprocessor:
         src_min_frequency: int = 2,        
         tgt_min_frequency: int = 2, 
         src_bpe_operations: int = 6000,    
-        tgt_bpe_operations: int = 6000     # larger number of BPE operations may overfit to training data.
+        tgt_bpe_operations: int = 6000,    # larger number of BPE operations may overfit to training data.
+        tracer: Optional[Tracer] = None,   # records time, memory and line counts of every stage
+        num_shards: int = 1,               # split the training data for corpora larger than RAM
+        workers: int = 1,                  # processes counting and encoding shards
+        vocab_sample: int = 10000          # training lines onmt_build_vocab samples
     ):
         self.src_lang = src_lang
         self.tgt_lang = tgt_lang
@@ -56,8 +104,14 @@ class ONMTPreprocessor:
         self.tgt_min_frequency = tgt_min_frequency
         self.src_bpe_operations = src_bpe_operations
         self.tgt_bpe_operations = tgt_bpe_operations
+        self.tracer = tracer or Tracer(enabled=False)
+        self.num_shards = max(num_shards, 1)
+        self.workers = max(workers, 1)
+        self.vocab_sample = vocab_sample
         
         self.files: Dict[str, str] = {}
+        # Training files per language: the original file, or its shards
+        self.train_shards: Dict[str, List[str]] = {}
 
         # Set up logging
         logging.basicConfig(
@@ -91,15 +145,64 @@ class ONMTPreprocessor:
         # Set the save_data path
         self.save_data = os.path.join(self.output_dir, self.save_prefix)
 
+    def _map(self, function, *iterables) -> list:
+        """Map over shards, in worker processes when there are several workers."""
+        if self.workers <= 1:
+            return list(map(function, *iterables))
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(function, *iterables))
+
+    def train_bpe_path(self, lang: str, shard: int) -> str:
+        """Path of an encoded training shard (train.bpe.LANG without sharding)."""
+        suffix = f".{shard}" if self.num_shards > 1 else ""
+        return os.path.join(self.output_dir, f"train.bpe.{lang}{suffix}")
+
+    def shard_training_data(self):
+        """Split the training files into line-aligned shards of consecutive lines."""
+        langs = (self.src_lang, self.tgt_lang)
+        if self.num_shards <= 1:
+            self.train_shards = {lang: [self.files[f"train_{lang}"]] for lang in langs}
+            return
+
+        src_path, tgt_path = (self.files[f"train_{lang}"] for lang in langs)
+        n_lines = count_lines(src_path)
+        shard_size = max(-(-n_lines // self.num_shards), 1)
+        shard_dir = os.path.join(self.output_dir, "shards")
+        os.makedirs(shard_dir, exist_ok=True)
+        self.train_shards = {lang: [os.path.join(shard_dir, f"train.{lang}.{k}") for k in range(self.num_shards)]
+                             for lang in langs}
+        self.logger.info(f"Splitting {n_lines} training lines into {self.num_shards} shards...")
+
+        src_file, tgt_file = iter_lines(src_path), iter_lines(tgt_path)
+        with self.tracer.stage('shard', lines=n_lines):
+            for k in range(self.num_shards):
+                with open(self.train_shards[self.src_lang][k], 'w', encoding='utf-8') as src_shard, \
+                     open(self.train_shards[self.tgt_lang][k], 'w', encoding='utf-8') as tgt_shard:
+                    for _ in range(shard_size):
+                        src_line = next(src_file, '')
+                        tgt_line = next(tgt_file, '')
+                        if not src_line and not tgt_line:
+                            break
+                        if not src_line or not tgt_line:
+                            raise ValueError("Source and target training files have a different number of lines")
+                        src_shard.write(src_line)
+                        tgt_shard.write(tgt_line)
+            if next(tgt_file, ''):
+                raise ValueError("Source and target training files have a different number of lines")
+
     def create_yaml_config(self) -> str:
         """Create YAML configuration for preprocessing."""
+        corpora = {
+            f"corpus_{k + 1}": {
+                'path_src': self.train_bpe_path(self.src_lang, k),
+                'path_tgt': self.train_bpe_path(self.tgt_lang, k),
+            }
+            for k in range(self.num_shards)
+        }
         config = {
             'save_data': self.save_data,
             'data': {
-                'corpus_1': {
-                    'path_src': os.path.join(self.output_dir, f"train.bpe.{self.src_lang}"),
-                    'path_tgt': os.path.join(self.output_dir, f"train.bpe.{self.tgt_lang}"),
-                },
+                **corpora,
                 'valid': {
                     'path_src': os.path.join(self.output_dir, f"dev.bpe.{self.src_lang}"),
                     'path_tgt': os.path.join(self.output_dir, f"dev.bpe.{self.tgt_lang}"),
@@ -125,36 +228,38 @@ class ONMTPreprocessor:
         return config_path
 
     def learn_bpe(self):
-        """Learn separate BPE codes for source and target languages."""
+        """Learn separate BPE codes for source and target languages.
+
+        The word counts of every training shard are merged into one frequency
+        table and the merges are learned from it, so the training text itself
+        is never held in memory.
+        """
         self.logger.info("Learning BPE codes...")
+        if not self.train_shards:
+            self.shard_training_data()
         
         # Create separate BPE codes files for each language
         src_bpe_codes_path = os.path.join(self.output_dir, f"{self.save_prefix}.{self.src_lang}.codes")
         tgt_bpe_codes_path = os.path.join(self.output_dir, f"{self.save_prefix}.{self.tgt_lang}.codes")
         
-        # Learn BPE for source language
-        self.logger.info(f"Learning BPE for {self.src_lang}...")
-        with open(self.files[f"train_{self.src_lang}"], 'r', encoding='utf-8') as src_file:
-            src_data = src_file.readlines()
-            with open(src_bpe_codes_path, 'w', encoding='utf-8') as codes_file:
-                learn_bpe(
-                src_data,
-                codes_file,
-                num_symbols=self.src_bpe_operations,  # use source-specific BPE operations
-                verbose=False
-            )
-        
-        # Learn BPE for target language
-        self.logger.info(f"Learning BPE for {self.tgt_lang}...")
-        with open(self.files[f"train_{self.tgt_lang}"], 'r', encoding='utf-8') as tgt_file:
-            tgt_data = tgt_file.readlines()
-            with open(tgt_bpe_codes_path, 'w', encoding='utf-8') as codes_file:
-                learn_bpe(
-                tgt_data,
-                codes_file,
-                num_symbols=self.tgt_bpe_operations,
-                verbose=False
-            )
+        # Learn BPE for source and target language, each with its own number of operations
+        for lang, codes_path, operations in ((self.src_lang, src_bpe_codes_path, self.src_bpe_operations),
+                                             (self.tgt_lang, tgt_bpe_codes_path, self.tgt_bpe_operations)):
+            self.logger.info(f"Learning BPE for {lang}...")
+            with self.tracer.stage('count_words', lang=lang, shards=len(self.train_shards[lang])) as stage:
+                counts = Counter()
+                for shard_counts in self._map(count_words, self.train_shards[lang]):
+                    counts.update(shard_counts)
+                stage.add(tokens=sum(counts.values()))
+            with self.tracer.stage('learn_bpe', lang=lang, lines=len(counts)):
+                with open(codes_path, 'w', encoding='utf-8') as codes_file:
+                    learn_bpe(
+                    [f"{word} {count}\n" for word, count in counts.items()],
+                    codes_file,
+                    num_symbols=operations,
+                    verbose=False,
+                    is_dict=True
+                )
                     
         # Store paths for use in apply_bpe
         self.src_bpe_codes_path = src_bpe_codes_path
@@ -163,37 +268,74 @@ class ONMTPreprocessor:
     def apply_bpe(self):
         """Apply language-specific BPE codes to datasets."""
         self.logger.info("Applying BPE codes...")
-        
-        # Create BPE processors for each language
-        src_bpe = BPE(open(self.src_bpe_codes_path, 'r', encoding='utf-8'))
-        tgt_bpe = BPE(open(self.tgt_bpe_codes_path, 'r', encoding='utf-8'))
-
-        datasets = [
-            ('train', self.files[f"train_{self.src_lang}"], self.src_lang, src_bpe),
-            ('train', self.files[f"train_{self.tgt_lang}"], self.tgt_lang, tgt_bpe),
-            ('dev', self.files[f"dev_{self.src_lang}"], self.src_lang, src_bpe),
-            ('dev', self.files[f"dev_{self.tgt_lang}"], self.tgt_lang, tgt_bpe),
-        ]
-
-        for split, input_path, lang, bpe_processor in datasets:
-            output_path = os.path.join(self.output_dir, f"{split}.bpe.{lang}")
-            with open(input_path, 'r', encoding='utf-8') as infile, \
-                open(output_path, 'w', encoding='utf-8') as outfile:
-                for line in infile:
-                    outfile.write(bpe_processor.process_line(line))
+        if not self.train_shards:
+            self.shard_training_data()
+        codes = {self.src_lang: self.src_bpe_codes_path, self.tgt_lang: self.tgt_bpe_codes_path}
+
+        # Training shards are encoded in parallel
+        for lang in (self.src_lang, self.tgt_lang):
+            inputs = self.train_shards[lang]
+            outputs = [self.train_bpe_path(lang, k) for k in range(len(inputs))]
+            with self.tracer.stage('apply_bpe', split='train', lang=lang, shards=len(inputs)) as stage:
+                for lines, tokens in self._map(encode_file, [codes[lang]] * len(inputs), inputs, outputs):
+                    stage.add(lines=lines, tokens=tokens)
+            self.logger.info(f"BPE applied to {self.files[f'train_{lang}']}, output saved to "
+                             f"{outputs[0] if len(outputs) == 1 else f'{len(outputs)} shards {outputs[0]}...'}")
+
+        for lang in (self.src_lang, self.tgt_lang):
+            input_path = self.files[f"dev_{lang}"]
+            output_path = os.path.join(self.output_dir, f"dev.bpe.{lang}")
+            with self.tracer.stage('apply_bpe', split='dev', lang=lang) as stage:
+                lines, tokens = encode_file(codes[lang], input_path, output_path)
+                stage.add(lines=lines, tokens=tokens)
             self.logger.info(f"BPE applied to {input_path}, output saved to {output_path}")
 
+    def vocab_config(self) -> str:
+        """Config to build the vocabulary from.
+
+        onmt_build_vocab samples -n_sample lines from every corpus, so with
+        shards the first vocab_sample lines across the encoded shards are
+        written to one sample corpus and a config listing only that corpus
+        is returned. Without shards this is the training config itself.
+        """
+        config_path = os.path.join(self.output_dir, f"{self.save_prefix}_config.yaml")
+        if self.num_shards <= 1:
+            return config_path
+
+        with open(config_path) as f:
+            config = yaml.safe_load(f)
+        sample = {}
+        for lang, key in ((self.src_lang, 'path_src'), (self.tgt_lang, 'path_tgt')):
+            sample[key] = os.path.join(self.output_dir, f"vocab_sample.bpe.{lang}")
+            remaining = self.vocab_sample
+            with open(sample[key], 'w', encoding='utf-8') as out:
+                for k in range(self.num_shards):
+                    if remaining <= 0:
+                        break
+                    with open(self.train_bpe_path(lang, k), encoding='utf-8') as shard:
+                        for line in islice(shard, remaining):
+                            out.write(line)
+                            remaining -= 1
+        config['data'] = {'corpus_1': sample, 'valid': config['data']['valid']}
+
+        vocab_config_path = os.path.join(self.output_dir, f"{self.save_prefix}_vocab_config.yaml")
+        with open(vocab_config_path, 'w') as f:
+            yaml.dump(config, f, default_flow_style=False)
+        self.logger.info(f"Vocabulary sample of {self.vocab_sample} lines per language saved to {vocab_config_path}")
+        return vocab_config_path
+
     def build_vocab(self):
         """Build vocabulary using onmt_build_vocab."""
         try:
             self.logger.info("Building vocabulary...")
-            config_path = os.path.join(self.output_dir, f"{self.save_prefix}_config.yaml")
+            config_path = self.vocab_config()
             build_vocab_cmd = [
                 "onmt_build_vocab",
                 "-config", config_path,
-                "-n_sample", str(10000)  # Adjust as needed
+                "-n_sample", str(self.vocab_sample)
             ]
-            subprocess.run(build_vocab_cmd, check=True)
+            with self.tracer.stage('build_vocab'):
+                subprocess.run(build_vocab_cmd, check=True)
             self.logger.info("Vocabulary building completed successfully.")
         except subprocess.CalledProcessError as e:
             self.logger.error(f"Error during vocabulary building: {e}")
@@ -202,6 +344,18 @@ class ONMTPreprocessor:
             self.logger.error(f"Unexpected error: {e}")
             raise
 
+    def check_vocab(self, thresholds: Optional[Dict[str, float]] = None):
+        """Check the encoded dev sets against the codes and vocabularies, so a
+        mismatch fails here instead of in the training job (see vocab_check.py)."""
+        vocabs = {lang: f"{self.save_data}.vocab.{lang}" for lang in (self.src_lang, self.tgt_lang)}
+        for lang, other, codes_path in ((self.src_lang, self.tgt_lang, self.src_bpe_codes_path),
+                                        (self.tgt_lang, self.src_lang, self.tgt_bpe_codes_path)):
+            dev_path = os.path.join(self.output_dir, f"dev.bpe.{lang}")
+            with self.tracer.stage('vocab_check', lang=lang):
+                precheck(dev_path, codes_path, vocabs[lang], vocabs[other], encoded=True,
+                         thresholds=thresholds, log=self.logger.info)
+        self.logger.info("Vocabulary check passed.")
+
 def main():
     parser = argparse.ArgumentParser(
         description='Preprocess data using OpenNMT-py tools with BPE encoding'
@@ -235,6 +389,18 @@ def main():
                         help='Number of BPE merge operations for source')
     parser.add_argument('--tgt-bpe-operations', type=int, default=8000,
                         help='Number of BPE merge operations for target')
+    parser.add_argument('--trace', default=None,
+                        help='Save a Chrome trace with the time and memory of every stage to this file')
+    parser.add_argument('--max-unk-rate', type=float, default=0.01,
+                        help='Maximum share of dev subwords missing from the vocabulary')
+    parser.add_argument('--skip-vocab-check', action='store_true',
+                        help='Do not check the dev sets against the new vocabulary')
+    parser.add_argument('--num-shards', type=int, default=1,
+                        help='Split the training data into this many shards (one corpus each in the config)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Processes counting and encoding the shards')
+    parser.add_argument('--vocab-sample', type=int, default=10000,
+                        help='Training lines sampled to build the vocabulary (in total, also with shards)')
 
     args = parser.parse_args()
 
@@ -247,7 +413,11 @@ def main():
         args.src_min_frequency,
         args.tgt_min_frequency,
         args.src_bpe_operations,
-        args.tgt_bpe_operations
+        args.tgt_bpe_operations,
+        Tracer(enabled=args.trace is not None),
+        args.num_shards,
+        args.workers,
+        args.vocab_sample
     )
 
     args = parser.parse_args()
@@ -283,6 +453,19 @@ def main():
     # Build Vocabulary
     preprocessor.build_vocab()
 
+    # Fail now rather than in the training job
+    if not args.skip_vocab_check:
+        try:
+            preprocessor.check_vocab({'max_unk_rate': args.max_unk_rate})
+        except VocabCheckError as e:
+            preprocessor.logger.error(str(e))
+            raise SystemExit(1)
+
+    if args.trace:
+        preprocessor.tracer.report(preprocessor.logger.info)
+        preprocessor.tracer.save(args.trace)
+        preprocessor.logger.info(f"Trace saved to {args.trace}")
+
 
 if __name__ == "__main__":
     main()
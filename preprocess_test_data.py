@@ -1,13 +1,35 @@
 """Script for encoding test data"""
+import argparse
+import os
+import sys
 from subword_nmt.apply_bpe import BPE
+from vocab_check import VocabCheckError, precheck
+
+parser = argparse.ArgumentParser(description='Encode the test set with the BPE codes of the training data')
+parser.add_argument('--input', default='processed_data_moses/salt.test.tk.lc.ach', help='Tokenized test file')
+parser.add_argument('--codes', default='onmt_data/data.ach.codes', help='BPE codes of the same language')
+parser.add_argument('--output', default='onmt_data/test.bpe.ach', help='Encoded output file')
+parser.add_argument('--vocab', default='onmt_data/data.vocab.ach',
+                    help='OpenNMT vocab of the same language (the check is skipped if it does not exist)')
+parser.add_argument('--other-vocab', default=None, help='OpenNMT vocab of the other language')
+parser.add_argument('--skip-vocab-check', action='store_true', help='Encode without checking coverage first')
+args = parser.parse_args()
+
+# Check that codes, vocab and input belong together before encoding
+if not args.skip_vocab_check:
+    vocab = args.vocab if args.vocab and os.path.exists(args.vocab) else None
+    try:
+        precheck(args.input, args.codes, vocab, args.other_vocab)
+    except VocabCheckError as e:
+        sys.exit(f"Error: {e}")
 
 # Create BPE processor using existing codes
-with open('onmt_data/data.src.codes', 'r', encoding='utf-8') as codes_file:
+with open(args.codes, 'r', encoding='utf-8') as codes_file:
     bpe = BPE(codes_file)
 
 # Apply BPE to test file
-with open('processed_data_moses/salt.test.tk.lc.eng', 'r', encoding='utf-8') as infile, \
-     open('onmt_data/test.bpe.eng', 'w', encoding='utf-8') as outfile:
+with open(args.input, 'r', encoding='utf-8') as infile, \
+     open(args.output, 'w', encoding='utf-8') as outfile:
     for line in infile:
         outfile.write(bpe.process_line(line))
-print("file saved: onmt_data/test.bpe.ach")
\ No newline at end of file
+print(f"file saved: {args.output}")
@@ -0,0 +1,224 @@
+"""
+sentence_store.py contains a columnar per-sentence store for translation sweeps.
+
+Every sweep cell (checkpoint, beam size, batching, ...) adds one row per test
+sentence with the de-BPE'd hypothesis, the source and reference lengths, the
+sentence's sufficient statistics for every metric (see metric_stats.py) and
+its sentence-level scores. The table is saved as Parquet (pandas with pyarrow
+or fastparquet), or as gzipped CSV when neither is installed.
+
+Corpus scores, length-bucket scores, checkpoint diffs and bootstrap tests are
+then sums over rows followed by the metric's closed-form score, so nothing is
+decoded or re-scored again.
+"""
+import argparse
+import os
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+import pandas as pd
+from metric_stats import SentenceStats, make_metric, scores_from_stats
+
+DEFAULT_BUCKETS = (0, 10, 20, 30, 50, np.inf)
+
+
+def _stat_columns(columns: Sequence[str], metric: str) -> List[str]:
+    prefix = f"{metric}_stat"
+    return sorted((c for c in columns if c.startswith(prefix)), key=lambda c: int(c[len(prefix):]))
+
+
+class SentenceStore:
+    def __init__(self, sentences: Optional[pd.DataFrame] = None) -> None:
+        """
+        Per-sentence results of a sweep, one row per (cell, sentence).
+
+        Args:
+            sentences: Table from an earlier run (see load); empty by default
+        """
+        self._frames = [] if sentences is None else [sentences]
+        self._sentences = sentences
+
+    @property
+    def sentences(self) -> pd.DataFrame:
+        """The whole table, with the cells added so far."""
+        if self._sentences is None or len(self._frames) > 1:
+            self._sentences = (pd.concat(self._frames, ignore_index=True) if self._frames
+                               else pd.DataFrame(columns=['cell', 'sentence']))
+            self._frames = [self._sentences]
+        return self._sentences
+
+    @property
+    def metrics(self) -> List[str]:
+        """Metrics with statistics in the store."""
+        return [name for name in ('bleu', 'chrf', 'chrf++')
+                if _stat_columns(self.sentences.columns, name)]
+
+    def cells(self) -> List[str]:
+        """Cell names in the order they were added."""
+        return list(dict.fromkeys(self.sentences['cell']))
+
+    def add_cell(self,
+                 cell: str,
+                 hypotheses: List[str],
+                 stats: Dict[str, np.ndarray],
+                 src_tokens: Sequence[int],
+                 ref_tokens: Sequence[int]) -> None:
+        """
+        Add the sentences of one sweep cell.
+
+        Args:
+            cell: Cell name, e.g. "step6000_beam5_batch32"
+            hypotheses: De-BPE'd hypotheses, one per test sentence
+            stats: Sentence statistics matrix per metric name, as in
+                SentenceStats.stats or StreamingScorer.sentence_stats
+            src_tokens: Token count of every source sentence
+            ref_tokens: Token count of every reference sentence
+        """
+        columns = {
+            'cell': cell,
+            'sentence': np.arange(len(hypotheses)),
+            'src_tokens': np.asarray(src_tokens, dtype=np.int32),
+            'ref_tokens': np.asarray(ref_tokens, dtype=np.int32),
+            'hyp_tokens': np.array([len(line.split()) for line in hypotheses], dtype=np.int32),
+            'hypothesis': hypotheses,
+        }
+        for name, rows in stats.items():
+            rows = np.asarray(rows, dtype=np.int64)
+            columns[name] = scores_from_stats(make_metric(name), rows)
+            for i in range(rows.shape[1]):
+                columns[f"{name}_stat{i}"] = rows[:, i]
+        self._frames.append(pd.DataFrame(columns))
+
+    def save(self, output_dir: str, name: str = "sentences") -> str:
+        """Save the table as output_dir/name.parquet (or .csv.gz) and return its path."""
+        path = os.path.join(output_dir, f"{name}.parquet")
+        try:
+            self.sentences.to_parquet(path, index=False)
+        except ImportError:
+            # Neither pyarrow nor fastparquet is installed
+            path = os.path.join(output_dir, f"{name}.csv.gz")
+            self.sentences.to_csv(path, index=False)
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> 'SentenceStore':
+        """Load a store saved with save (a .parquet or .csv.gz file, or the directory holding it)."""
+        if os.path.isdir(path):
+            parquet = os.path.join(path, "sentences.parquet")
+            path = parquet if os.path.exists(parquet) else os.path.join(path, "sentences.csv.gz")
+        if path.endswith(".parquet"):
+            sentences = pd.read_parquet(path)
+        else:
+            sentences = pd.read_csv(path, keep_default_na=False, dtype={'cell': str, 'hypothesis': str})
+        return cls(sentences)
+
+    def stats(self, cell: str, metric: str = 'bleu') -> np.ndarray:
+        """Sentence statistics matrix of one cell, in sentence order."""
+        rows = self.sentences[self.sentences['cell'] == cell].sort_values('sentence')
+        return rows[_stat_columns(rows.columns, metric)].to_numpy(dtype=np.int64)
+
+    def sentence_stats(self, cell: str) -> SentenceStats:
+        """SentenceStats of one cell, e.g. for bootstrap_evaluation.multi_system_bootstrap."""
+        return SentenceStats.from_stats({metric: self.stats(cell, metric) for metric in self.metrics})
+
+    def system_stats(self, cells: Optional[List[str]] = None) -> Dict[str, SentenceStats]:
+        """SentenceStats per cell (all cells by default)."""
+        return {cell: self.sentence_stats(cell) for cell in (cells or self.cells())}
+
+    def _grouped_scores(self, metric: str, keys: List) -> pd.Series:
+        columns = _stat_columns(self.sentences.columns, metric)
+        totals = self.sentences.groupby(keys, sort=False, observed=True)[columns].sum()
+        return pd.Series(scores_from_stats(make_metric(metric), totals.to_numpy(dtype=np.int64)),
+                         index=totals.index, name=metric)
+
+    def corpus_scores(self, metric: str = 'bleu') -> pd.Series:
+        """Corpus-level score of every cell, identical to scoring its output with sacrebleu."""
+        return self._grouped_scores(metric, ['cell'])
+
+    def bucket_scores(self,
+                      metric: str = 'bleu',
+                      column: str = 'src_tokens',
+                      buckets: Sequence[float] = DEFAULT_BUCKETS) -> pd.DataFrame:
+        """
+        Corpus-level scores of every cell per length bucket.
+
+        Args:
+            metric: Metric name
+            column: Length column to bucket by ('src_tokens', 'ref_tokens' or 'hyp_tokens')
+            buckets: Bucket edges; a sentence of length n is in [edge_i, edge_i+1)
+
+        Returns:
+            Table with one row per cell and one column per bucket
+        """
+        bucket = pd.cut(self.sentences[column], list(buckets), right=False)
+        scores = self._grouped_scores(metric, [self.sentences['cell'], bucket])
+        return scores.unstack().sort_index(axis=1)
+
+    def compare(self, cell_a: str, cell_b: str, metric: str = 'bleu') -> pd.DataFrame:
+        """
+        Sentence-level differences between two cells, largest gains of cell_b first.
+
+        Returns:
+            Table with the sentence index, both hypotheses, both sentence scores and their difference
+        """
+        a = self.sentences[self.sentences['cell'] == cell_a].set_index('sentence')
+        b = self.sentences[self.sentences['cell'] == cell_b].set_index('sentence')
+        diff = pd.DataFrame({
+            f'{metric}_a': a[metric],
+            f'{metric}_b': b[metric],
+            'hypothesis_a': a['hypothesis'],
+            'hypothesis_b': b['hypothesis'],
+        })
+        diff['diff'] = diff[f'{metric}_b'] - diff[f'{metric}_a']
+        return diff.sort_values('diff', ascending=False).reset_index()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the per-sentence results of a translation sweep')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    scores_parser = subparsers.add_parser('scores', help='Corpus score of every cell')
+    buckets_parser = subparsers.add_parser('buckets', help='Scores of every cell per length bucket')
+    buckets_parser.add_argument('--column', choices=['src_tokens', 'ref_tokens', 'hyp_tokens'],
+                                default='src_tokens', help='Length to bucket by')
+    buckets_parser.add_argument('--edges', type=float, nargs='+', default=list(DEFAULT_BUCKETS),
+                                help='Bucket edges (use inf for an open last bucket)')
+    compare_parser = subparsers.add_parser('compare', help='Sentence-level differences between two cells')
+    compare_parser.add_argument('cell_a', help='First cell')
+    compare_parser.add_argument('cell_b', help='Second cell')
+    compare_parser.add_argument('--top', type=int, default=10, help='Sentences to show at each end')
+    bootstrap_parser = subparsers.add_parser('bootstrap', help='Paired bootstrap over cells')
+    bootstrap_parser.add_argument('--cells', nargs='+', default=None, help='Cells to compare (all by default)')
+    bootstrap_parser.add_argument('--iterations', type=int, default=1000, help='Bootstrap iterations')
+    bootstrap_parser.add_argument('--seed', type=int, default=None, help='Random seed')
+    bootstrap_parser.add_argument('--alpha', type=float, default=0.05, help='Significance level')
+    for subparser in (scores_parser, buckets_parser, compare_parser, bootstrap_parser):
+        subparser.add_argument('--store', required=True,
+                               help='sentences.parquet/.csv.gz or the sweep directory holding it')
+        subparser.add_argument('--metric', choices=['bleu', 'chrf', 'chrf++'], default='bleu', help='Metric')
+    args = parser.parse_args()
+
+    store = SentenceStore.load(args.store)
+    pd.set_option('display.width', 200)
+    if args.command == 'scores':
+        print(store.corpus_scores(args.metric).sort_values(ascending=False).to_string())
+    elif args.command == 'buckets':
+        print(store.bucket_scores(args.metric, args.column, args.edges).round(2).to_string())
+    elif args.command == 'compare':
+        diff = store.compare(args.cell_a, args.cell_b, args.metric)
+        print(diff.head(args.top).to_string())
+        print('...')
+        print(diff.tail(args.top).to_string())
+    else:
+        # Imported here, it needs the evaluation dependencies
+        from bootstrap_evaluation import multi_system_bootstrap, print_multi_system_results
+        results = multi_system_bootstrap(store.system_stats(args.cells), args.metric,
+                                         args.iterations, args.seed, args.alpha)
+        print_multi_system_results(results, args.alpha)
+
+
+if __name__ == "__main__":
+    main()
+
+# Example:
+# python sentence_store.py buckets --store translations_20240101_120000 --metric chrf
+# python sentence_store.py compare step5000_beam5_batch32 step6000_beam5_batch32 \
+#     --store translations_20240101_120000
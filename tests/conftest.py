@@ -0,0 +1,6 @@
+"""Puts the repository root and tools/ on sys.path, as the scripts are run from the root."""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "tools")]
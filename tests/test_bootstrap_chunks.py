@@ -0,0 +1,87 @@
+import statistics
+
+import numpy as np
+import pytest
+from sacrebleu.metrics import BLEU, CHRF
+
+from bootstrap_evaluation import OpenNMTBootstrapEvaluator, RunningStats, wilson_interval
+from translator_backends import LocalBackend
+
+
+class DroppingBackend(LocalBackend):
+    """Identity decoder that drops every k-th token, with k taken from the model name."""
+
+    def translate(self, model_paths, src_lines, *args, **kwargs):
+        every = int(model_paths[0].rsplit('_', 1)[-1])
+        for line in super().translate(model_paths, src_lines, *args, **kwargs):
+            yield ' '.join(token for i, token in enumerate(line.split()) if (i + 1) % every)
+
+
+class SacrebleuEval:
+    """eval_class without COMET or METEOR: BLEU, with chrF in place of METEOR."""
+
+    def __init__(self, source_file, translation_out, refference_file, model):
+        self.trans, self.ref = translation_out, refference_file
+
+    def full_evaluation(self):
+        with open(self.trans, encoding='utf-8') as f:
+            hypotheses = [line.strip() for line in f]
+        with open(self.ref, encoding='utf-8') as f:
+            references = [[line.strip() for line in f]]
+        self.bleu_score = BLEU().corpus_score(hypotheses, references).score
+        self.meteor_score = CHRF().corpus_score(hypotheses, references).score
+        self.comet_score = 0.0
+
+
+@pytest.fixture
+def evaluator(tmp_path):
+    rng = np.random.default_rng(0)
+    words = [f"w{i}" for i in range(50)]
+    lines = [' '.join(rng.choice(words, size=rng.integers(3, 12))) for _ in range(40)]
+    src = tmp_path / "src.txt"
+    src.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    return OpenNMTBootstrapEvaluator(str(src), "model_every_3", "model_every_4", str(src), SacrebleuEval,
+                                     n_iterations=12, temp_dir=str(tmp_path), backend=DroppingBackend())
+
+
+def test_running_stats_merge_matches_serial():
+    values = np.random.default_rng(1).normal(size=37).tolist()
+    serial = RunningStats()
+    for value in values:
+        serial.add(value)
+    merged = RunningStats()
+    for start in range(0, len(values), 10):
+        part = RunningStats()
+        for value in values[start:start + 10]:
+            part.add(value)
+        merged.merge(RunningStats.from_dict(part.to_dict()))
+    merged.merge(RunningStats())
+    assert merged.count == serial.count == len(values)
+    assert merged.mean == pytest.approx(statistics.mean(values))
+    assert merged.variance == pytest.approx(statistics.variance(values))
+    assert serial.std == pytest.approx(statistics.stdev(values))
+
+
+def test_wilson_interval():
+    low, high = wilson_interval(50, 100, confidence=0.95)
+    assert low < 0.5 < high
+    narrow_low, narrow_high = wilson_interval(500, 1000, confidence=0.95)
+    assert low < narrow_low and narrow_high < high
+    assert wilson_interval(0, 100)[0] == 0.0
+    assert wilson_interval(100, 100)[1] == pytest.approx(1.0)
+    assert wilson_interval(0, 0) == (0.0, 1.0)
+
+
+def test_chunked_workers_match_serial_run(evaluator):
+    serial = evaluator.run_bootstrap(seed=5, n_workers=1, chunk_size=4)
+    parallel = evaluator.run_bootstrap(seed=5, n_workers=2, chunk_size=4)
+    for metric in ('bleu', 'meteor'):
+        for key, value in serial['metrics'][metric].items():
+            assert parallel['metrics'][metric][key] == pytest.approx(value, abs=1e-12), (metric, key)
+    assert serial['metrics']['bleu']['experimental_wins'] > 0
+
+
+def test_workspace_is_removed(evaluator, tmp_path):
+    evaluator.run_bootstrap(seed=1, chunk_size=6)
+    assert evaluator.temp_dir is None
+    assert not list(tmp_path.glob("bootstrap_*"))
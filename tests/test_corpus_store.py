@@ -0,0 +1,93 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from corpus_store import (CorpusLines, MmapCorpus, corpus_to_text, count_lines, count_tokens,
+                          read_lengths, read_lines, text_to_corpus)
+
+LINES = ["the cat sat", "", "a dog  barked at the cat", "cat"]
+
+
+@pytest.fixture
+def text_file(tmp_path):
+    path = tmp_path / "train.tk"
+    path.write_text("\n".join(LINES) + "\n", encoding="utf-8")
+    return str(path)
+
+
+@pytest.fixture
+def corpus_prefix(text_file, tmp_path):
+    prefix = str(tmp_path / "corpus" / "train")
+    text_to_corpus(text_file, prefix)
+    return prefix
+
+
+def normalized(lines):
+    return [" ".join(line.split()) for line in lines]
+
+
+def test_round_trip(corpus_prefix, tmp_path):
+    out = tmp_path / "decoded.txt"
+    corpus_to_text(corpus_prefix, str(out))
+    assert out.read_text(encoding="utf-8").splitlines() == normalized(LINES)
+
+
+def test_read_lines_is_lazy_and_matches_text(text_file, corpus_prefix):
+    lines = read_lines(corpus_prefix)
+    assert isinstance(lines, CorpusLines)
+    assert list(lines) == normalized(read_lines(text_file))
+    assert lines[2] == "a dog barked at the cat"
+    assert lines[-1] == "cat"
+    assert lines[np.int64(0)] == "the cat sat"
+    assert lines[1:3] == ["", "a dog barked at the cat"]
+    assert lines[::2] == ["the cat sat", "a dog barked at the cat"]
+    with pytest.raises(IndexError):
+        lines[len(LINES)]
+
+
+def test_lines_pickle_as_prefix(corpus_prefix):
+    lines = read_lines(corpus_prefix)
+    restored = pickle.loads(pickle.dumps(lines))
+    assert list(restored) == list(lines)
+    assert isinstance(restored.corpus.ids, np.memmap)
+
+
+def test_block_decoding_crosses_block_boundaries(tmp_path, monkeypatch):
+    import corpus_store
+    monkeypatch.setattr(corpus_store, "DECODE_BLOCK", 3)
+    text = tmp_path / "long.txt"
+    expected = [f"line {i} " + "x " * (i % 4) for i in range(10)]
+    text.write_text("\n".join(expected) + "\n", encoding="utf-8")
+    corpus = text_to_corpus(str(text), str(tmp_path / "long"))
+    assert list(corpus.lines()) == normalized(expected)
+    assert list(corpus.lines(4, 8)) == normalized(expected[4:8])
+
+
+def test_counts_and_lengths_match_text(text_file, corpus_prefix):
+    assert count_tokens(corpus_prefix) == count_tokens(text_file)
+    assert count_tokens(corpus_prefix)["cat"] == 3
+    np.testing.assert_array_equal(read_lengths(corpus_prefix), [3, 0, 6, 1])
+    np.testing.assert_array_equal(read_lengths(corpus_prefix), read_lengths(text_file))
+    assert count_lines(corpus_prefix) == count_lines(text_file) == len(LINES)
+
+
+def test_shared_vocab_keeps_ids(corpus_prefix, tmp_path):
+    train = MmapCorpus(corpus_prefix)
+    dev_text = tmp_path / "dev.tk"
+    dev_text.write_text("the bird\n", encoding="utf-8")
+    dev = text_to_corpus(str(dev_text), str(tmp_path / "dev"), train.vocab)
+    assert dev.vocab[:len(train.vocab)] == train.vocab
+    assert dev.tokens(0) == ["the", "bird"]
+    assert dev[0][0] == train.vocab.index("the")
+
+
+def test_overlap_loads_corpus_like_text(text_file, corpus_prefix):
+    from analyze_overlap import load_corpus
+
+    def decoded(path):
+        vocab, words = {}, []
+        tokens, offsets = load_corpus(path, 3, vocab, words)
+        return [[words[t] for t in tokens[offsets[i]:offsets[i + 1]]] for i in range(len(offsets) - 1)]
+
+    assert decoded(corpus_prefix) == decoded(text_file)
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from filter_bitext import BitextFilter, CharNgramLID, EncodedBatch
+from tools.analyze_line_endings import has_end_punct
+
+LINES = ["Dano  me mwaka.\n", "", "  the cat sat!", "Привет мир", "ŋat ma okobo ?\n"]
+
+ACHOLI = ["an aye latin ma maber", "gin ma otimme i kare ca", "lutino gudwogo paco", "wan waneno gang",
+          "ber ki in ducu", "latin mukene ocito i cukul"] * 5
+ENGLISH = ["i am a good child", "what happened at that time", "the children went home", "we saw the village",
+           "good to you all", "another child went to school"] * 5
+
+
+@pytest.fixture(scope="module")
+def lid():
+    return CharNgramLID.train({'ach': ACHOLI, 'en': ENGLISH}, buckets=1 << 12)
+
+
+def test_token_counts_match_split():
+    np.testing.assert_array_equal(EncodedBatch(LINES).token_counts(), [len(line.split()) for line in LINES])
+
+
+def test_end_punct_matches_analyze_line_endings():
+    assert EncodedBatch(LINES).end_punct().tolist() == [has_end_punct(line) for line in LINES]
+
+
+def test_script_ratio():
+    ratios = EncodedBatch(LINES).script_ratio()
+    assert ratios[0] == 1.0 and ratios[4] == 1.0  # ŋ is Latin Extended
+    assert ratios[1] == 1.0  # no letters
+    assert ratios[3] == 0.0
+
+
+def test_ngrams_never_cross_lines():
+    orders, buckets = (1, 2, 3), 1 << 16
+    hashes, lines = EncodedBatch(["ab", "cd"]).ngram_hashes(orders, buckets)
+    for i, line in enumerate(["ab", "cd"]):
+        alone, _ = EncodedBatch([line]).ngram_hashes(orders, buckets)
+        assert sorted(hashes[lines == i].tolist()) == sorted(alone.tolist())
+
+
+def test_language_id(lid, tmp_path):
+    assert lid.predict(["the children saw a good village", "lutino gudwogo i gang"]) == ['en', 'ach']
+    path = str(tmp_path / "lid.npz")
+    lid.save(path)
+    loaded = CharNgramLID.load(path)
+    assert loaded.langs == lid.langs and loaded.orders == lid.orders
+    batch = EncodedBatch(["we went to school", "wan wacito i cukul"])
+    np.testing.assert_allclose(loaded.margin(batch, 'ach'), lid.margin(batch, 'ach'))
+    assert (lid.margin(batch, 'ach') < 0).tolist() == [True, False]
+    with pytest.raises(ValueError, match="no 'fr'"):
+        lid.margin(batch, 'fr')
+
+
+def test_reasons(lid):
+    bitext = BitextFilter('ach', 'en', lid, thresholds={'max_tokens': 10})
+    src = ["latin ma maber.", "", "latin", "a " * 12, "Привет мир", "the children went home", "wan waneno gang."]
+    tgt = ["a good child.", "empty source", "one two three four five", "b " * 12, "hello world",
+           "lutino gudwogo paco", "we saw the village"]
+    reasons = bitext.reasons(bitext.features(src, tgt))
+    flagged = {reason: np.flatnonzero(mask).tolist() for reason, mask in reasons.items()}
+    assert flagged['empty'] == [1]
+    assert flagged['too_long'] == [3]
+    assert flagged['length_ratio'] == [2]
+    assert flagged['script'] == [4]
+    assert flagged['punct_mismatch'] == [6]
+    assert 5 in flagged['language_id'] and 0 not in flagged['language_id']
+
+
+def test_filter_files(tmp_path):
+    src, tgt = tmp_path / "train.ach", tmp_path / "train.en"
+    src.write_text("latin ma maber\n\nwan waneno gang.\nПривет\n", encoding='utf-8')
+    tgt.write_text("a good child\nempty source\nwe saw the village\nhello\n", encoding='utf-8')
+    bitext = BitextFilter('ach', 'en', batch_size=2)
+    outputs = [str(tmp_path / name) for name in ("kept.ach", "kept.en", "rejected.tsv")]
+    counts = bitext.filter_files(str(src), str(tgt), *outputs)
+    assert (counts['total'], counts['kept'], counts['rejected']) == (4, 2, 2)
+    assert counts['empty'] == 1 and counts['script'] == 1 and counts['flagged_punct_mismatch'] == 1
+    assert open(outputs[0], encoding='utf-8').read() == "latin ma maber\nwan waneno gang.\n"
+    assert open(outputs[1], encoding='utf-8').read() == "a good child\nwe saw the village\n"
+    rejected = open(outputs[2], encoding='utf-8').read().splitlines()
+    assert rejected[0] == "reasons\tsource\ttarget"
+    assert [line.split('\t')[0] for line in rejected[1:]] == ["empty", "script"]
+
+    counts = BitextFilter('ach', 'en', reject_punct_mismatch=True).filter_files(str(src), str(tgt), *outputs[:2])
+    assert counts['kept'] == 1 and counts['punct_mismatch'] == 1
+
+
+def test_line_count_mismatch_is_rejected(tmp_path):
+    src, tgt = tmp_path / "a", tmp_path / "b"
+    src.write_text("one\ntwo\n", encoding='utf-8')
+    tgt.write_text("one\n", encoding='utf-8')
+    with pytest.raises(ValueError, match="different number of lines"):
+        BitextFilter('ach', 'en').filter_files(str(src), str(tgt), str(tmp_path / "c"), str(tmp_path / "d"))
@@ -0,0 +1,49 @@
+import numpy as np
+
+from length_batching import (fixed_size_batches, line_lengths, padding_efficiency, restore_order,
+                             sort_lines, token_budget_batches)
+
+LINES = ["a b c d e", "a", "a b", "a b c", "", "a b"]
+
+
+def test_line_lengths():
+    np.testing.assert_array_equal(line_lengths(LINES), [5, 1, 2, 3, 0, 2])
+
+
+def test_fixed_size_batches_cover_every_line_in_order():
+    batches = fixed_size_batches(7, 3)
+    assert [batch.tolist() for batch in batches] == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_token_budget_batches_stay_within_budget():
+    lengths = line_lengths(LINES)
+    order, batches = token_budget_batches(lengths, max_tokens=6)
+    np.testing.assert_array_equal(order, np.argsort(lengths, kind='stable'))
+    assert sorted(np.concatenate(batches).tolist()) == list(range(len(LINES)))
+    for batch in batches:
+        assert len(batch) == 1 or len(batch) * max(lengths[batch].max(), 1) <= 6
+
+
+def test_overlong_sentence_gets_its_own_batch():
+    lengths = np.array([2, 50, 2])
+    _, batches = token_budget_batches(lengths, max_tokens=10)
+    assert [batch.tolist() for batch in batches] == [[0, 2], [1]]
+
+
+def test_sorting_improves_padding_efficiency():
+    lengths = np.array([1, 20, 1, 20, 1, 20])
+    fixed = padding_efficiency(lengths, fixed_size_batches(len(lengths), 2))
+    _, budget = token_budget_batches(lengths, max_tokens=60)
+    assert fixed < padding_efficiency(lengths, budget) == 1.0
+
+
+def test_restore_order_inverts_sort_lines():
+    sorted_lines, order = sort_lines(LINES)
+    assert line_lengths(sorted_lines).tolist() == sorted(line_lengths(LINES).tolist())
+    assert restore_order(sorted_lines, order) == LINES
+
+
+def test_restore_order_keeps_n_best_groups_together():
+    sorted_lines, order = sort_lines(LINES)
+    n_best_output = [f"{line}|{k}" for line in sorted_lines for k in range(2)]
+    assert restore_order(n_best_output, order, n_best=2) == [f"{line}|{k}" for line in LINES for k in range(2)]
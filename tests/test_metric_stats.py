@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from sacrebleu.metrics import BLEU, CHRF
+
+from metric_stats import SentenceStats, StreamingScorer
+
+HYPOTHESES = [
+    "the cat sat on the mat",
+    "a dog barked loudly at the postman",
+    "it is raining",
+    "he went to the market yesterday to buy food",
+    "",
+    "thank you very much",
+]
+REFERENCES = [
+    "the cat sat on a mat",
+    "the dog barked at the postman",
+    "it rains",
+    "yesterday he went to the market to buy food",
+    "hello",
+    "thank you very much",
+]
+
+
+def sacrebleu_scores(indices):
+    hyps = [HYPOTHESES[i] for i in indices]
+    refs = [[REFERENCES[i] for i in indices]]
+    return {
+        'bleu': BLEU().corpus_score(hyps, refs).score,
+        'chrf': CHRF().corpus_score(hyps, refs).score,
+        'chrf++': CHRF(word_order=2).corpus_score(hyps, refs).score,
+    }
+
+
+@pytest.fixture(scope="module")
+def stats():
+    return SentenceStats(HYPOTHESES, REFERENCES)
+
+
+def test_corpus_scores_match_sacrebleu(stats):
+    assert stats.scores() == pytest.approx(sacrebleu_scores(range(len(HYPOTHESES))))
+
+
+def test_subset_with_repeats_matches_sacrebleu(stats):
+    indices = [0, 0, 3, 5, 1, 3]
+    assert stats.scores(indices) == pytest.approx(sacrebleu_scores(indices))
+
+
+def test_weighted_scores_match_per_subset_scores(stats):
+    rng = np.random.default_rng(0)
+    weights = rng.multinomial(len(HYPOTHESES), [1 / len(HYPOTHESES)] * len(HYPOTHESES), size=20)
+    for metric in ('bleu', 'chrf', 'chrf++'):
+        expected = [stats.score(metric, np.repeat(np.arange(len(HYPOTHESES)), row)) for row in weights]
+        np.testing.assert_allclose(stats.weighted_scores(metric, weights), expected, atol=1e-9)
+
+
+def test_sentence_scores_match_sacrebleu(stats):
+    expected = [BLEU().corpus_score([hyp], [[ref]]).score for hyp, ref in zip(HYPOTHESES, REFERENCES)]
+    np.testing.assert_allclose(stats.sentence_scores('bleu'), expected, atol=1e-9)
+
+
+def test_from_stats_round_trip(stats):
+    restored = SentenceStats.from_stats(stats.stats)
+    assert len(restored) == len(HYPOTHESES)
+    assert restored.scores() == stats.scores()
+
+
+def test_streaming_scorer_matches_batch_statistics(stats):
+    scorer = StreamingScorer({'bleu': BLEU(), 'chrf': CHRF()}, REFERENCES)
+    for index in reversed(range(len(HYPOTHESES))):
+        scorer.add(index, HYPOTHESES[index])
+    assert scorer.score() == pytest.approx({name: stats.score(name) for name in ('bleu', 'chrf')})
+    np.testing.assert_array_equal(scorer.sentence_stats('bleu'), stats.stats['bleu'])
+
+
+def test_length_mismatch_is_rejected():
+    with pytest.raises(AssertionError):
+        SentenceStats(HYPOTHESES, REFERENCES[:-1])
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from bootstrap_evaluation import multi_system_bootstrap, resample_counts
+from metric_stats import SentenceStats
+
+REFERENCES = [
+    "the cat sat on the mat",
+    "a dog barked at the postman",
+    "it is raining today",
+    "he went to the market to buy food",
+    "thank you very much",
+    "the children are playing outside",
+    "she reads a book every evening",
+    "we will meet tomorrow morning",
+]
+GOOD = REFERENCES[:4] + ["thank you", "the children play outside", "she reads a book", "we meet tomorrow"]
+BAD = ["cat", "dog", "rain", "market", "thanks", "children", "book", "tomorrow"]
+
+
+@pytest.fixture(scope="module")
+def systems():
+    return {name: SentenceStats(hyps, REFERENCES, ('bleu', 'chrf'))
+            for name, hyps in (('good', GOOD), ('bad', BAD), ('good_copy', GOOD))}
+
+
+def test_resample_counts_draw_n_sentences_per_sample():
+    counts = resample_counts(np.random.default_rng(1), n_sentences=8, n_samples=50)
+    assert counts.shape == (50, 8)
+    assert (counts.sum(axis=1) == 8).all()
+    np.testing.assert_array_equal(counts, resample_counts(np.random.default_rng(1), 8, 50))
+
+
+def test_scores_match_scoring_every_sample_separately(systems):
+    results = multi_system_bootstrap(systems, 'chrf', n_iterations=30, seed=3)
+    counts = resample_counts(np.random.default_rng(3), len(REFERENCES), 30)
+    for k, name in enumerate(results['systems']):
+        expected = [systems[name].score('chrf', np.repeat(np.arange(len(REFERENCES)), row)) for row in counts]
+        assert results['mean'][k] == pytest.approx(np.mean(expected))
+        assert results['std'][k] == pytest.approx(np.std(expected, ddof=1))
+
+
+def test_pairwise_matrices(systems):
+    results = multi_system_bootstrap(systems, 'bleu', n_iterations=200, seed=0)
+    good, bad, copy = (results['systems'].index(name) for name in ('good', 'bad', 'good_copy'))
+    assert results['win_rate'][good][bad] == 1.0
+    assert results['p_value'][good][bad] == 0.0
+    assert results['p_value'][bad][good] == 1.0
+    # Identical output ties on every sample
+    assert results['win_rate'][good][copy] == 0.0
+    assert results['p_value'][good][copy] == 0.5
+    assert results['diff_ci'][good][copy] == [0.0, 0.0]
+    assert results['actual'][good] == systems['good'].score('bleu')
+
+
+def test_same_seed_same_result(systems):
+    first = multi_system_bootstrap(systems, 'bleu', n_iterations=50, seed=11)
+    second = multi_system_bootstrap(systems, 'bleu', n_iterations=50, seed=11)
+    first.pop('time_taken'), second.pop('time_taken')
+    assert first == second
+
+
+def test_systems_must_share_the_test_set(systems):
+    short = SentenceStats(GOOD[:4], REFERENCES[:4], ('bleu',))
+    with pytest.raises(AssertionError):
+        multi_system_bootstrap({'good': systems['good'], 'short': short}, 'bleu', n_iterations=5)
@@ -0,0 +1,56 @@
+import numpy as np
+
+from nbest_rerank import candidate_lengths, length_penalty, parse_nbest, rerank, select
+
+
+def test_parse_nbest_splits_scores_and_pads_short_lists():
+    grouped = ["a b\t-1.5\na\t-2.0", "c d e\t-0.5", "no score"]
+    candidates, scores = parse_nbest(grouped, n_best=2)
+    assert candidates == [["a b", "a"], ["c d e", ""], ["no score", ""]]
+    np.testing.assert_array_equal(scores[:2], [[-1.5, -2.0], [-0.5, -np.inf]])
+    assert np.isnan(scores[2, 0]) and np.isneginf(scores[2, 1])
+
+
+def test_hypothesis_may_contain_tabs():
+    candidates, scores = parse_nbest(["x\ty\t-3.0"], n_best=1)
+    assert candidates == [["x\ty"]]
+    assert scores[0, 0] == -3.0
+
+
+def test_candidate_lengths():
+    np.testing.assert_array_equal(candidate_lengths([["a b", ""], ["a b c", "a"]]), [[2, 0], [3, 1]])
+
+
+def test_length_penalty_is_zero_at_the_expected_ratio():
+    penalty = length_penalty(np.array([[3.0, 7.0]]), np.array([3.0]), log_ratio=0.0)
+    assert penalty[0, 0] == 0.0
+    assert penalty[0, 1] < 0.0
+
+
+def test_model_score_only_picks_the_decoder_best():
+    scores = np.array([[-2.0, -1.0, -3.0], [-0.1, -0.5, -np.inf]])
+    lengths = np.ones((2, 3))
+    best = rerank(scores, lengths, np.ones(2), weights={'length': 0.0})
+    np.testing.assert_array_equal(best, [1, 0])
+
+
+def test_length_penalty_overrides_a_slightly_better_model_score():
+    scores = np.array([[-1.0, -1.1]])
+    lengths = np.array([[1.0, 10.0]])
+    best = rerank(scores, lengths, np.array([10.0]), weights={'model': 1.0, 'length': 1.0}, log_ratio=0.0)
+    assert best[0] == 1
+
+
+def test_qe_scores_are_used_only_with_a_weight():
+    scores = np.array([[-1.0, -1.2]])
+    lengths = np.array([[4.0, 4.0]])
+    qe = np.array([[0.1, 0.9]])
+    assert rerank(scores, lengths, np.array([4.0]), qe_scores=qe)[0] == 0
+    assert rerank(scores, lengths, np.array([4.0]), qe_scores=qe, weights={'qe': 1.0})[0] == 1
+
+
+def test_padded_candidates_are_never_selected():
+    candidates, scores = parse_nbest(["only one\t-50.0"], n_best=3)
+    best = rerank(scores, candidate_lengths(candidates), np.array([2.0]),
+                  qe_scores=np.array([[0.0, 100.0, 100.0]]), weights={'qe': 1.0})
+    assert select(candidates, best) == ["only one"]
@@ -0,0 +1,68 @@
+import pickle
+import time
+
+import pytest
+
+from translation_cache import TranslationCache
+
+OPTIONS = {'beam_size': 5}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = TranslationCache(str(tmp_path / "cache.sqlite"))
+    yield cache
+    cache.close()
+
+
+def test_translate_decodes_only_misses(cache):
+    decoded = []
+
+    def decode(lines):
+        decoded.append(list(lines))
+        return [line.upper() for line in lines]
+
+    assert cache.translate("model.pt", OPTIONS, ["a", "b", "a"], decode) == ["A", "B", "A"]
+    assert cache.translate("model.pt", OPTIONS, ["b", "c"], decode) == ["B", "C"]
+    assert decoded == [["a", "b"], ["c"]]
+    assert (cache.hits, cache.misses) == (1, 4)
+
+
+def test_options_and_model_are_part_of_the_key(cache, tmp_path):
+    checkpoint = tmp_path / "step100.pt"
+    checkpoint.write_bytes(b"weights")
+    cache.store(cache.model_hash(str(checkpoint)), OPTIONS, ["a"], ["A"])
+    assert cache.lookup(cache.model_hash(str(checkpoint)), OPTIONS, ["a"]) == ["A"]
+    assert cache.lookup(cache.model_hash(str(checkpoint)), {'beam_size': 1}, ["a"]) == [None]
+    checkpoint.write_bytes(b"other weights")
+    assert cache.lookup(cache.model_hash(str(checkpoint)), OPTIONS, ["a"]) == [None]
+
+
+def test_identical_checkpoints_share_entries(tmp_path):
+    first, second = tmp_path / "a.pt", tmp_path / "b.pt"
+    first.write_bytes(b"same")
+    second.write_bytes(b"same")
+    assert TranslationCache.model_hash(str(first)) == TranslationCache.model_hash(str(second))
+    assert TranslationCache.model_hash([str(first), str(second)]) != TranslationCache.model_hash(str(first))
+
+
+def test_eviction_removes_least_recently_used_first(tmp_path):
+    # Every entry is 2 characters, the limit holds three of them
+    cache = TranslationCache(str(tmp_path / "cache.sqlite"), max_size_mb=6 / (1024 * 1024))
+    for line in ["a", "b", "c"]:
+        cache.store("model", OPTIONS, [line], [line.upper()])
+        time.sleep(0.01)
+    cache.lookup("model", OPTIONS, ["a"])
+    time.sleep(0.01)
+    cache.store("model", OPTIONS, ["d"], ["D"])
+    assert cache.lookup("model", OPTIONS, ["a", "b", "c", "d"]) == ["A", None, "C", "D"]
+    assert cache.evicted == 1
+    assert cache.size() <= cache.max_size
+    cache.close()
+
+
+def test_cache_is_picklable(cache):
+    cache.store("model", OPTIONS, ["a"], ["A"])
+    restored = pickle.loads(pickle.dumps(cache))
+    assert restored.lookup("model", OPTIONS, ["a"]) == ["A"]
+    restored.close()
@@ -0,0 +1,83 @@
+import io
+
+import pytest
+from subword_nmt.learn_bpe import learn_bpe
+
+from vocab_check import (VocabCheckError, check_coverage, codes_coverage, find_problems, load_codes,
+                         load_vocab, precheck)
+
+
+def write(path, text):
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+@pytest.fixture
+def vocab(tmp_path):
+    return write(tmp_path / "vocab.src", "<unk>\t0\nthe\t9\nca@@\t5\nt\t5\ndog\t4\nsat\t3\n")
+
+
+def test_load_codes_and_vocab(tmp_path, vocab):
+    codes = write(tmp_path / "codes", "#version: 0.2\nc a\nca t</w>\n")
+    assert load_codes(codes) == {"ca", "cat</w>"}
+    assert load_vocab(vocab) == {"<unk>", "the", "ca@@", "t", "dog", "sat"}
+
+
+def test_codes_coverage_skips_specials_and_single_characters():
+    vocab = {"<unk>", "ca@@", "cat", "dog", "d@@", "t"}
+    # dog is the only token the codes cannot produce
+    assert codes_coverage({"ca", "cat</w>"}, vocab) == pytest.approx(4 / 5)
+
+
+def test_encoded_rates(tmp_path, vocab):
+    data = write(tmp_path / "dev.bpe", "the ca@@ t sat\nthe b@@ ir@@ d sat\n")
+    report = check_coverage(data, vocab_path=vocab, encoded=True)
+    assert (report['lines'], report['words'], report['subwords']) == (2, 6, 9)
+    assert report['unk_rate'] == pytest.approx(3 / 9)
+    assert report['oov_rate'] == pytest.approx(1 / 6)
+    assert report['fragmentation'] == pytest.approx(9 / 6)
+    assert report['single_char_rate'] == pytest.approx(3 / 9)
+
+
+def test_raw_input_is_encoded_with_the_codes(tmp_path):
+    train = "the cat sat on the mat\n" * 20
+    codes_path = tmp_path / "codes"
+    with open(codes_path, 'w', encoding='utf-8') as codes_file:
+        learn_bpe(io.StringIO(train), codes_file, num_symbols=30)
+    vocab = write(tmp_path / "vocab", "\n".join(sorted(set(train.split()))) + "\n")
+    report = check_coverage(write(tmp_path / "dev.tk", "the cat sat\n"), str(codes_path), vocab)
+    assert report['unk_rate'] == 0.0
+    assert report['fragmentation'] == 1.0
+    assert report['codes_coverage'] == 1.0
+
+
+def test_wrong_language_is_a_problem(tmp_path, vocab):
+    other = write(tmp_path / "vocab.tgt", "le\nchat\n")
+    data = write(tmp_path / "dev.bpe", "le chat\n")
+    report = check_coverage(data, vocab_path=other, other_vocab_path=vocab, encoded=True)
+    assert report['other_unk_rate'] == 1.0
+    assert find_problems(report) == []
+    report = check_coverage(data, vocab_path=vocab, other_vocab_path=other, encoded=True)
+    assert any("wrong language" in problem for problem in find_problems(report, max_unk_rate=1.0))
+
+
+def test_fragmentation_only_fails_with_an_explicit_limit(tmp_path):
+    vocab = write(tmp_path / "vocab", "c@@\na@@\nt\n")
+    data = write(tmp_path / "dev.bpe", "c@@ a@@ t c@@ a@@ t\n")
+    messages = []
+    report = precheck(data, vocab_path=vocab, encoded=True, log=messages.append)
+    assert report['fragmentation'] == 3.0
+    assert any(message.startswith("Warning") for message in messages)
+    with pytest.raises(VocabCheckError, match="subwords per word"):
+        precheck(data, vocab_path=vocab, encoded=True, thresholds={'max_fragmentation': 2.0}, log=messages.append)
+
+
+def test_unknown_subwords_fail_the_precheck(tmp_path, vocab):
+    data = write(tmp_path / "dev.bpe", "le chat noir\n")
+    with pytest.raises(VocabCheckError, match="not in the vocab"):
+        precheck(data, vocab_path=vocab, encoded=True, log=lambda message: None)
+
+
+def test_empty_input_is_a_problem(tmp_path, vocab):
+    report = check_coverage(write(tmp_path / "empty", ""), vocab_path=vocab, encoded=True)
+    assert find_problems(report) == [f"{tmp_path / 'empty'} is empty"]
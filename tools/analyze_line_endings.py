@@ -1,5 +1,15 @@
 """A tool for comparing end of line punctuation in parallel text files"""
 
+# End punctuation marks
+END_PUNCT = {'.', '!', '?'}
+
+
+def has_end_punct(line):
+    """Check if line ends with punctuation, handling whitespace."""
+    line = line.rstrip()
+    return line[-1] in END_PUNCT if line else False
+
+
 def analyze_line_endings(file1_path, file2_path):
     """
     Compare line endings of two text files and analyze punctuation patterns.
@@ -9,9 +19,6 @@ def analyze_line_endings(file1_path, file2_path):
         file1_path (str): Path to first text file
         file2_path (str): Path to second text file
     """
-    # Define end punctuation marks
-    end_punct = {'.', '!', '?'}
-    
     # Statistics counters
     stats = {
         'total_lines': 0,
@@ -22,11 +29,6 @@ def analyze_line_endings(file1_path, file2_path):
         'only_file2_punct': 0
     }
     
-    def has_end_punct(line):
-        """Check if line ends with punctuation, handling whitespace."""
-        line = line.rstrip()
-        return line[-1] in end_punct if line else False
-    
     try:
         with open(file1_path, 'r', encoding='utf-8') as f1, \
              open(file2_path, 'r', encoding='utf-8') as f2:
@@ -1,37 +1,120 @@
 """analyze_overlap.py contains tools for analyzing overlap in parallel language data files"""
 import os
+import sys
 import argparse
-from collections import Counter
+from itertools import islice
+from typing import Dict, List, Tuple
+import numpy as np
 
-MIN_WORD_LENGTH = 4  # Minimum word length to consider
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from corpus_store import MmapCorpus, is_corpus
 
-def load_corpus(file_path, min_length):
+MIN_WORD_LENGTH = 4  # Minimum word length to consider
+MAX_EXAMPLES = 200  # Maximum number of example lines written per split
+
+def load_corpus(file_path, min_length, vocab: Dict[str, int], words: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Load a corpus as a flat array of token IDs plus line offsets.
+
+    Words are interned into the shared vocab/words tables, so IDs are comparable
+    across both sides of the bitext. Line i consists of tokens[offsets[i]:offsets[i+1]].
+    A memory-mapped corpus (corpus_store.py) is mapped to the shared IDs type by
+    type and then converted in one array operation, without decoding any lines.
+
+    Args:
+        file_path (str): Path to the text file or corpus prefix
+        min_length (int): Minimum word length to keep
+        vocab (dict): Shared word-to-ID map, updated in place
+        words (list): Shared ID-to-word list, updated in place
+    """
+    if is_corpus(file_path):
+        corpus = MmapCorpus(file_path)
+        shared_ids = np.full(len(corpus.vocab), -1, dtype=np.int64)
+        for token_id, word in enumerate(corpus.vocab):
+            if len(word) < min_length:
+                continue
+            word = word.lower()
+            word_id = vocab.get(word)
+            if word_id is None:
+                word_id = vocab[word] = len(words)
+                words.append(word)
+            shared_ids[token_id] = word_id
+        ids = shared_ids[corpus.ids]
+        keep = ids >= 0
+        kept_before = np.concatenate(([0], np.cumsum(keep, dtype=np.int64)))
+        return ids[keep].astype(np.int32), kept_before[corpus.offsets]
+
+    ids = []
+    offsets = [0]
     with open(file_path, 'r', encoding='utf-8') as f:
-        return [[word.lower() for word in line.strip().split() if len(word) >= min_length] for line in f]
-
-def get_word_overlap(ach_corpus, eng_corpus):
-    ach_words = set(word for sentence in ach_corpus for word in sentence)
-    eng_words = set(word for sentence in eng_corpus for word in sentence)
-    return ach_words.intersection(eng_words)
-
-def analyze_overlap(ach_corpus, eng_corpus, overlap, output_file):
-    overlap_count = Counter()
-    total_ach_words = sum(len(sentence) for sentence in ach_corpus)
-    overlap_instances = 0
-
+        for line in f:
+            for word in line.strip().split():
+                if len(word) < min_length:
+                    continue
+                word = word.lower()
+                word_id = vocab.get(word)
+                if word_id is None:
+                    word_id = vocab[word] = len(words)
+                    words.append(word)
+                ids.append(word_id)
+            offsets.append(len(ids))
+    return np.array(ids, dtype=np.int32), np.array(offsets, dtype=np.int64)
+
+def get_word_overlap(ach_tokens: np.ndarray, eng_tokens: np.ndarray) -> np.ndarray:
+    """Return the sorted IDs of word types occurring on both sides."""
+    return np.intersect1d(ach_tokens, eng_tokens)
+
+def line_hits(mask: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Count the True entries of a token mask within each line."""
+    cumulative = np.concatenate(([0], np.cumsum(mask, dtype=np.int64)))
+    return cumulative[offsets[1:]] - cumulative[offsets[:-1]]
+
+def analyze_overlap(ach_tokens, ach_offsets, overlap, vocab_size):
+    """
+    Compute overlap counts with vectorized operations.
+
+    Returns:
+        Tuple of (per-word overlap counts, total Acholi words, overlap instances,
+        per-line overlap hits, token-level overlap mask)
+    """
+    mask = np.isin(ach_tokens, overlap)
+    overlap_count = np.bincount(ach_tokens[mask], minlength=vocab_size)
+    hits = line_hits(mask, ach_offsets)
+    return overlap_count, len(ach_tokens), int(mask.sum()), hits, mask
+
+def check_line_counts(ach_offsets, eng_offsets, ach_path="Acholi", eng_path="English"):
+    """Raise a ValueError unless both sides of the bitext have the same number of lines."""
+    if len(ach_offsets) != len(eng_offsets):
+        raise ValueError(f"{ach_path} has {len(ach_offsets) - 1} lines but {eng_path} has "
+                         f"{len(eng_offsets) - 1}; the files must be line-aligned")
+
+def iter_examples(ach, eng, hits, mask, words):
+    """Lazily yield (line number, Acholi, English, overlapping words) for lines with overlap.
+    Both sides must have the same number of lines (see check_line_counts)."""
+    ach_tokens, ach_offsets = ach
+    eng_tokens, eng_offsets = eng
+    check_line_counts(ach_offsets, eng_offsets)
+    for i in np.flatnonzero(hits):
+        start, end = ach_offsets[i], ach_offsets[i + 1]
+        sentence = ach_tokens[start:end]
+        yield (i + 1,
+               ' '.join(words[t] for t in sentence),
+               ' '.join(words[t] for t in eng_tokens[eng_offsets[i]:eng_offsets[i + 1]]),
+               [words[t] for t in sentence[mask[start:end]]])
+
+def write_examples(examples, output_file, max_examples=MAX_EXAMPLES):
+    """Write at most max_examples overlap examples, pulling them from the iterator on demand."""
     with open(output_file, 'w', encoding='utf-8') as f:
-        for i, (ach_sentence, eng_sentence) in enumerate(zip(ach_corpus, eng_corpus)):
-            sentence_overlap = [word for word in ach_sentence if word in overlap]
-            if sentence_overlap:
-                f.write(f"Line {i+1}:\n")
-                f.write(f"Acholi:  {' '.join(ach_sentence)}\n")
-                f.write(f"English: {' '.join(eng_sentence)}\n")
-                f.write(f"Overlapping words: {', '.join(sentence_overlap)}\n\n")
-                overlap_instances += len(sentence_overlap)
-            for word in sentence_overlap:
-                overlap_count[word] += 1
-
-    return overlap_count, total_ach_words, overlap_instances
+        for line_no, ach_sentence, eng_sentence, sentence_overlap in islice(examples, max_examples):
+            f.write(f"Line {line_no}:\n")
+            f.write(f"Acholi:  {ach_sentence}\n")
+            f.write(f"English: {eng_sentence}\n")
+            f.write(f"Overlapping words: {', '.join(sentence_overlap)}\n\n")
+
+def top_overlap(overlap_count, words, n=10):
+    """Return the n most frequent overlapping words as (word, count) pairs."""
+    top = np.argsort(-overlap_count, kind='stable')[:n]
+    return [(words[i], int(overlap_count[i])) for i in top if overlap_count[i] > 0]
 
 def write_stats(stats, output_file, data_type):
     with open(output_file, 'w', encoding='utf-8') as f:
@@ -43,6 +126,7 @@ def write_stats(stats, output_file, data_type):
             f.write(f"Unique English words: {data['unique_eng_words']}\n")
             f.write(f"Number of overlapping word types: {data['overlap_types']}\n")
             f.write(f"Number of overlapping word instances: {data['overlap_instances']}\n")
+            f.write(f"Number of lines with overlap: {data['overlap_lines']}\n")
             f.write(f"Percentage of overlapping word types: {data['overlap_types_percent']:.2f}%\n")
             f.write(f"Percentage of overlapping word instances: {data['overlap_instances_percent']:.2f}%\n")
             f.write("\nTop 10 overlapping words:\n")
@@ -50,7 +134,7 @@ def write_stats(stats, output_file, data_type):
                 f.write(f"{word}: {count}\n")
             f.write("\n")
 
-def main(data_type):
+def main(data_type, max_examples=MAX_EXAMPLES):
     if data_type == 'raw':
         data_dir = "data"
         file_prefix = "salt"
@@ -60,7 +144,7 @@ def main(data_type):
 
     output_dir = f"overlap_analysis_{data_type}"
     os.makedirs(output_dir, exist_ok=True)
-    
+
     splits = ["train", "dev", "test"] if data_type == 'raw' else ["train"]
     stats = {}
 
@@ -73,15 +157,22 @@ def main(data_type):
             ach_path = os.path.join(data_dir, f"{file_prefix}.ach")
             eng_path = os.path.join(data_dir, f"{file_prefix}.eng")
 
-        ach_corpus = load_corpus(ach_path, MIN_WORD_LENGTH)
-        eng_corpus = load_corpus(eng_path, MIN_WORD_LENGTH)
+        # Both sides share one vocabulary so that overlap is a set operation on IDs
+        vocab, words = {}, []
+        ach_tokens, ach_offsets = load_corpus(ach_path, MIN_WORD_LENGTH, vocab, words)
+        eng_tokens, eng_offsets = load_corpus(eng_path, MIN_WORD_LENGTH, vocab, words)
+        check_line_counts(ach_offsets, eng_offsets, ach_path, eng_path)
+
+        overlap = get_word_overlap(ach_tokens, eng_tokens)
+        overlap_count, total_words, overlap_instances, hits, mask = analyze_overlap(
+            ach_tokens, ach_offsets, overlap, len(words))
 
-        overlap = get_word_overlap(ach_corpus, eng_corpus)
         output_file = os.path.join(output_dir, f"{split}_overlap_examples.txt")
-        overlap_count, total_words, overlap_instances = analyze_overlap(ach_corpus, eng_corpus, overlap, output_file)
+        examples = iter_examples((ach_tokens, ach_offsets), (eng_tokens, eng_offsets), hits, mask, words)
+        write_examples(examples, output_file, max_examples)
 
-        unique_ach_words = len(set(word for sentence in ach_corpus for word in sentence))
-        unique_eng_words = len(set(word for sentence in eng_corpus for word in sentence))
+        unique_ach_words = len(np.unique(ach_tokens))
+        unique_eng_words = len(np.unique(eng_tokens))
 
         stats[split] = {
             'total_words': total_words,
@@ -89,9 +180,10 @@ def main(data_type):
             'unique_eng_words': unique_eng_words,
             'overlap_types': len(overlap),
             'overlap_instances': overlap_instances,
+            'overlap_lines': int(np.count_nonzero(hits)),
             'overlap_types_percent': (len(overlap) / unique_ach_words) * 100 if unique_ach_words > 0 else 0,
             'overlap_instances_percent': (overlap_instances / total_words) * 100 if total_words > 0 else 0,
-            'top_overlap': overlap_count.most_common(10)
+            'top_overlap': top_overlap(overlap_count, words)
         }
 
     write_stats(stats, os.path.join(output_dir, "overlap_statistics.txt"), data_type)
@@ -101,5 +193,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Analyze word overlap in Acholi-English bitext.")
     parser.add_argument('--data_type', choices=['raw', 'processed'], default='raw',
                         help="Type of data to analyze: 'raw' or 'processed'")
+    parser.add_argument('--max_examples', type=int, default=MAX_EXAMPLES,
+                        help="Maximum number of overlap example lines to write per split")
     args = parser.parse_args()
-    main(args.dat
+    main(args.data_type, args.max_examples)
@@ -1,31 +1,28 @@
 import argparse
-from collections import Counter
+import os
+import sys
 from typing import Dict, Tuple
 import matplotlib.pyplot as plt
 import numpy as np
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from corpus_store import count_tokens
+
 # pip install matplotlib
 
 def analyze_vocab(filepath: str) -> Tuple[Dict[str, int], Dict[str, float]]:
     """
-    Analyze vocabulary and token frequencies in a file.
+    Analyze vocabulary and token frequencies in a file, or in a memory-mapped
+    corpus (corpus_store.py) by counting its token IDs.
     
     Returns:
         Tuple containing:
         - Dictionary with basic stats
         - Dictionary with frequency distribution
     """
-    # Read file and collect statistics
-    tokens = []
-    token_count = 0
-    with open(filepath, 'r', encoding='utf-8') as f:
-        for line in f:
-            line_tokens = line.strip().split()
-            tokens.extend(line_tokens)
-            token_count += len(line_tokens)
-    
     # Count unique tokens
-    token_freqs = Counter(tokens)
+    token_freqs = count_tokens(filepath)
+    token_count = sum(token_freqs.values())
     
     # Calculate statistics
     stats = {
@@ -18,19 +18,30 @@ TEST_SRC=$PROJECT_DIR/onmt_data/test.bpe.ach
 OUTPUT_DIR=$PROJECT_DIR/onmt_data/test_translations
 mkdir -p $OUTPUT_DIR
 
+# Sort the source by length so batches can be filled up to a token budget
+python $PROJECT_DIR/length_batching.py report --src $TEST_SRC --batch-size 32 --max-tokens 2048
+python $PROJECT_DIR/length_batching.py sort \
+    --src $TEST_SRC \
+    --output $OUTPUT_DIR/test.sorted.bpe.ach \
+    --order $OUTPUT_DIR/test.order.npy
+
 # Translate
 onmt_translate \
     -model $MODEL_PATH \
-    -src $TEST_SRC \
-    -output $OUTPUT_DIR/predictions.txt \
+    -src $OUTPUT_DIR/test.sorted.bpe.ach \
+    -output $OUTPUT_DIR/predictions.sorted.txt \
     -gpu 0 \
-    -batch_size 32 \
+    -batch_type tokens \
+    -batch_size 2048 \
     -beam_size 5 \
     -replace_unk
 
-# Remove BPE
-sed -i 's/@@ //g' $OUTPUT_DIR/predictions.txt
-
-# Calculate BLEU if you have references
-sacrebleu $PROJECT_DIR/processed_data_moses/salt.test.tk.lc.eng \
-    < $OUTPUT_DIR/predictions.txt > $OUTPUT_DIR/bleu_score.txt
\ No newline at end of file
+# Restore the original sentence order, remove BPE and score in one pipe;
+# the de-BPE'd predictions are written as a side output by tee
+python $PROJECT_DIR/length_batching.py restore \
+    --hyp $OUTPUT_DIR/predictions.sorted.txt \
+    --order $OUTPUT_DIR/test.order.npy \
+    --output /dev/stdout \
+    | sed -u 's/@@ //g' \
+    | tee $OUTPUT_DIR/predictions.txt \
+    | sacrebleu $PROJECT_DIR/processed_data_moses/salt.test.tk.lc.eng -m bleu chrf > $OUTPUT_DIR/bleu_score.txt
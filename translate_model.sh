@@ -37,19 +37,37 @@ python -c "import torch; print('CUDA available:', torch.cuda.is_available())"
 
 echo "Starting translation with OpenNMT-py"
 
+# Sort the source by length so batches can be filled up to a token budget
+python $PROJECT_DIR/length_batching.py report --src $TEST_SRC --batch-size 32 --max-tokens 2048 \
+    | tee $LOG_DIR/batching.log
+python $PROJECT_DIR/length_batching.py sort \
+    --src $TEST_SRC \
+    --output $OUTPUT_DIR/test.sorted.bpe \
+    --order $OUTPUT_DIR/test.order.npy
+
 # Translation command
+START_TIME=$(date +%s)
 onmt_translate \
     -model $MODEL_PATH \
-    -src $TEST_SRC \
-    -output $OUTPUT_FILE \
+    -src $OUTPUT_DIR/test.sorted.bpe \
+    -output $OUTPUT_FILE.sorted \
     -gpu 0 \
-    -batch_size 32 \
+    -batch_type tokens \
+    -batch_size 2048 \
     -beam_size 5 \
     -replace_unk \
     2>&1 | tee $LOG_DIR/translation.log
+echo "Decoding took $(( $(date +%s) - START_TIME )) seconds" | tee -a $LOG_DIR/batching.log
+
+# Restore the original sentence order and remove BPE in one pass
+python $PROJECT_DIR/length_batching.py restore \
+    --hyp $OUTPUT_FILE.sorted \
+    --order $OUTPUT_DIR/test.order.npy \
+    --output /dev/stdout \
+    | sed -u 's/@@ //g' > $OUTPUT_FILE
 
 ## Some parameters that can be adjusted:
-## batch_size: Number of sentences to translate at once
+## batch_size: Number of tokens per batch (with -batch_type tokens); use -batch_type sents to count sentences
 ## beam_size: Size of beam search (larger = potentially better but slower)
 ## replace_unk: Replaces unknown tokens with source tokens
 ## Add -n_best 3 for multiple translations per sentence
@@ -58,10 +76,7 @@ onmt_translate \
 # If you have reference translations, calculate BLEU score
 if [ -f "$GOLD_FILE" ]; then
     echo "Calculating BLEU score..."
-    # First, remove BPE
-    sed -i 's/@@ //g' $OUTPUT_FILE
-    
-    # Calculate BLEU using sacrebleu
+    # Calculate BLEU using sacrebleu (BPE was removed when the order was restored)
     cat $OUTPUT_FILE | sacrebleu $GOLD_FILE --width 2 > $LOG_DIR/bleu_score.txt
     echo "BLEU score saved to $LOG_DIR/bleu_score.txt"
 fi
@@ -0,0 +1,203 @@
+"""
+translation_cache.py contains a persistent translation memory for decoder output.
+
+Entries are keyed by (model checkpoint hash, decode options, BPE source line), so
+repeated sweeps, bootstrap runs and translate jobs only send source lines that
+have not been decoded with the same model and settings before to onmt_translate.
+The cache is a single SQLite file and is trimmed to a maximum size by evicting
+the least recently used entries.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# SQLite limits the number of parameters per statement
+_QUERY_CHUNK = 500
+
+
+class TranslationCache:
+    _model_hashes: Dict[Tuple[str, int, float], str] = {}
+
+    def __init__(self, db_path: str = "translation_cache.sqlite", max_size_mb: float = 512) -> None:
+        """
+        Open (or create) a translation cache.
+
+        Args:
+            db_path: Path to the SQLite cache file
+            max_size_mb: Size limit for cached source/hypothesis text; the least
+                recently used entries are evicted once it is exceeded
+        """
+        self.db_path = db_path
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connect()
+
+    def _connect(self) -> None:
+        # Worker processes may write to the same file, wait for their locks. The
+        # connection may be used from a decoder thread, but never concurrently
+        self.conn = sqlite3.connect(self.db_path, timeout=60, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            "key TEXT PRIMARY KEY, hypothesis TEXT NOT NULL, "
+            "size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON translations (last_used)")
+        self.conn.commit()
+
+    def __getstate__(self) -> dict:
+        # Connections cannot be pickled; every process opens its own
+        state = self.__dict__.copy()
+        del state['conn']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._connect()
+
+    @classmethod
+    def model_hash(cls, model_path) -> str:
+        """SHA-256 of a checkpoint file, memoized on (path, size, mtime).
+
+        A list of checkpoints (an ensemble) hashes to the combination of its members.
+        """
+        if isinstance(model_path, (list, tuple)):
+            if len(model_path) == 1:
+                return cls.model_hash(model_path[0])
+            combined = '+'.join(cls.model_hash(path) for path in model_path)
+            return hashlib.sha256(combined.encode('utf-8')).hexdigest()
+        if not os.path.isfile(model_path):
+            # Not a single checkpoint file, fall back to its resolved path
+            return hashlib.sha256(os.path.abspath(model_path).encode('utf-8')).hexdigest()
+        stat = os.stat(model_path)
+        memo_key = (os.path.abspath(model_path), stat.st_size, stat.st_mtime)
+        if memo_key not in cls._model_hashes:
+            digest = hashlib.sha256()
+            with open(model_path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+            cls._model_hashes[memo_key] = digest.hexdigest()
+        return cls._model_hashes[memo_key]
+
+    @staticmethod
+    def _entry_key(model_hash: str, options: dict, src_line: str) -> str:
+        options_key = json.dumps(options, sort_keys=True)
+        return hashlib.sha1(f"{model_hash}\t{options_key}\t{src_line}".encode('utf-8')).hexdigest()
+
+    def lookup(self, model_hash: str, options: dict, src_lines: List[str]) -> List[Optional[str]]:
+        """Return the cached hypothesis for every source line, None for misses."""
+        keys = [self._entry_key(model_hash, options, line) for line in src_lines]
+        found = {}
+        unique_keys = list(set(keys))
+        for start in range(0, len(unique_keys), _QUERY_CHUNK):
+            chunk = unique_keys[start:start + _QUERY_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT key, hypothesis FROM translations WHERE key IN ({placeholders})", chunk)
+            found.update(rows)
+
+        if found:
+            now = time.time()
+            self.conn.executemany("UPDATE translations SET last_used = ? WHERE key = ?",
+                                  [(now, key) for key in found])
+            self.conn.commit()
+
+        hypotheses = [found.get(key) for key in keys]
+        n_hits = sum(hyp is not None for hyp in hypotheses)
+        self.hits += n_hits
+        self.misses += len(hypotheses) - n_hits
+        return hypotheses
+
+    def store(self, model_hash: str, options: dict, src_lines: List[str], hypotheses: List[str]) -> None:
+        """Add decoded lines to the cache and evict old entries if it grew too large."""
+        now = time.time()
+        rows = [(self._entry_key(model_hash, options, src), hyp, len(src) + len(hyp), now)
+                for src, hyp in zip(src_lines, hypotheses)]
+        self.conn.executemany("INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)", rows)
+        self.conn.commit()
+        self.evict()
+
+    def size(self) -> int:
+        """Total size of the cached text in bytes (approximate, in characters)."""
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM translations").fetchone()[0]
+
+    def evict(self) -> int:
+        """Delete least recently used entries until the cache is within its size limit."""
+        excess = self.size() - self.max_size
+        if excess <= 0:
+            return 0
+        removed, freed = 0, 0
+        doomed = []
+        for key, size in self.conn.execute("SELECT key, size FROM translations ORDER BY last_used"):
+            doomed.append((key,))
+            freed += size
+            removed += 1
+            if freed >= excess:
+                break
+        self.conn.executemany("DELETE FROM translations WHERE key = ?", doomed)
+        self.conn.commit()
+        self.evicted += removed
+        return removed
+
+    def translate(self,
+                  model_path,
+                  options: dict,
+                  src_lines: List[str],
+                  decode_fn: Callable[[List[str]], List[str]],
+                  on_hit: Optional[Callable[[int, str], None]] = None) -> List[str]:
+        """
+        Translate src_lines, decoding only the lines that are not cached.
+
+        Args:
+            model_path: Checkpoint (or list of ensembled checkpoints) used for
+                decoding, hashed for the cache key
+            options: Decode options that affect the output (e.g. beam size)
+            src_lines: BPE-encoded source lines
+            decode_fn: Called with the list of uncached (unique) source lines,
+                must return one hypothesis per line in the same order
+            on_hit: Optional callback, called with (index, hypothesis) for every
+                cached line before the misses are decoded
+
+        Returns:
+            One hypothesis per source line, in the original order
+        """
+        model_hash = self.model_hash(model_path)
+        hypotheses = self.lookup(model_hash, options, src_lines)
+        if on_hit is not None:
+            for i, hyp in enumerate(hypotheses):
+                if hyp is not None:
+                    on_hit(i, hyp)
+
+        missing = list(dict.fromkeys(src for src, hyp in zip(src_lines, hypotheses) if hyp is None))
+        if missing:
+            decoded = decode_fn(missing)
+            self.store(model_hash, options, missing, decoded)
+            translations = dict(zip(missing, decoded))
+            hypotheses = [hyp if hyp is not None else translations[src]
+                          for src, hyp in zip(src_lines, hypotheses)]
+        return hypotheses
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def report(self) -> dict:
+        """Lookup statistics since the cache was opened."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate(),
+            'evicted': self.evicted,
+            'size_bytes': self.size(),
+        }
+
+    def close(self) -> None:
+        self.conn.close()
@@ -0,0 +1,270 @@
+"""
+translator_backends.py contains the decoders used by batch_translate.py and
+bootstrap_evaluation.py.
+
+A TranslatorBackend turns BPE source lines into output lines for one or more
+model checkpoints. Two implementations are provided:
+    - OpenNMTBackend runs the onmt_translate CLI, piping the source in and the
+      translations out
+    - LocalBackend is a fast, deterministic stand-in (identity or word
+      dictionary) with a configurable artificial latency, so the sweep,
+      bootstrap, caching and batching code can be run and benchmarked on
+      machines without GPUs or OpenNMT
+"""
+import argparse
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, List, Optional
+
+from instrumentation import ChildMemoryWatcher
+
+BACKENDS = ('onmt', 'local')
+
+
+class TranslatorBackend(ABC):
+    """Interface of a decoder backend."""
+
+    def __init__(self) -> None:
+        # Peak memory of the decoder during the last translate call, in bytes
+        self.peak_rss = 0
+
+    @property
+    @abstractmethod
+    def name(self) -> str:
+        """Backend name used in messages and --backend (a class attribute in subclasses)."""
+
+    @property
+    @abstractmethod
+    def cache_options(self) -> dict:
+        """Options that make this backend's output differ, added to translation cache keys."""
+
+    @abstractmethod
+    def translate(self,
+                  model_paths: List[str],
+                  src_lines: List[str],
+                  beam_size: int = 5,
+                  batch_size: int = 32,
+                  batch_type: str = "sents",
+                  n_best: int = 1,
+                  threads: Optional[int] = None) -> Iterator[str]:
+        """
+        Translate source lines and yield the output lines in input order.
+
+        Args:
+            model_paths: Checkpoints to decode with; several are decoded as an ensemble
+            src_lines: BPE source lines
+            beam_size: Beam size
+            batch_size: Sentences per batch, or tokens per batch with batch_type "tokens"
+            batch_type: "sents" or "tokens"
+            n_best: Output lines per sentence; with n_best > 1 every line is
+                "hypothesis<TAB>score"
+            threads: CPU threads of the decoder, None keeps the default
+        """
+
+
+class OpenNMTBackend(TranslatorBackend):
+    name = 'onmt'
+
+    def __init__(self, gpu: str = "0", replace_unk: bool = True) -> None:
+        """
+        Decode with the onmt_translate CLI.
+
+        Args:
+            gpu: GPU device passed to -gpu ("-1" decodes on the CPU)
+            replace_unk: Pass -replace_unk
+        """
+        super().__init__()
+        self.gpu = gpu
+        self.replace_unk = replace_unk
+
+    @property
+    def cache_options(self) -> dict:
+        return {'replace_unk': self.replace_unk}
+
+    def command(self,
+                model_paths: List[str],
+                beam_size: int,
+                batch_size: int,
+                batch_type: str,
+                n_best: int) -> List[str]:
+        """The onmt_translate command line, reading stdin and writing stdout."""
+        cmd = [
+            "onmt_translate",
+            "-model", *model_paths,
+            "-src", "/dev/stdin",
+            "-output", "/dev/stdout",
+            "-batch_size", str(batch_size),
+            "-batch_type", batch_type,
+            "-beam_size", str(beam_size),
+        ]
+        if self.gpu not in (None, "", "-1"):
+            cmd += ["-gpu", str(self.gpu)]
+        if self.replace_unk:
+            cmd.append("-replace_unk")
+        if n_best > 1:
+            cmd += ["-n_best", str(n_best), "-with_score"]
+        return cmd
+
+    def translate(self,
+                  model_paths: List[str],
+                  src_lines: List[str],
+                  beam_size: int = 5,
+                  batch_size: int = 32,
+                  batch_type: str = "sents",
+                  n_best: int = 1,
+                  threads: Optional[int] = None) -> Iterator[str]:
+        """Run onmt_translate; raises subprocess.CalledProcessError if it fails."""
+        cmd = self.command(model_paths, beam_size, batch_size, batch_type, n_best)
+        env = None
+        if threads:
+            env = {**os.environ, 'OMP_NUM_THREADS': str(threads), 'MKL_NUM_THREADS': str(threads)}
+
+        self.peak_rss = 0
+        memory = None
+        # The log goes to a file, so a chatty decoder cannot block on a full pipe
+        with tempfile.TemporaryFile('w+', encoding='utf-8') as log, \
+             subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=log,
+                              env=env, text=True, encoding='utf-8') as process:
+            memory = ChildMemoryWatcher(process.pid)
+
+            def feed() -> None:
+                try:
+                    for line in src_lines:
+                        process.stdin.write(line + '\n')
+                except BrokenPipeError:
+                    # The decoder died, its return code and log tell why
+                    pass
+                finally:
+                    try:
+                        process.stdin.close()
+                    except BrokenPipeError:
+                        pass
+
+            writer = threading.Thread(target=feed, daemon=True)
+            writer.start()
+            try:
+                for line in process.stdout:
+                    yield line.rstrip('\n')
+            except GeneratorExit:
+                # The caller stopped reading, don't wait for the rest of the decode
+                process.kill()
+                raise
+            finally:
+                writer.join()
+                process.wait()
+                self.peak_rss = memory.stop()
+            if process.returncode != 0:
+                log.seek(0)
+                raise subprocess.CalledProcessError(process.returncode, cmd, stderr=log.read())
+
+
+class LocalBackend(TranslatorBackend):
+    name = 'local'
+
+    def __init__(self,
+                 dictionary: Optional[str] = None,
+                 latency_ms: float = 0.0,
+                 startup_ms: float = 0.0) -> None:
+        """
+        Deterministic stand-in decoder without a model.
+
+        Every source token is replaced by its dictionary entry (tokens missing
+        from the dictionary are copied, so without a dictionary the backend
+        is the identity). The k-th n-best candidate drops the last k tokens
+        and gets the score -k.
+
+        Args:
+            dictionary: Optional file with "source<TAB>target" token pairs
+            latency_ms: Artificial decoding time per source token and beam
+                hypothesis, slept once per batch
+            startup_ms: Artificial model loading time per translate call
+        """
+        super().__init__()
+        self.dictionary_path = dictionary
+        self.latency_ms = latency_ms
+        self.startup_ms = startup_ms
+        self.dictionary: Dict[str, str] = {}
+        if dictionary:
+            with open(dictionary, 'r', encoding='utf-8') as f:
+                for line in f:
+                    source, _, target = line.rstrip('\n').partition('\t')
+                    if source:
+                        self.dictionary[source] = target or source
+
+    @property
+    def cache_options(self) -> dict:
+        return {'backend': self.name, 'dictionary': self.dictionary_path}
+
+    def _batches(self, src_lines: List[str], batch_size: int, batch_type: str) -> Iterator[List[str]]:
+        batch, tokens = [], 0
+        for line in src_lines:
+            length = len(line.split())
+            if batch and (len(batch) >= batch_size if batch_type == "sents"
+                          else tokens + length > batch_size):
+                yield batch
+                batch, tokens = [], 0
+            batch.append(line)
+            tokens += length
+        if batch:
+            yield batch
+
+    def translate(self,
+                  model_paths: List[str],
+                  src_lines: List[str],
+                  beam_size: int = 5,
+                  batch_size: int = 32,
+                  batch_type: str = "sents",
+                  n_best: int = 1,
+                  threads: Optional[int] = None) -> Iterator[str]:
+        """Translate token by token, sleeping to simulate the decoder's latency."""
+        self.peak_rss = 0
+        if self.startup_ms:
+            time.sleep(self.startup_ms / 1000)
+        for batch in self._batches(src_lines, max(batch_size, 1), batch_type):
+            if self.latency_ms:
+                tokens = sum(len(line.split()) for line in batch)
+                time.sleep(self.latency_ms * tokens * beam_size / 1000)
+            for line in batch:
+                target = [self.dictionary.get(token, token) for token in line.split()]
+                if n_best == 1:
+                    yield ' '.join(target)
+                    continue
+                for k in range(n_best):
+                    candidate = target[:len(target) - k] if k < len(target) else target
+                    yield f"{' '.join(candidate)}\t{-float(k)}"
+
+
+def make_backend(name: str = 'onmt',
+                 gpu: str = "0",
+                 dictionary: Optional[str] = None,
+                 latency_ms: float = 0.0,
+                 startup_ms: float = 0.0) -> TranslatorBackend:
+    """Create a backend by name; the remaining options apply to one backend only."""
+    if name == 'onmt':
+        return OpenNMTBackend(gpu)
+    if name == 'local':
+        return LocalBackend(dictionary, latency_ms, startup_ms)
+    raise ValueError(f"Unknown translator backend: {name}")
+
+
+def add_backend_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the --backend, --gpu and local backend options to a command line parser."""
+    parser.add_argument('--backend', choices=BACKENDS, default='onmt',
+                        help='Decoder: onmt_translate, or a local stand-in that needs no model or GPU')
+    parser.add_argument('--gpu', default="0", help='GPU device for onmt_translate ("-1" for CPU)')
+    parser.add_argument('--local-dictionary', default=None,
+                        help='"source<TAB>target" token dictionary of the local backend (identity without)')
+    parser.add_argument('--local-latency-ms', type=float, default=0.0,
+                        help='Artificial latency of the local backend per token and beam hypothesis')
+    parser.add_argument('--local-startup-ms', type=float, default=0.0,
+                        help='Artificial model loading time of the local backend per call')
+
+
+def backend_from_args(args: argparse.Namespace) -> TranslatorBackend:
+    """Create the backend selected with the options of add_backend_arguments."""
+    return make_backend(args.backend, args.gpu, args.local_dictionary,
+                        args.local_latency_ms, args.local_startup_ms)
@@ -0,0 +1,257 @@
+"""
+vocab_check.py contains a fast coverage precheck of input data against BPE codes
+and OpenNMT vocabularies, run before onmt_train or onmt_translate is launched.
+
+The codes file and vocab files are loaded into sets and the input is streamed
+(BPE is applied on the fly unless the input is already encoded). The check
+reports:
+    - the unknown-subword rate: subword tokens missing from the vocab, which
+      the model only sees as <unk>
+    - the OOV rate: words with at least one unknown subword
+    - fragmentation: subwords per word and the share of single-character
+      subwords; both jump when the codes were learned on another language
+    - codes/vocab consistency: vocab entries the codes can never produce
+    - language mismatch: with the vocab of the other side, whether the input
+      fits that vocab better than its own
+Any value beyond its threshold is a problem and precheck raises VocabCheckError.
+Fragmentation depends on the merge count, so it is only a problem when a limit
+is set; otherwise a high value is logged as a warning.
+"""
+import argparse
+import sys
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Set
+from subword_nmt.apply_bpe import BPE
+
+BPE_SEPARATOR = '@@'
+END_OF_WORD = '</w>'
+
+DEFAULT_THRESHOLDS = {
+    'max_unk_rate': 0.01,
+    'max_fragmentation': None,
+    'min_codes_coverage': 0.9,
+}
+
+# Subwords per word above which precheck warns when no fragmentation limit is set
+FRAGMENTATION_WARNING = 2.0
+
+
+class VocabCheckError(ValueError):
+    """Raised when the input does not fit the codes or vocabulary."""
+
+
+def load_codes(codes_path: str) -> Set[str]:
+    """Symbols created by the merges of a subword-nmt codes file (final symbols end with </w>)."""
+    symbols = set()
+    with open(codes_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('#version'):
+                continue
+            pair = line.rstrip('\r\n').split(' ')
+            if len(pair) == 2:
+                symbols.add(pair[0] + pair[1])
+    return symbols
+
+
+def load_vocab(vocab_path: str) -> Set[str]:
+    """Tokens of an OpenNMT vocab file ("token<TAB>count" per line, or one token per line)."""
+    with open(vocab_path, 'r', encoding='utf-8') as f:
+        return {line.split()[0] for line in f if line.strip()}
+
+
+def codes_coverage(codes_symbols: Set[str], vocab: Set[str]) -> float:
+    """Share of the vocab's subword tokens that the codes can produce.
+
+    Single characters are always producible; a vocab built from other codes
+    (or another language) contains many multi-character subwords these codes
+    never create.
+    """
+    producible = total = 0
+    for token in vocab:
+        if token.startswith('<') and token.endswith('>'):
+            # Special tokens such as <unk> and <blank>
+            continue
+        symbol = token[:-len(BPE_SEPARATOR)] if token.endswith(BPE_SEPARATOR) else token + END_OF_WORD
+        total += 1
+        if len(symbol.replace(END_OF_WORD, '')) <= 1 or symbol in codes_symbols:
+            producible += 1
+    return producible / total if total else 1.0
+
+
+def _stream(input_path: str, max_lines: Optional[int]) -> Iterator[str]:
+    with open(input_path, 'r', encoding='utf-8') as f:
+        for i, line in enumerate(f):
+            if max_lines is not None and i >= max_lines:
+                break
+            yield line
+
+
+def check_coverage(input_path: str,
+                   codes_path: Optional[str] = None,
+                   vocab_path: Optional[str] = None,
+                   other_vocab_path: Optional[str] = None,
+                   encoded: bool = False,
+                   max_lines: Optional[int] = None) -> Dict[str, object]:
+    """
+    Measure how well the input fits the BPE codes and vocabulary.
+
+    Args:
+        input_path: Tokenized text, or BPE-encoded text with encoded=True
+        codes_path: BPE codes; required unless the input is already encoded
+        vocab_path: OpenNMT vocab of the input's side (src vocab for source text)
+        other_vocab_path: Optional vocab of the other side, to detect language mismatch
+        encoded: The input is already BPE-encoded
+        max_lines: Only check the first max_lines lines
+
+    Returns:
+        Dictionary with the line, word and subword counts and the rates above
+    """
+    if not encoded and codes_path is None:
+        raise ValueError("BPE codes are needed to encode the input")
+    start_time = time.time()
+    bpe = None
+    if not encoded:
+        with open(codes_path, 'r', encoding='utf-8') as codes_file:
+            bpe = BPE(codes_file)
+    vocab = load_vocab(vocab_path) if vocab_path else None
+    other_vocab = load_vocab(other_vocab_path) if other_vocab_path else None
+
+    lines = words = subwords = single_chars = 0
+    unk_subwords = oov_words = other_unk_subwords = 0
+    for line in _stream(input_path, max_lines):
+        tokens = line.split() if encoded else bpe.segment_tokens(line.split())
+        lines += 1
+        subwords += len(tokens)
+        word_unknown = False
+        for token in tokens:
+            base = token[:-len(BPE_SEPARATOR)] if token.endswith(BPE_SEPARATOR) else token
+            if len(base) == 1:
+                single_chars += 1
+            if vocab is not None and token not in vocab:
+                unk_subwords += 1
+                word_unknown = True
+            if other_vocab is not None and token not in other_vocab:
+                other_unk_subwords += 1
+            if not token.endswith(BPE_SEPARATOR):
+                # Last subword of a word
+                words += 1
+                oov_words += word_unknown
+                word_unknown = False
+
+    report = {
+        'input': input_path,
+        'lines': lines,
+        'words': words,
+        'subwords': subwords,
+        'fragmentation': subwords / words if words else 0.0,
+        'single_char_rate': single_chars / subwords if subwords else 0.0,
+    }
+    if vocab is not None:
+        report['vocab_size'] = len(vocab)
+        report['unk_rate'] = unk_subwords / subwords if subwords else 0.0
+        report['oov_rate'] = oov_words / words if words else 0.0
+        if codes_path is not None:
+            report['codes_coverage'] = codes_coverage(load_codes(codes_path), vocab)
+    if other_vocab is not None:
+        report['other_unk_rate'] = other_unk_subwords / subwords if subwords else 0.0
+    report['time_taken'] = time.time() - start_time
+    return report
+
+
+def find_problems(report: Dict[str, object],
+                  max_unk_rate: float = DEFAULT_THRESHOLDS['max_unk_rate'],
+                  max_fragmentation: Optional[float] = DEFAULT_THRESHOLDS['max_fragmentation'],
+                  min_codes_coverage: float = DEFAULT_THRESHOLDS['min_codes_coverage']) -> List[str]:
+    """Describe every value of a check_coverage report that is beyond its threshold."""
+    problems = []
+    if report['lines'] == 0:
+        problems.append(f"{report['input']} is empty")
+        return problems
+    if max_fragmentation is not None and report['fragmentation'] > max_fragmentation:
+        problems.append(f"{report['fragmentation']:.2f} subwords per word (max {max_fragmentation:g}), "
+                        f"{report['single_char_rate']:.1%} single characters: the codes do not fit this text")
+    if 'unk_rate' in report and report['unk_rate'] > max_unk_rate:
+        problems.append(f"{report['unk_rate']:.2%} of the subwords are not in the vocab "
+                        f"(max {max_unk_rate:.2%}), {report['oov_rate']:.2%} of the words are affected")
+    if 'codes_coverage' in report and report['codes_coverage'] < min_codes_coverage:
+        problems.append(f"only {report['codes_coverage']:.1%} of the vocab can be produced by the codes "
+                        f"(min {min_codes_coverage:.0%}): codes and vocab come from different data")
+    if 'other_unk_rate' in report and 'unk_rate' in report and report['other_unk_rate'] < report['unk_rate']:
+        problems.append(f"the input fits the other side's vocab better ({report['other_unk_rate']:.2%} "
+                        f"vs {report['unk_rate']:.2%} unknown subwords): wrong language?")
+    return problems
+
+
+def print_report(report: Dict[str, object], log: Callable[[str], None] = print) -> None:
+    """Log the measured rates of a check_coverage report."""
+    summary = (f"{report['input']}: {report['lines']} lines, {report['words']} words, "
+               f"{report['fragmentation']:.2f} subwords/word, {report['single_char_rate']:.1%} single characters")
+    if 'unk_rate' in report:
+        summary += f", unknown subwords {report['unk_rate']:.2%}, OOV words {report['oov_rate']:.2%}"
+    if 'codes_coverage' in report:
+        summary += f", codes cover {report['codes_coverage']:.1%} of the vocab"
+    if 'other_unk_rate' in report:
+        summary += f", unknown in the other vocab {report['other_unk_rate']:.2%}"
+    log(summary + f" ({report['time_taken']:.2f}s)")
+
+
+def precheck(input_path: str,
+             codes_path: Optional[str] = None,
+             vocab_path: Optional[str] = None,
+             other_vocab_path: Optional[str] = None,
+             encoded: bool = False,
+             max_lines: Optional[int] = None,
+             thresholds: Optional[Dict[str, float]] = None,
+             log: Callable[[str], None] = print) -> Dict[str, object]:
+    """
+    Run check_coverage, log the report and raise VocabCheckError if anything is
+    beyond its threshold (see DEFAULT_THRESHOLDS).
+    """
+    thresholds = {**DEFAULT_THRESHOLDS, **(thresholds or {})}
+    report = check_coverage(input_path, codes_path, vocab_path, other_vocab_path, encoded, max_lines)
+    print_report(report, log)
+    if thresholds['max_fragmentation'] is None and report['fragmentation'] > FRAGMENTATION_WARNING:
+        log(f"Warning: {report['fragmentation']:.2f} subwords per word, {report['single_char_rate']:.1%} "
+            f"single characters: few merges, or codes learned on other data")
+    problems = find_problems(report, **thresholds)
+    if problems:
+        raise VocabCheckError(f"{input_path} failed the vocabulary check: " + "; ".join(problems))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check BPE/vocabulary coverage of input data before training or translation')
+    parser.add_argument('--input', required=True, nargs='+', help='Tokenized (or, with --encoded, BPE-encoded) files')
+    parser.add_argument('--codes', default=None, help='BPE codes file')
+    parser.add_argument('--vocab', default=None, help='OpenNMT vocab of the input side')
+    parser.add_argument('--other-vocab', default=None, help='OpenNMT vocab of the other side (detects a wrong language)')
+    parser.add_argument('--encoded', action='store_true', help='The input is already BPE-encoded')
+    parser.add_argument('--max-lines', type=int, default=None, help='Only check the first N lines of each file')
+    parser.add_argument('--max-unk-rate', type=float, default=DEFAULT_THRESHOLDS['max_unk_rate'],
+                        help='Maximum share of subwords missing from the vocab')
+    parser.add_argument('--max-fragmentation', type=float, default=DEFAULT_THRESHOLDS['max_fragmentation'],
+                        help='Maximum subwords per word (default: only warn above '
+                             f'{FRAGMENTATION_WARNING:g})')
+    parser.add_argument('--min-codes-coverage', type=float, default=DEFAULT_THRESHOLDS['min_codes_coverage'],
+                        help='Minimum share of vocab entries the codes can produce')
+    args = parser.parse_args()
+
+    thresholds = {'max_unk_rate': args.max_unk_rate, 'max_fragmentation': args.max_fragmentation,
+                  'min_codes_coverage': args.min_codes_coverage}
+    failed = False
+    for input_path in args.input:
+        try:
+            precheck(input_path, args.codes, args.vocab, args.other_vocab, args.encoded,
+                     args.max_lines, thresholds)
+        except VocabCheckError as e:
+            print(f"FAILED: {e}", file=sys.stderr)
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
+
+# Example:
+# python vocab_check.py --input processed_data_moses/salt.test.tk.lc.ach \
+#     --codes onmt_data/data.ach.codes --vocab onmt_data/data.vocab.ach --other-vocab onmt_data/data.vocab.en